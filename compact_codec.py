@@ -0,0 +1,157 @@
+# ==============================================================================
+# About: compact_codec.py
+# ==============================================================================
+#
+# compact_codec.py contains the compact encodings of the livestream columns that used to be json text
+# - ViewerCounts - a viewer_counts BLOB that's only decoded when it's read
+# - encode_viewer_counts() / decode_viewer_counts() - viewer series as a delta-encoded, array-packed BLOB
+# - get_tag_set_id() / get_tag_set_text() - a set of tag_ids as one integer id into the tag_sets table
+#
+# viewer_counts BLOB layout:
+#   byte 0      - VIEWER_COUNTS_FORMAT
+#   byte 1      - the array typecode of the deltas ('b', 'h', 'i' or 'q'), the narrowest one all of them fit in
+#   varint      - the first viewer count, zigzag encoded
+#   the rest    - the differences between consecutive viewer counts, packed little-endian with array.tobytes()
+# viewer counts change slowly between snapshots, so most deltas fit in 1 byte instead of the ~6 bytes of json text,
+# and packing/unpacking with array and itertools.accumulate stays in C instead of a python loop per value.
+#
+# tag_set_id is a stable 64 bit hash of the sorted tag_ids, so it can be computed without a lookup,
+# and a write that's rolled back can't leave a cached id that points at a different tag set.
+# the text of each tag set is stored once, in the tag_sets table.
+#
+# Rows written before this encoding still hold json text, every decode function takes both.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import json
+import array
+import hashlib
+import itertools
+
+
+# Constants --------------------------------------------------------------------
+
+# first byte of every viewer_counts BLOB, a new layout gets a new number
+VIEWER_COUNTS_FORMAT = 1
+
+# the typecodes deltas can be packed with, narrowest first, with the range of values each one holds
+DELTA_TYPECODES = [('b', 2 ** 7), ('h', 2 ** 15), ('i', 2 ** 31), ('q', 2 ** 63)]
+
+
+# ==============================================================================
+# Class: ViewerCounts
+# ==============================================================================
+
+# a viewer_counts value read from the db, it's only decoded the first time its values are used
+# -> len() doesn't decode, so readers that only need the number of snapshots never unpack the deltas
+# -> holds either a BLOB or, for rows written before the compact encoding, json text
+class ViewerCounts():
+
+    def __init__(self, value):
+        self.value  = value
+        self.counts = None # <- the decoded list, once it has been read
+        return
+
+    def __len__(self):
+        if (self.counts is not None):
+            return len(self.counts)
+        if ((isinstance(self.value, bytes)) and (len(self.value) > 2)):
+            first, offset = decode_varint(self.value, 2)
+            return 1 + (len(self.value) - offset) // array.array(chr(self.value[1])).itemsize
+        return len(self.get())
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __getitem__(self, i):
+        return self.get()[i]
+
+    def get(self):
+        if (self.counts is None):
+            self.counts = decode_viewer_counts(self.value)
+        return self.counts
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+# Viewer Counts ----------------------------------------------------------------
+
+# returns viewer_counts (a list of ints) as a BLOB, see the layout above
+def encode_viewer_counts(viewer_counts):
+    if (len(viewer_counts) == 0):
+        return bytes([VIEWER_COUNTS_FORMAT, ord('b')])
+
+    deltas = [b - a for a, b in zip(viewer_counts, viewer_counts[1:])]
+    largest = max([max(deltas), -min(deltas) - 1]) if (len(deltas) > 0) else 0
+    for typecode, limit in DELTA_TYPECODES:
+        if (largest < limit):
+            break
+    packed = array.array(typecode, deltas)
+    if (sys.byteorder == 'big'):
+        packed.byteswap()
+    return bytes([VIEWER_COUNTS_FORMAT, ord(typecode)]) + encode_varint(zigzag(viewer_counts[0])) + packed.tobytes()
+
+# returns the list of viewer counts in a viewer_counts value, which is either a BLOB or json text (rows written before the BLOB)
+def decode_viewer_counts(value):
+    if (value is None):
+        return []
+    if (isinstance(value, str)):
+        return json.loads(value)
+    if (value[0] != VIEWER_COUNTS_FORMAT):
+        raise ValueError('unknown viewer_counts format: ' + str(value[0]))
+    if (len(value) <= 2):
+        return []
+
+    first, offset = decode_varint(value, 2)
+    deltas = array.array(chr(value[1]))
+    deltas.frombytes(value[offset:])
+    if (sys.byteorder == 'big'):
+        deltas.byteswap()
+    return list(itertools.accumulate(deltas, initial = unzigzag(first)))
+
+
+# Tag Sets ---------------------------------------------------------------------
+
+# returns the id of a set of tag_ids, the same for every ordering of the same tag_ids
+# -> None or [] (a livestream without tags) is a tag set too
+def get_tag_set_id(tag_ids):
+    digest = hashlib.blake2b(get_tag_set_text(tag_ids).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True) # <- signed, so it fits in a sqlite INTEGER
+
+# returns the text a tag set is stored as in the tag_sets table
+def get_tag_set_text(tag_ids):
+    return json.dumps(sorted(tag_ids if (tag_ids is not None) else []))
+
+
+# Varints ----------------------------------------------------------------------
+
+# maps signed ints to unsigned ones so small negative numbers stay small: 0, -1, 1, -2, 2 -> 0, 1, 2, 3, 4
+def zigzag(n):
+    return (n << 1) if (n >= 0) else ((-n << 1) - 1)
+
+def unzigzag(n):
+    return (n >> 1) if (n & 1 == 0) else -((n + 1) >> 1)
+
+# returns n (an unsigned int) as a LEB128 varint, 7 bits per byte
+def encode_varint(n):
+    encoded = bytearray()
+    while (n >= 0x80):
+        encoded.append((n & 0x7f) | 0x80)
+        n >>= 7
+    encoded.append(n)
+    return bytes(encoded)
+
+# returns (n, offset of the byte after the varint) for the varint that starts at data[offset]
+def decode_varint(data, offset):
+    n, shift = 0, 0
+    while (True):
+        byte = data[offset]
+        n |= (byte & 0x7f) << shift
+        offset += 1
+        if (byte < 0x80):
+            return n, offset
+        shift += 7
@@ -3,279 +3,676 @@
 # ==============================================================================
 #
 # db_manager.py contains the SQLiteManager classes, which is responsible for all interactions with the SQLite databases
+# - SQLiteConnectionManager - opens, tunes and reuses the sqlite3 connections for one db file
 # - MixerDB  - handles all sql interactions with mixer.db
-# - TwitchDB - handles all sql interactions with twitch.db
+# - TwitchDB - handles all sql interactions with twitch.db, whose time series tables are split into monthly partitions (see partitions.py)
+#
+# The ids already in the streamers/channels, games and tags tables are kept in KnownIDSets (see known_ids.py),
+# shared by the procedures of a process and only read again from the rows added since the last refresh.
 #
 
 # Imports ----------------------------------------------------------------------
 
+import os
 import sys
 import json
 import time
+import heapq
 import sqlite3
+import hashlib
+import threading
+
+from sql_commands import *
+from partitions import *
+from compact_codec import *
+from known_ids import *
+
+
+# ==============================================================================
+# Class: SQLiteConnectionManager
+# ==============================================================================
+
+# SQLiteConnectionManager hands out the connections for one db file
+# -> the db is put in WAL mode, so readers (ie: status_checker.py) don't block the writer and the writer doesn't block readers
+# -> each thread reuses one writer connection and one read-only reader connection instead of opening new ones every phase
+# -> connections must stay on the thread that got them, call release_connection() instead of conn.close() when a phase is done
+class SQLiteConnectionManager():
+
+    # mmap_size  - bytes of the db file that are memory mapped (0 turns memory mapping off)
+    # cache_size - page cache per connection, negative values are in KiB (ie: -65536 = 64MB)
+    # temp_store - where temporary tables and indices are kept: 'DEFAULT', 'FILE' or 'MEMORY'
+    def __init__(self, filepath, timeout = 15 * 60, mmap_size = 256 * 1024 * 1024, cache_size = -64 * 1024, temp_store = 'MEMORY'):
+        self.filepath   = filepath
+        self.timeout    = timeout # <- seconds a connection waits for a lock before raising 'database is locked'
+        self.mmap_size  = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self.temp_store = temp_store
+        self.local      = threading.local() # <- holds .writer and .reader for each thread
+        self.lock       = threading.Lock()
+        self.wal_enabled = False
+        self.stats      = {'num_writers_opened': 0, 'num_readers_opened': 0, 'num_reused': 0}
+        return
+
+    # Connections --------------------------------------------------------------
+
+    # returns this thread's read/write connection
+    def get_connection(self):
+        conn = getattr(self.local, 'writer', None)
+        if (conn is not None):
+            self.__increment('num_reused')
+            return conn
+
+        conn = sqlite3.connect('file:' + os.path.abspath(self.filepath), uri = True, timeout = self.timeout, cached_statements = STATEMENT_CACHE_SIZE)
+        self.__enable_wal(conn)
+        self.__apply_pragmas(conn)
+        conn.execute('PRAGMA synchronous = NORMAL;') # <- safe with WAL, a power loss can only lose the last commits
+        conn.execute('PRAGMA recursive_triggers = ON;') # <- so the rows INSERT OR REPLACE deletes fire delete triggers (ie: twitch.db's row counters)
+        self.local.writer = conn
+        self.__increment('num_writers_opened')
+        return conn
+
+    # returns this thread's read-only connection
+    # -> in WAL mode it reads from the last commit and never waits on the writer
+    # -> it never opens a write connection, unless a WAL db's -wal/-shm files are missing (the writer creates them)
+    #    and allow_writer is True, read-only consumers (ie: status_checker.py) pass False so they never touch the journal mode
+    def get_reader_connection(self, allow_writer = True):
+        conn = getattr(self.local, 'reader', None)
+        if (conn is not None):
+            self.__increment('num_reused')
+            return conn
+
+        conn = self.__open_read_only()
+        if ((conn is None) and (allow_writer) and (not self.__has_wal_files())):
+            self.get_connection()
+            conn = self.__open_read_only()
+        if (conn is None):
+            # some platforms can't open a WAL db with mode=ro, fall back to a connection that refuses writes
+            conn = sqlite3.connect('file:' + os.path.abspath(self.filepath), uri = True, timeout = self.timeout, cached_statements = STATEMENT_CACHE_SIZE)
+            conn.execute('PRAGMA query_only = ON;')
+        self.__apply_pragmas(conn)
+        self.local.reader = conn
+        self.__increment('num_readers_opened')
+        return conn
+
+    # ends a phase of work on conn without closing it, anything that wasn't committed is rolled back
+    def release_connection(self, conn):
+        if (conn.in_transaction):
+            conn.rollback()
+
+    # closes this thread's connections (ie: before a thread exits)
+    def close_thread_connections(self):
+        for name in ['writer', 'reader']:
+            conn = getattr(self.local, name, None)
+            if (conn is not None):
+                conn.close()
+                setattr(self.local, name, None)
+
+    # Helpers ------------------------------------------------------------------
+
+    # returns a mode=ro connection, or None if it can't read the db
+    def __open_read_only(self):
+        try:
+            conn = sqlite3.connect('file:' + os.path.abspath(self.filepath) + '?mode=ro', uri = True, timeout = self.timeout, cached_statements = STATEMENT_CACHE_SIZE)
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1;')
+            return conn
+        except sqlite3.OperationalError:
+            return None
+
+    # a WAL db that no connection has open has no -wal/-shm files, and a mode=ro connection can't create them
+    def __has_wal_files(self):
+        return os.path.exists(self.filepath + '-wal') and os.path.exists(self.filepath + '-shm')
+
+    # journal_mode is saved in the db file, so it only needs to be set once
+    def __enable_wal(self, conn):
+        with self.lock:
+            if (self.wal_enabled):
+                return
+            conn.execute('PRAGMA journal_mode = WAL;')
+            self.wal_enabled = True
+
+    def __apply_pragmas(self, conn):
+        conn.execute('PRAGMA mmap_size = ' + str(self.mmap_size) + ';')
+        conn.execute('PRAGMA cache_size = ' + str(self.cache_size) + ';')
+        conn.execute('PRAGMA temp_store = ' + self.temp_store + ';')
+
+    def __increment(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
 
 
 # ==============================================================================
 # Class: MixerDBManager
 # ==============================================================================
 
+# the mixer.db tables that store (channel_id, date_scraped, value) rows
+MIXER_TIME_SERIES_TABLES = ['followers', 'lifetime_viewers', 'sparks', 'experience', 'partnered']
+
+# seconds after its followers were last scraped that a channel is due to be scraped again by the inactive procedure
+MIXER_CHANNEL_REFRESH_INTERVAL = 1 * 60 * 60 * 24 # <- 24 hours
+
 class MixerDB():
     def __init__(self):
         self.filepath = './data/mixer.db' # <- the filepath to the db file
         self.commands = self.load_commands()
+        self.connections = get_connection_manager(self.filepath)
+        self.known_ids = {
+            'channels': get_known_id_set(self.filepath, self.commands['get-all-channel-ids-mixer']),
+            'games':    get_known_id_set(self.filepath, self.commands['get-all-game-ids-mixer'])
+        }
         return
 
+    # returns the SQLCommandRegistry for mixer.db, see sql_commands.py
     def load_commands(self):
-
-        def __load_from_file(commands, filepath):
-            f = json.load(open(filepath))
-            for command_name, command_list in f.items():
-                if (len(command_list) > 1):
-                    commands[command_name] = command_list
-                else:
-                    commands[command_name] = command_list[0]
-            return commands
-
-        commands = __load_from_file({}, './sql/mixer_create.json')
-        commands = __load_from_file(commands, './sql/mixer_insert.json')
-        commands = __load_from_file(commands, './sql/mixer_select.json')
-        return commands
+        filepaths = [
+            './sql/mixer_create.json',
+            './sql/mixer_insert.json',
+            './sql/mixer_select.json'
+        ]
+        table_variants = {
+            'insert-time-series-mixer':                          MIXER_TIME_SERIES_TABLES,
+            'get-most-recent-entry-for-channel-mixer':           MIXER_TIME_SERIES_TABLES,
+            'get-most-recent-values-for-channels-mixer':         MIXER_TIME_SERIES_TABLES,
+            'confirm-time-series-mixer':                         MIXER_TIME_SERIES_TABLES,
+            'delete-time-series-row-mixer':                      MIXER_TIME_SERIES_TABLES,
+            'get-time-series-mixer':                             MIXER_TIME_SERIES_TABLES,
+            'get-time-series-ids-mixer':                         MIXER_TIME_SERIES_TABLES,
+            'add-last-confirmed-column-mixer':                   MIXER_TIME_SERIES_TABLES
+        }
+        return load_command_registry(filepaths, table_variants)
 
 
 
     # Connect ------------------------------------------------------------------
 
+    # returns this thread's read/write connection, see SQLiteConnectionManager
     def get_connection(self):
-        return sqlite3.connect(self.filepath, timeout = 1 * 60 * 15) # <- 15 minutes
+        return self.connections.get_connection()
+
+    # returns this thread's read-only connection, for phases that only read
+    # -> allow_writer = False never opens a write connection, see SQLiteConnectionManager.get_reader_connection()
+    def get_reader_connection(self, allow_writer = True):
+        return self.connections.get_reader_connection(allow_writer)
+
+    # call this instead of conn.close() when a phase is done with its connection
+    def release_connection(self, conn):
+        self.connections.release_connection(conn)
+
+    # called by the db writer before every transaction, mixer.db isn't partitioned so there's nothing to get ready
+    def prepare_write_connection(self, conn):
+        return
+
+    # returns the stats of the connections, of the command reuse estimate (see SQLCommandRegistry) and of the known id sets
+    def get_stats(self):
+        known_ids = {name: known.get_stats() for name, known in self.known_ids.items()}
+        return {'connections': self.connections.get_stats(), 'statements': self.commands.get_stats(), 'known_ids': known_ids}
 
     # Create -------------------------------------------------------------------
 
     def create_tables(self):
-        conn = sqlite3.connect(self.filepath)
+        conn = self.get_connection()
         for command in self.commands['create-tables-mixer']:
             conn.execute(command)
+        add_column_if_missing(conn, 'channels', 'profile_hash', self.commands['add-profile-hash-column-mixer'])
+        for table_name in MIXER_TIME_SERIES_TABLES:
+            add_column_if_missing(conn, table_name, 'last_confirmed', self.commands.get('add-last-confirmed-column-mixer', table_name))
         conn.commit()
-        conn.close()
+        if (conn.execute(self.commands['get-channel-work-is-empty-mixer']).fetchone()[0]):
+            self.build_channel_work(conn)
+        self.release_connection(conn)
 
 
     # Insert -------------------------------------------------------------------
+    # -> every helper takes an iterable of objects and writes them with a single executemany call
+    # -> the singular helpers (ie: insert_new_channel) are kept for callers that only have one object
+
+    # inserts channels into the channels table
+    def insert_new_channels(self, conn, channels):
+        rows = [channel.get_db_tuple('insert-channel') + (channel.get_profile_hash(), ) for channel in channels]
+        conn.executemany(self.commands['insert-new-channel-mixer'], rows)
+        conn.executemany(self.commands['insert-channel-work-mixer'], [(channel.id, channel.date_scraped) for channel in channels])
+        return
 
-    # inserts a channel into the channels table
     def insert_new_channel(self, conn, channel):
-        conn.execute(self.commands['insert-new-channel-mixer'], channel.get_db_tuple('insert-channel'))
-        return
+        self.insert_new_channels(conn, [channel])
 
 
-    # updates an existing channel entry in the data
-    def update_channel(self, conn, channel):
-        command = self.commands['update-channel-mixer'].replace('{channel_id}', str(channel.id))
-        conn.execute(command, channel.get_db_tuple('update-channel'))
+    # updates existing channel entries in the data
+    def update_channels(self, conn, channels):
+        rows = [channel.get_db_tuple('update-channel') + (channel.get_profile_hash(), channel.id) for channel in channels]
+        conn.executemany(self.commands['update-channel-mixer'], rows)
         return
 
+    def update_channel(self, conn, channel):
+        self.update_channels(conn, [channel])
+
+
+    # updates existing channels only if their profile is different from the one saved in the db
+    # -> profile_hashes is the lookup table from get_channel_profile_hashes() for the channels (None for rows saved before profile hashes existed)
+    # returns the number of channels that were updated
+    def update_channels_if_changed(self, conn, channels, profile_hashes):
+        changed_channels = []
+        for channel in channels:
+            if (channel.get_profile_hash() != profile_hashes.get(channel.id)):
+                changed_channels.append(channel)
+        self.update_channels(conn, changed_channels)
+        return len(changed_channels)
+
+    # returns True if the channel was updated
+    def update_channel_if_changed(self, conn, channel, profile_hashes):
+        return self.update_channels_if_changed(conn, [channel], profile_hashes) > 0
+
+
+    # adds data for channels into: followers, lifetime_viewers, sparks, and experience tables
+    # -> the tables are run-length time series, a value that didn't change only confirms the channel's current interval
+    def insert_time_series_data_for_channels(self, conn, channels, data_type):
+        select_command  = self.commands.get('get-most-recent-values-for-channels-mixer', data_type)
+        insert_command  = self.commands.get('insert-time-series-mixer', data_type)
+        confirm_command = self.commands.get('confirm-time-series-mixer', data_type)
+        rows = [channel.get_db_tuple(data_type) for channel in channels]
+        write_run_length_rows(conn, rows, select_command, insert_command, confirm_command)
+        if (data_type == 'followers'):
+            self.__update_refresh_due(conn, [(channel_id, date_scraped) for channel_id, date_scraped, value in rows])
+        return
 
-    # adds data for a channel into: followers, lifetime_viewers, sparks, and experience tables
     def insert_time_series_data(self, conn, channel, data_type):
-        insert_command = self.commands['insert-time-series-mixer'].replace('{table_name}', data_type)
-        conn.execute(insert_command, channel.get_db_tuple(data_type))
-        return
+        self.insert_time_series_data_for_channels(conn, [channel], data_type)
 
 
-    # adds data for a channel into data_type iff the value has changed
+    # adds data for channels into data_type iff the value has changed
     # -> typically used for partnered table
-    def insert_time_series_data_by_value(self, conn, channel, table_name):
+    # -> every time series table only stores changes now, this is kept for the callers that only write partnered
+    def insert_time_series_data_by_value_for_channels(self, conn, channels, table_name):
 
         if (table_name not in ['partnered']):
             return
 
-        tuple_to_insert = channel.get_db_tuple(table_name)
-        new_value = tuple_to_insert[2]
+        self.insert_time_series_data_for_channels(conn, channels, table_name)
+        return
 
-        # create sql statements
-        insert_command = self.commands['insert-time-series-mixer'].replace('{table_name}', table_name)
-        select_command = self.commands['get-most-recent-entry-for-channel-mixer']
-        select_command = select_command.replace('{table_name}', table_name)
-        select_command = select_command.replace('{date_column}', 'date_scraped')
-        select_command = select_command.replace('{channel_id}', str(channel.id))
-
-        # only insert this value if the value has changed
-        c = conn.execute(select_command)
-        row = c.fetchone()
-        if (row is None):
-            conn.execute(insert_command, tuple_to_insert)
-        else:
-            if (row[2] != new_value):
-                conn.execute(insert_command, tuple_to_insert)
+    def insert_time_series_data_by_value(self, conn, channel, table_name):
+        self.insert_time_series_data_by_value_for_channels(conn, [channel], table_name)
 
 
-    def insert_livestream_snapshot(self, conn, channel):
+    def insert_livestream_snapshots(self, conn, channels):
         insert_command = self.commands['insert-livestream-snapshot-mixer']
-        conn.execute(insert_command, channel.get_db_tuple('livestream_snapshots'))
+        conn.executemany(insert_command, [channel.get_db_tuple('livestream_snapshots') for channel in channels])
         return
 
-    # assumes game_stats is a StatsBucket object
-    def insert_game_snapshot(self, conn, game_stats):
+    def insert_livestream_snapshot(self, conn, channel):
+        self.insert_livestream_snapshots(conn, [channel])
+
+
+    # assumes each game_stats is a StatsBucket object
+    def insert_game_snapshots(self, conn, list_of_game_stats):
         insert_command = self.commands['insert-game-snapshot-mixer']
-        conn.execute(insert_command, game_stats.to_db_tuple())
+        conn.executemany(insert_command, [game_stats.to_db_tuple() for game_stats in list_of_game_stats])
         return
 
-    # assumes game is a MixerGame object
-    def insert_game(self, conn, game):
+    def insert_game_snapshot(self, conn, game_stats):
+        self.insert_game_snapshots(conn, [game_stats])
+
+
+    # assumes each game is a MixerGame object
+    def insert_games(self, conn, games):
         insert_command = self.commands['insert-game-mixer']
-        conn.execute(insert_command, game.to_db_tuple())
+        conn.executemany(insert_command, [game.to_db_tuple() for game in games])
         return
 
-    # inserts a channel into no_recordings table
-    def insert_channel_with_no_recordings(self, conn, channel_id):
-        tuple_to_insert = (channel_id, int(time.time()))
+    def insert_game(self, conn, game):
+        self.insert_games(conn, [game])
+
+
+    # inserts channels into no_recordings table
+    def insert_channels_with_no_recordings(self, conn, channel_ids):
+        date_scraped = int(time.time())
         insert_command = self.commands['insert-channel-no-recordings-mixer']
-        conn.execute(insert_command, tuple_to_insert)
+        conn.executemany(insert_command, [(channel_id, date_scraped) for channel_id in channel_ids])
+        self.__clear_recordings_due(conn, channel_ids)
         return
 
-    def insert_recording_for_channel(self, conn, recording):
+    def insert_channel_with_no_recordings(self, conn, channel_id):
+        self.insert_channels_with_no_recordings(conn, [channel_id])
+
+
+    def insert_recordings(self, conn, recordings):
         insert_command = self.commands['insert-recording-mixer']
-        conn.execute(insert_command, recording.to_db_tuple())
+        rows = [recording.to_db_tuple() for recording in recordings]
+        conn.executemany(insert_command, rows)
+        self.__clear_recordings_due(conn, set(row[1] for row in rows)) # <- row[1] is the channel_id
         return
 
+    def insert_recording_for_channel(self, conn, recording):
+        self.insert_recordings(conn, [recording])
+
+
     def insert_logs(self, conn, log_name, time_started, timelog_str, stats_str):
         insert_command = self.commands['insert-log-mixer']
         tuple_to_insert = (log_name, time_started, int(time.time()), timelog_str, stats_str, )
         conn.execute(insert_command, tuple_to_insert)
         return
 
+    # Channel Work -------------------------------------------------------------
+    # -> channel_work has one row per channel with the date its recordings are due to be scraped and the date it's due to be scraped again
+    # -> the insert helpers above keep it up to date in the same transaction as the rows they write,
+    #    so the selectors below are index range scans instead of scans of channels, recordings and the whole followers history
+    # -> recordings_due is set when a channel is inserted and becomes NULL once its recordings (or the lack of them) are saved
+    # -> refresh_due is MIXER_CHANNEL_REFRESH_INTERVAL after its followers were last scraped, it only ever moves forward
+
+    # moves refresh_due forward for (channel_id, date_scraped) rows of followers
+    def __update_refresh_due(self, conn, rows):
+        conn.executemany(self.commands['update-channel-work-refresh-due-mixer'], [(channel_id, date + MIXER_CHANNEL_REFRESH_INTERVAL) for channel_id, date in rows])
+
+    def __clear_recordings_due(self, conn, channel_ids):
+        conn.executemany(self.commands['clear-channel-work-recordings-due-mixer'], [(channel_id, ) for channel_id in channel_ids])
+
+    # fills channel_work from the channels, recordings, no_recordings and followers tables (ie: for a db created before it)
+    # -> create_tables() calls it once, when channel_work is still empty
+    def build_channel_work(self, conn):
+        conn.executemany(self.commands['insert-channel-work-mixer'], conn.execute(self.commands['get-channels-without-recordings-mixer']).fetchall())
+        self.__update_refresh_due(conn, conn.execute(self.commands['get-latest-followers-dates-mixer']).fetchall())
+        conn.commit()
+
     # Select -------------------------------------------------------------------
 
-    # returns a lookup table of channel_ids for channels that are already in the database
-    # needs an existing connection to run
+    # returns the KnownIDSet of channel_ids for channels that are already in the database, see known_ids.py
+    # -> only the channels added since the last call are read, and only if conn isn't inside a transaction
     def get_all_channel_ids(self, conn):
-        ids = {}
-        for row in conn.execute(self.commands['get-all-channel-ids-mixer']):
-            ids[row[0]] = True
-        return ids
+        return self.known_ids['channels'].refresh(conn)
+
 
+    # returns a lookup table of {channel_id: profile_hash} for the channels in channel_ids that are already in the database
+    # -> this doubles as a lookup table of which of them exist
+    def get_channel_profile_hashes(self, conn, channel_ids):
+        hashes = {}
+        channel_ids = list(dict.fromkeys(channel_ids))
+        for i in range(0, len(channel_ids), IN_LIST_SIZE):
+            for row in conn.execute(self.commands['get-channel-profile-hashes-mixer'], pad_in_list(channel_ids[i:i + IN_LIST_SIZE])):
+                hashes[row[0]] = row[1]
+        return hashes
 
-    # returns a lookup table of game_ids for games that are already in database
+
+    # returns the KnownIDSet of game_ids for games that are already in database, see known_ids.py
+    # -> only the games added since the last call are read, and only if conn isn't inside a transaction
     def get_all_game_ids(self, conn):
-        ids = {}
-        for row in conn.execute(self.commands['get-all-game-ids-mixer']):
-            ids[row[0]] = True
-        return ids
+        return self.known_ids['games'].refresh(conn)
 
 
-    # returns a list of all channel IDs that IndieOutreach hasn't scraped for recordings yet
-    def get_channel_ids_that_need_recordings(self, conn):
-        ids = []
-        ids_to_ignore = {}
-        for row in conn.execute(self.commands['get-channel-ids-that-have-recordings-mixer']):
-            ids_to_ignore[row[0]] = True
-        for row in conn.execute(self.commands['get-channel-ids-with-no-recordings-mixer']):
-            ids_to_ignore[row[0]] = True
-        for row in conn.execute(self.commands['get-all-channel-ids-mixer']):
-            if (row[0] not in ids_to_ignore):
-                ids.append(row[0])
-        return ids
+    # returns a list of channel IDs that IndieOutreach hasn't scraped for recordings yet
+    # -> the channels added first come first, limit = -1 returns all of them
+    def get_channel_ids_that_need_recordings(self, conn, limit = -1):
+        select_command = self.commands['get-channel-ids-that-need-recordings-mixer']
+        return [row[0] for row in conn.execute(select_command, {'date': int(time.time()), 'result_limit': limit})]
 
     # returns a list of channel IDs that haven't been active in the last 24 hours
-    def get_inactive_channel_ids(self, conn):
-        ids = []
-        time_cutoff = int(time.time()) - (1 * 60 * 60 * 24) # <- 24 hours ago
-        select_command = self.commands['get-channel-ids-whose-most-recent-entry-was-before']
-        select_command = select_command.replace('{table_name}', 'followers')
-        select_command = select_command.replace('{date}', str(time_cutoff))
-        for row in conn.execute(select_command):
-            ids.append(row[0])
-        return ids
+    # -> active means followers were last confirmed in the last 24 hours, not that they changed
+    # -> the ones scraped longest ago come first, limit = -1 returns all of them
+    def get_inactive_channel_ids(self, conn, limit = -1):
+        select_command = self.commands['get-channel-ids-due-for-refresh-mixer']
+        return [row[0] for row in conn.execute(select_command, {'date': int(time.time()), 'result_limit': limit})]
+
+    # returns a list of (channel_id, date, value) points of a time series table between date_from and date_to, see get_time_series()
+    def get_time_series(self, conn, table_name, channel_ids, date_from, date_to, step = False):
+        return get_time_series(conn, self.commands.get('get-time-series-mixer', table_name), channel_ids, date_from, date_to, step)
+
+
+    # Migrate ------------------------------------------------------------------
+
+    # merges the rows a time series table got before run-length storage into intervals, see merge_run_length_rows()
+    # -> commits after every chunk of channels
+    # returns (number of rows before, number of rows after)
+    def merge_time_series_rows(self, conn, table_name):
+        ids = [row[0] for row in conn.execute(self.commands.get('get-time-series-ids-mixer', table_name))]
+        return merge_run_length_rows(
+            conn,
+            ids,
+            self.commands.get('get-time-series-mixer', table_name),
+            self.commands.get('confirm-time-series-mixer', table_name),
+            self.commands.get('delete-time-series-row-mixer', table_name)
+        )
 
 # ==============================================================================
 # Class: TwitchDBManager
 # ==============================================================================
 
+# the twitch.db tables whose rows are written to the monthly partition of their date_scraped, see partitions.py
+TWITCH_PARTITIONED_TABLES = ['livestream_snapshots', 'followers', 'total_views', 'game_snapshots']
+
+# the twitch.db tables that store (streamer_id, date_scraped, value, last_confirmed) run-length intervals
+TWITCH_TIME_SERIES_TABLES = ['followers', 'total_views']
+
+# the twitch.db tables whose number of rows is kept in table_stats by insert/delete triggers, see get_row_counts()
+TWITCH_COUNTED_TABLES = ['streamers', 'followers', 'total_views', 'broadcaster_type', 'livestream_snapshots', 'livestreams', 'games', 'game_snapshots', 'tags', 'logs']
+
 class TwitchDB():
 
     def __init__(self):
         self.filepath = './data/twitch.db' # <- the filepath to the db file
         self.commands = self.load_commands()
+        self.connections = get_connection_manager(self.filepath)
+        self.partitions = get_partition_manager(self.filepath, self.commands, 'twitch')
+        self.upgraded_schemas = {} # <- lookup table of {schema: True} for the partitions whose tables are up to date
+        self.run_length_tables = {} # <- lookup table of {(schema, table_name): True} for the time series tables known to have last_confirmed
+        self.known_ids = {
+            'streamers': get_known_id_set(self.filepath, self.commands['get-all-streamer-ids-twitch']),
+            'games':     get_known_id_set(self.filepath, self.commands['get-all-game-ids-twitch']),
+            'tags':      get_known_id_set(self.filepath, self.commands['get-all-tag-ids-twitch'], typecode = False) # <- tag_ids are text
+        }
         return
 
+    # returns the SQLCommandRegistry for twitch.db, see sql_commands.py
     def load_commands(self):
-
-        def __load_from_file(commands, filepath):
-            f = json.load(open(filepath))
-            for command_name, command_list in f.items():
-                if (len(command_list) > 1):
-                    commands[command_name] = command_list
-                else:
-                    commands[command_name] = command_list[0]
-            return commands
-
-        commands = __load_from_file({}, './sql/twitch_create.json')
-        commands = __load_from_file(commands, './sql/twitch_insert.json')
-        commands = __load_from_file(commands, './sql/twitch_select.json')
-        commands = __load_from_file(commands, './sql/twitch_delete.json')
-        return commands
+        filepaths = [
+            './sql/twitch_create.json',
+            './sql/twitch_insert.json',
+            './sql/twitch_select.json',
+            './sql/twitch_delete.json'
+        ]
+        table_variants = {
+            'count-rows-twitch':                           TWITCH_COUNTED_TABLES,
+            'create-row-count-triggers-twitch':            TWITCH_COUNTED_TABLES,
+            'reconcile-row-count-twitch':                  TWITCH_COUNTED_TABLES,
+            'insert-time-series-twitch':                   TWITCH_TIME_SERIES_TABLES,
+            'confirm-time-series-twitch':                  TWITCH_TIME_SERIES_TABLES,
+            'delete-time-series-row-twitch':               TWITCH_TIME_SERIES_TABLES,
+            'get-most-recent-values-for-streamers-twitch': TWITCH_TIME_SERIES_TABLES,
+            'get-time-series-twitch':                      TWITCH_TIME_SERIES_TABLES,
+            'get-time-series-legacy-twitch':               TWITCH_TIME_SERIES_TABLES,
+            'get-time-series-ids-twitch':                  TWITCH_TIME_SERIES_TABLES,
+            'add-last-confirmed-column-twitch':            TWITCH_TIME_SERIES_TABLES
+        }
+        return load_command_registry(filepaths, table_variants)
 
 
 
     # Connect ------------------------------------------------------------------
 
+    # returns this thread's read/write connection, see SQLiteConnectionManager
     def get_connection(self):
-        return sqlite3.connect(self.filepath, timeout = 1 * 60 * 15) # <- 15 minutes
+        return self.connections.get_connection()
+
+    # returns this thread's read-only connection, for phases that only read
+    # -> allow_writer = False never opens a write connection, see SQLiteConnectionManager.get_reader_connection()
+    def get_reader_connection(self, allow_writer = True):
+        return self.connections.get_reader_connection(allow_writer)
+
+    # call this instead of conn.close() when a phase is done with its connection
+    def release_connection(self, conn):
+        self.connections.release_connection(conn)
+
+    # creates and attaches the partitions conn writes to, and freezes the ones that are done, see PartitionManager
+    # -> called by the db writer before every transaction, anything else that writes to twitch.db must call it first too
+    def prepare_write_connection(self, conn):
+        self.partitions.prepare_write_connection(conn)
+
+        # partitions created before a column was added get it the first time they're written to
+        for schema in self.partitions.get_writable_schemas(conn):
+            self.__upgrade_schema(conn, schema)
+
+    # adds the columns and row counters a schema's tables got after it was created, once per schema
+    # -> frozen partitions are read-only and never get them, see __get_time_series_select()
+    def __upgrade_schema(self, conn, schema):
+        if (schema in self.upgraded_schemas):
+            return
+        add_column_if_missing(conn, 'livestream_snapshots', 'tag_set_id', self.commands.get('add-tag-set-id-column-livestream-snapshots-twitch', schema = schema), schema)
+        for table_name in TWITCH_TIME_SERIES_TABLES:
+            add_column_if_missing(conn, table_name, 'last_confirmed', self.commands.get('add-last-confirmed-column-twitch', table_name, schema), schema)
+        self.__add_row_counters(conn, TWITCH_COUNTED_TABLES if (schema == 'main') else TWITCH_PARTITIONED_TABLES, schema)
+        self.upgraded_schemas[schema] = True
+
+    # returns the stats of the connections, of the command reuse estimate (see SQLCommandRegistry), of the partitions and of the known id sets
+    def get_stats(self):
+        known_ids = {name: known.get_stats() for name, known in self.known_ids.items()}
+        return {'connections': self.connections.get_stats(), 'statements': self.commands.get_stats(), 'partitions': self.partitions.get_stats(), 'known_ids': known_ids}
 
     # Create -------------------------------------------------------------------
 
     def create_tables(self):
-        conn = sqlite3.connect(self.filepath)
+        conn = self.get_connection()
         for command in self.commands['create-tables-twitch']:
             conn.execute(command)
+        add_column_if_missing(conn, 'streamers', 'profile_hash', self.commands['add-profile-hash-column-twitch'])
+        add_column_if_missing(conn, 'livestreams', 'tag_set_id', self.commands['add-tag-set-id-column-livestreams-twitch'])
+        add_column_if_missing(conn, 'livestream_snapshots', 'tag_set_id', self.commands['add-tag-set-id-column-livestream-snapshots-twitch'])
+        for table_name in TWITCH_TIME_SERIES_TABLES:
+            add_column_if_missing(conn, table_name, 'last_confirmed', self.commands.get('add-last-confirmed-column-twitch', table_name))
         conn.commit()
-        conn.close()
+
+        # main and the partitions that aren't frozen are upgraded now, so readers don't have to wait for a writer to do it
+        for schema in self.partitions.iter_schemas(conn, include_frozen = False):
+            self.__upgrade_schema(conn, schema)
+        if (conn.execute(self.commands['get-streamer-state-is-empty-twitch']).fetchone()[0]):
+            self.build_streamer_state(conn)
+        self.release_connection(conn)
 
 
     # Insert -------------------------------------------------------------------
+    # -> every helper takes an iterable of objects and writes them with a single executemany call
+    # -> the singular helpers (ie: insert_new_streamer) are kept for callers that only have one object
+    # -> rows of TWITCH_PARTITIONED_TABLES go to the partition of their date_scraped, one executemany call per partition
+
+    # inserts new streamers into streamers table
+    def insert_new_streamers(self, conn, streamers):
+        rows = [streamer.to_db_tuple('insert') + (streamer.get_profile_hash(), ) for streamer in streamers]
+        conn.executemany(self.commands['insert-new-streamer-twitch'], rows)
+        self.__update_streamer_state(conn, 'last-profile-refresh', [(streamer.id, streamer.date_scraped) for streamer in streamers])
+        return
 
-    # inserts a new streamer into streamers table
     def insert_new_streamer(self, conn, streamer):
-        conn.execute(self.commands['insert-new-streamer-twitch'], streamer.to_db_tuple('insert'))
-        return
+        self.insert_new_streamers(conn, [streamer])
 
 
-    # updates an existing streamer in the streamers table
+    # updates existing streamers in the streamers table
+    def update_streamers(self, conn, streamers):
+        rows = [streamer.to_db_tuple('update') + (streamer.get_profile_hash(), streamer.id) for streamer in streamers]
+        conn.executemany(self.commands['update-existing-streamer-twitch'], rows)
+        self.__update_streamer_state(conn, 'last-profile-refresh', [(streamer.id, streamer.date_scraped) for streamer in streamers])
+        return
+
     def update_streamer(self, conn, streamer):
-        update_command = self.commands['update-existing-streamer-twitch'].replace('{streamer_id}', str(streamer.id))
-        conn.execute(update_command, streamer.to_db_tuple('update'))
+        self.update_streamers(conn, [streamer])
+
+
+    # updates existing streamers only if their profile is different from the one saved in the db
+    # -> profile_hashes is the lookup table of {streamer_id: (profile_hash, date_last_scraped)} from get_streamer_profile_hashes()
+    # -> an unchanged profile only gets date_last_scraped refreshed, once it is older than touch_interval seconds,
+    #    so get_inactive_streamer_ids() still sees the streamer as active
+    # returns the number of streamers whose profile changed
+    def update_streamers_if_changed(self, conn, streamers, profile_hashes, touch_interval = 12 * 60 * 60):
+        changed_streamers, rows_to_touch = [], []
+        for streamer in streamers:
+            profile_hash, date_last_scraped = profile_hashes.get(streamer.id, (None, None))
+            if (streamer.get_profile_hash() != profile_hash):
+                changed_streamers.append(streamer)
+            elif ((date_last_scraped is None) or (date_last_scraped < streamer.date_scraped - touch_interval)):
+                rows_to_touch.append((streamer.date_scraped, streamer.id))
+
+        self.update_streamers(conn, changed_streamers)
+        conn.executemany(self.commands['update-streamer-date-last-scraped-twitch'], rows_to_touch)
+        self.__update_streamer_state(conn, 'last-profile-refresh', [(streamer_id, date_scraped) for date_scraped, streamer_id in rows_to_touch])
+        return len(changed_streamers)
+
+    # returns True if the streamer's profile changed
+    def update_streamer_if_changed(self, conn, streamer, profile_hashes, touch_interval = 12 * 60 * 60):
+        return self.update_streamers_if_changed(conn, [streamer], profile_hashes, touch_interval) > 0
+
+
+    # inserts TwitchGames into games table
+    def insert_games(self, conn, games):
+        conn.executemany(self.commands['insert-game-twitch'], [game.to_db_tuple() for game in games])
         return
 
-    # inserts a TwitchGame into games table
     def insert_game(self, conn, game):
-        conn.execute(self.commands['insert-game-twitch'], game.to_db_tuple())
+        self.insert_games(conn, [game])
+
+
+    # inserts StatsBucket objects into the game_snapshots table
+    def insert_game_snapshots(self, conn, list_of_game_stats):
+        self.__insert_partitioned(conn, 'insert-game-snapshot-twitch', [game_stats.to_db_tuple() for game_stats in list_of_game_stats], 1)
         return
 
-    # inserts a StatsBucket object into the game_snapshots table
     def insert_game_snapshot(self, conn, game_stats):
-        conn.execute(self.commands['insert-game-snapshot-twitch'], game_stats.to_db_tuple())
+        self.insert_game_snapshots(conn, [game_stats])
+
+
+    # inserts TwitchTags into tags table
+    def insert_tags(self, conn, tags):
+        conn.executemany(self.commands['insert-tag-twitch'], [tag.to_db_tuple() for tag in tags])
         return
 
-    # inserts a TwitchTag into tags table
     def insert_tag(self, conn, tag):
-        conn.execute(self.commands['insert-tag-twitch'], tag.to_db_tuple())
+        self.insert_tags(conn, [tag])
+
+
+    # inserts the tag sets (lists of tag_ids) that aren't in the tag_sets table yet
+    def insert_tag_sets(self, conn, list_of_tag_ids):
+        rows = {}
+        for tag_ids in list_of_tag_ids:
+            tag_set_text = get_tag_set_text(tag_ids)
+            if (tag_set_text not in rows):
+                rows[tag_set_text] = (get_tag_set_id(tag_ids), tag_set_text)
+        conn.executemany(self.commands['insert-tag-set-twitch'], rows.values())
         return
 
-    # insert a TwitchLivestream object into livestream_snapshots table
-    def insert_livestream_snapshot(self, conn, livestream):
-        conn.execute(self.commands['insert-livestream-snapshot-twitch'], livestream.to_db_tuple())
+
+    # inserts TwitchLivestreamSnapshot objects into livestream_snapshots table
+    # -> their tag_ids are saved once per tag set in tag_sets, rows only have the tag_set_id (see compact_codec.py)
+    def insert_livestream_snapshots(self, conn, livestreams):
+        self.insert_tag_sets(conn, [livestream.get_tag_ids() for livestream in livestreams])
+        self.__insert_partitioned(conn, 'insert-livestream-snapshot-twitch', [livestream.to_db_tuple() for livestream in livestreams], 5)
+        self.__update_streamer_state(conn, 'last-live', [(livestream.user_id, livestream.date_scraped) for livestream in livestreams])
         return
 
+    def insert_livestream_snapshot(self, conn, livestream):
+        self.insert_livestream_snapshots(conn, [livestream])
 
-    # inserts a livestream object into livestreams table
-    # NOTE: unlike other insert statements, the object passed into this function is already a tuple
-    def insert_livestream(self, conn, livestream_tuple):
-        conn.execute(self.commands['insert-livestream-twitch'], livestream_tuple)
+
+    # inserts livestream objects into livestreams table
+    # NOTE: unlike other insert statements, the objects passed into this function are already tuples
+    # -> tuples have the tag_set_id of tag sets that are already in tag_sets, and viewer_counts encoded with encode_viewer_counts()
+    # -> a livestream_id that's already saved is skipped: a commit that spans partitions isn't atomic across their files,
+    #    so a compression that crashed after main.livestreams was committed selects the same livestreams again,
+    #    and the retry only has to delete the snapshots that were left behind
+    def insert_livestreams(self, conn, livestream_tuples):
+        conn.executemany(self.commands['insert-livestream-twitch'], livestream_tuples)
         return
 
+    def insert_livestream(self, conn, livestream_tuple):
+        self.insert_livestreams(conn, [livestream_tuple])
 
-    def insert_total_views_for_streamer(self, conn, streamer):
-        conn.execute(self.commands['insert-total-views-for-streamer-twitch'], streamer.to_db_tuple('total_views'))
+
+    # total_views is a run-length time series, a value that didn't change only confirms the streamer's current interval
+    def insert_total_views_for_streamers(self, conn, streamers):
+        self.__write_time_series(conn, 'total_views', [streamer.to_db_tuple('total_views') for streamer in streamers])
         return
 
+    def insert_total_views_for_streamer(self, conn, streamer):
+        self.insert_total_views_for_streamers(conn, [streamer])
+
+
     def insert_logs(self, conn, log_name, time_started, timelog_str, stats_str):
         insert_command = self.commands['insert-log-twitch']
         tuple_to_insert = (log_name, time_started, int(time.time()), timelog_str, stats_str, )
@@ -283,119 +680,175 @@ class TwitchDB():
         return
 
 
-    # only inserts a new broadcaster_type value if it is different than the streamer's most recent one
-    def insert_broadcaster_type_for_streamer(self, conn, streamer):
-
-        tuple_to_insert = streamer.to_db_tuple('broadcaster_type')
-        new_value = tuple_to_insert[2]
+    # only inserts a new broadcaster_type value for streamers whose value is different than their most recent one
+    def insert_broadcaster_types_for_streamers(self, conn, streamers):
 
         # create sql statements
         insert_command = self.commands['insert-broadcaster-type-for-streamer-twitch']
-        select_command = self.commands['get-most-recent-broadcaster-type-for-streamer-twitch']
-        select_command = select_command.replace('{streamer_id}', str(streamer.id))
-
-        # only insert this value if it is new or changed
-        c = conn.execute(select_command)
-        row = c.fetchone()
-        if (row is None):
-            conn.execute(insert_command, tuple_to_insert)
-        else:
-            if (row[0] != new_value):
-                conn.execute(insert_command, tuple_to_insert)
+        select_command = self.commands['get-most-recent-broadcaster-type-for-streamers-twitch']
+
+        # only insert values that are new or changed
+        tuples_to_insert = [streamer.to_db_tuple('broadcaster_type') for streamer in streamers]
+        most_recent_values = get_most_recent_values(conn, select_command, [v[0] for v in tuples_to_insert])
+        conn.executemany(insert_command, get_changed_rows(tuples_to_insert, most_recent_values))
+        return
+
+    def insert_broadcaster_type_for_streamer(self, conn, streamer):
+        self.insert_broadcaster_types_for_streamers(conn, [streamer])
+
+
+    # inserts follower counts into followers table
+    # -> followers is an iterable of (streamer_id, num_followers) tuples
+    # -> followers is a run-length time series, a count that didn't change only confirms the streamer's current interval
+    def insert_followers_counts(self, conn, followers):
+        date_scraped = int(time.time())
+        rows = [(streamer_id, date_scraped, num_followers) for streamer_id, num_followers in followers]
+        self.__write_time_series(conn, 'followers', rows)
+        self.__update_streamer_state(conn, 'last-followers', [(streamer_id, date_scraped) for streamer_id, date_scraped, num_followers in rows])
         return
 
-    # inserts the number of followers a streamer has into followers table
     def insert_followers_count(self, conn, streamer_id, num_followers):
-        insert_command = self.commands['insert-followers-count-twitch']
-        tuple_to_insert = (streamer_id, int(time.time()), num_followers)
-        conn.execute(insert_command, tuple_to_insert)
+        self.insert_followers_counts(conn, [(streamer_id, num_followers)])
+
+
+    # runs a '{schema}' insert command for rows, in the partition of each row's date (rows[date_index])
+    def __insert_partitioned(self, conn, command_name, rows, date_index):
+        rows_by_schema = {}
+        for row in rows:
+            rows_by_schema.setdefault(self.partitions.get_schema_for_date(row[date_index]), []).append(row)
+        for schema, schema_rows in rows_by_schema.items():
+            conn.executemany(self.commands.get(command_name, schema = schema), schema_rows)
         return
 
+    # writes (streamer_id, date_scraped, value) rows to a run-length time series table, see write_run_length_rows()
+    # -> intervals don't span partitions, the first value of a month starts a new interval in that month's partition
+    def __write_time_series(self, conn, table_name, rows):
+        rows_by_schema = {}
+        for row in rows:
+            rows_by_schema.setdefault(self.partitions.get_schema_for_date(row[1]), []).append(row)
+        for schema, schema_rows in rows_by_schema.items():
+            write_run_length_rows(
+                conn,
+                schema_rows,
+                self.commands.get('get-most-recent-values-for-streamers-twitch', table_name, schema),
+                self.commands.get('insert-time-series-twitch', table_name, schema),
+                self.commands.get('confirm-time-series-twitch', table_name, schema)
+            )
+        return
+
+    # Streamer State -----------------------------------------------------------
+    # -> streamer_state has one row per streamer with the last time it was seen live, its profile was refreshed and its followers were scraped
+    # -> the insert helpers above keep it up to date in the same transaction as the rows they write,
+    #    so the selectors below are index range scans instead of scans of streamers and the whole followers history
+    # -> a date only ever moves forward, an older date written late (ie: a backfill) doesn't overwrite a newer one
+
+    # moves a column of streamer_state forward for (streamer_id, date) rows, column is 'last-live', 'last-profile-refresh' or 'last-followers'
+    def __update_streamer_state(self, conn, column, rows):
+        conn.executemany(self.commands['update-streamer-state-' + column + '-twitch'], rows)
+
+    # fills streamer_state from the streamers, livestreams and every partition's snapshots and followers (ie: for a db created before it)
+    # -> create_tables() calls it once, when streamer_state is still empty
+    # -> the partitions are read first and written in one transaction after, ATTACH can't run inside a transaction
+    # -> frozen partitions without last_confirmed are read with get-latest-followers-dates-legacy-twitch
+    def build_streamer_state(self, conn):
+        latest_live, latest_followers = {}, {}
+        for schema in self.partitions.iter_schemas(conn):
+            for streamer_id, date in conn.execute(self.commands.get('get-latest-live-dates-twitch', schema = schema)):
+                latest_live[streamer_id] = max(date, latest_live.get(streamer_id, date))
+            for streamer_id, date in conn.execute(self.__get_time_series_select(conn, 'get-latest-followers-dates-twitch', 'followers', schema)):
+                latest_followers[streamer_id] = max(date, latest_followers.get(streamer_id, date))
+        for streamer_id, date in conn.execute(self.commands['get-latest-livestream-dates-twitch']):
+            latest_live[streamer_id] = max(date, latest_live.get(streamer_id, date))
+
+        self.__update_streamer_state(conn, 'last-profile-refresh', conn.execute(self.commands['get-streamers-date-last-scraped-twitch']).fetchall())
+        self.__update_streamer_state(conn, 'last-live', latest_live.items())
+        self.__update_streamer_state(conn, 'last-followers', latest_followers.items())
+        conn.commit()
+
     # Select -------------------------------------------------------------------
 
-    # returns a lookup table of streamer_ids for streamers that are already in the database
+    # returns the KnownIDSet of streamer_ids for streamers that are already in the database, see known_ids.py
+    # -> only the streamers added since the last call are read, and only if conn isn't inside a transaction
     def get_all_streamer_ids(self, conn):
-        ids = {}
-        for row in conn.execute(self.commands['get-all-streamer-ids-twitch']):
-            ids[row[0]] = True
-        return ids
+        return self.known_ids['streamers'].refresh(conn)
 
-    # returns a lookup table of game_ids for games that are already in the database
+    # returns a lookup table of {streamer_id: (profile_hash, date_last_scraped)} for the streamers in streamer_ids that are already in the database
+    # -> this doubles as a lookup table of which of them exist
+    def get_streamer_profile_hashes(self, conn, streamer_ids):
+        return get_most_recent_rows(conn, self.commands['get-streamer-profile-hashes-twitch'], streamer_ids)
+
+    # returns the KnownIDSet of game_ids for games that are already in the database, see known_ids.py
     def get_all_game_ids(self, conn):
-        ids = {}
-        for row in conn.execute(self.commands['get-all-game-ids-twitch']):
-            ids[row[0]] = True
-        return ids
+        return self.known_ids['games'].refresh(conn)
 
-    # returns a lookup table of tag_ids that already exist in database
+    # returns the KnownIDSet of tag_ids that already exist in database, see known_ids.py
     def get_all_tag_ids(self, conn):
-        ids = {}
-        for row in conn.execute(self.commands['get-all-tag-ids-twitch']):
-            ids[row[0]] = True
-        return ids
+        return self.known_ids['tags'].refresh(conn)
 
     # returns a list of streamer_ids that need follower data (because they haven't gotten it in 24 hours+ or don't have any at all)
     # streamer_ids are sorted so that the ones who are furthest behind scraping wise are at the front
+    # -> both steps read at most limit rows of a streamer_state index
     def get_streamer_ids_that_need_follower_data(self, conn, limit):
-        ids = []
 
         # 1) get streamer IDs with NO followers data at all
-        select_command = self.commands['get-streamer-ids-with-no-followers-data-twitch']
-        for row in conn.execute(select_command):
-            ids.append(row[0])
-            if (len(ids) >= limit):
-                return ids
+        ids = [row[0] for row in conn.execute(self.commands['get-streamer-ids-without-followers-twitch'], {'result_limit': limit})]
+        if (len(ids) >= limit):
+            return ids
 
         # 2) If step 1 didn't fill out out limit, get streamer IDs that don't have follower data from the past day
         date_cutoff = int(time.time()) - (1 * 60 * 60 * 24) # <- 1 day ago
-        select_command = self.commands['get-streamer-ids-that-dont-have-followers-from-last-day-twitch']
-        select_command = select_command.replace('{date}', str(date_cutoff))
-        for row in conn.execute(select_command):
+        for row in conn.execute(self.commands['get-streamer-ids-with-followers-before-twitch'], {'date': date_cutoff, 'result_limit': limit - len(ids)}):
             ids.append(row[0])
-            if (len(ids) >= limit):
-                return ids
         return ids
 
 
-    # returns a list of streamer IDs that haven't livestreamed in over 24 hours
-    def get_inactive_streamer_ids(self, conn):
-        ids = []
-        date_cutoff = int(time.time()) - (1 * 60 * 60 * 24) # <- 1 day ago
-        select_command = self.commands['get-inactive-streamer-ids'].replace('{date}', str(date_cutoff))
-        for row in conn.execute(select_command):
-            ids.append(row[0])
-        return ids
+    # returns a lookup table of {streamer_id: date_last_scraped} for streamers whose profiles were saved on or after date
+    def get_streamers_scraped_since(self, conn, date):
+        streamers = {}
+        select_command = self.commands['get-streamers-scraped-since-twitch']
+        for row in conn.execute(select_command, {'date': int(date)}):
+            streamers[row[0]] = row[1]
+        return streamers
 
 
-    # returns a list of livestream_ids that are in livestream_snapshots and
-    # are ready to be compressed and moved to the livestreams table
-    def get_livestream_snapshot_ids_to_compress(self, conn, limit = 500):
+    # returns a list of streamer IDs whose profiles haven't been refreshed in over 24 hours (the livestreams procedure refreshes live streamers)
+    # -> the ones refreshed longest ago come first, limit = -1 returns all of them
+    def get_inactive_streamer_ids(self, conn, limit = -1):
         ids = []
-        date_cutoff = int(time.time()) - (1 * 60 * 60 * 24 * 2) # <- 2 days ago
-        select_command = self.commands['get-livestream-snapshot-ids-to-compress']
-        select_command = select_command.replace('{date}', str(date_cutoff))
-        select_command = select_command.replace('{result_limit}', str(limit))
-        for row in conn.execute(select_command):
+        date_cutoff = int(time.time()) - (1 * 60 * 60 * 24) # <- 1 day ago
+        select_command = self.commands['get-inactive-streamer-ids']
+        for row in conn.execute(select_command, {'date': date_cutoff, 'result_limit': limit}):
             ids.append(row[0])
         return ids
 
-    # return all livestream snapshots with given livestream ID
-    def get_all_livestream_snapshots_with_id(self, conn, id):
-        snapshots = []
-        select_command = self.commands['get-snapshots-for-livestream']
-        select_command = select_command.replace('{livestream_id}', str(id))
-        for row in conn.execute(select_command):
-            snapshots.append({
-                'livestream_id': row[0],
-                'streamer_id'  : row[1],
-                'game_id'      : row[2],
-                'viewers'      : row[3],
-                'date_started' : row[4],
-                'date_scraped' : row[5],
-                'tag_ids'      : json.loads(row[6]),
-                'language'     : row[7]
-            })
-        return snapshots
+
+    # returns a lookup table of {tag_set_id: [tag_ids]} for every tag set
+    def get_tag_sets(self, conn):
+        tag_sets = {}
+        for row in conn.execute(self.commands['get-tag-sets-twitch']):
+            tag_sets[row[0]] = json.loads(row[1])
+        return tag_sets
+
+    # yields the livestreams that started between date_from and date_to as dicts
+    # -> viewer_counts is a ViewerCounts, its BLOB is only decoded if it's read
+    # -> tag_ids are looked up in tag_sets (loaded once per call), rows written before tag sets still have their own json text
+    # NOTE: max_viewers, min_viewers and average_viewers are named after the columns, see __compressed_livestream_to_db_tuple in twitch_scraper.py
+    def iter_livestreams_started_between(self, conn, date_from, date_to):
+        tag_sets = self.get_tag_sets(conn)
+        select_command = self.commands['get-livestreams-started-between-twitch']
+        for row in conn.execute(select_command, {'date_from': int(date_from), 'date_to': int(date_to)}):
+            yield {
+                'livestream_id'  : row[0],
+                'streamer_id'    : row[1],
+                'game_id'        : row[2],
+                'date_started'   : row[3],
+                'date_ended'     : row[4],
+                'tag_ids'        : json.loads(row[5]) if (isinstance(row[5], str)) else tag_sets.get(row[5], []),
+                'max_viewers'    : row[6],
+                'min_viewers'    : row[7],
+                'average_viewers': row[8],
+                'viewer_counts'  : ViewerCounts(row[9])
+            }
 
     # returns the most recent logs for each type of scraping procedure
     # -> this lets us know when it was run last
@@ -406,15 +859,308 @@ class TwitchDB():
             logs[row[0]] = row[1]
         return logs
 
+    # returns a list of (streamer_id, date, value) points of followers or total_views between date_from and date_to, see get_time_series()
+    # -> only the partitions that overlap the range are read
+    def get_time_series(self, conn, table_name, streamer_ids, date_from, date_to, step = False):
+        points = []
+        for schema in self.partitions.iter_schemas(conn, date_from, date_to):
+            points += get_time_series(conn, self.__get_time_series_select(conn, 'get-time-series-twitch', table_name, schema), streamer_ids, date_from, date_to, step)
+        points.sort()
+        return points
+
+
+    # returns the sql text of a select command that reads last_confirmed from schema's table_name,
+    # or of its '-legacy-twitch' variant (which reads date_scraped AS last_confirmed) when the table doesn't have the column
+    # -> partitions frozen before run-length storage are read-only, so they never get the column
+    def __get_time_series_select(self, conn, name, table_name, schema):
+        if ((schema, table_name) not in self.run_length_tables):
+            if (has_column(conn, table_name, 'last_confirmed', schema)):
+                self.run_length_tables[(schema, table_name)] = True # <- a column is never dropped, so this is only checked until it's there
+            else:
+                name = name.replace('-twitch', '-legacy-twitch')
+        return self.commands.get(name, table_name if ((name, table_name) in self.commands) else False, schema)
+
+
+    # Migrate ------------------------------------------------------------------
+
+    # merges the rows followers or total_views got before run-length storage into intervals, see merge_run_length_rows()
+    # -> frozen partitions are read-only, their rows are left as intervals of a single scrape
+    # -> commits after every chunk of streamers
+    # returns (number of rows before, number of rows after)
+    def merge_time_series_rows(self, conn, table_name):
+        num_before, num_after = 0, 0
+        for schema in self.partitions.iter_schemas(conn, include_frozen = False):
+            ids = [row[0] for row in conn.execute(self.commands.get('get-time-series-ids-twitch', table_name, schema))]
+            schema_before, schema_after = merge_run_length_rows(
+                conn,
+                ids,
+                self.__get_time_series_select(conn, 'get-time-series-twitch', table_name, schema),
+                self.commands.get('confirm-time-series-twitch', table_name, schema),
+                self.commands.get('delete-time-series-row-twitch', table_name, schema)
+            )
+            num_before += schema_before
+            num_after  += schema_after
+        return num_before, num_after
+
+    # rewrites up to limit livestreams written before compact_codec.py, from json text to a tag_set_id and a viewer_counts BLOB
+    # -> rows are rewritten in rowid order, pass the returned rowid back in to carry on where the last call stopped
+    # returns (number of livestreams rewritten, last rowid), 0 rewritten means there's nothing left to migrate
+    def encode_legacy_livestreams(self, conn, rowid = 0, limit = 5000):
+        rows, tag_id_lists = [], []
+        select_command = self.commands['get-livestreams-to-encode-twitch']
+        for rowid, tag_ids, viewer_counts in conn.execute(select_command, {'rowid': rowid, 'result_limit': limit}).fetchall():
+            tag_ids = json.loads(tag_ids) if (tag_ids is not None) else []
+            viewer_counts = decode_viewer_counts(viewer_counts)
+            tag_id_lists.append(tag_ids)
+            rows.append((get_tag_set_id(tag_ids), encode_viewer_counts(viewer_counts), rowid))
+        self.insert_tag_sets(conn, tag_id_lists)
+        conn.executemany(self.commands['update-livestream-encoding-twitch'], rows)
+        return len(rows), rowid
+
+    # Count --------------------------------------------------------------------
+    # -> twitch.db and every partition keep the number of rows of their TWITCH_COUNTED_TABLES in their own table_stats table,
+    #    updated by insert/delete triggers in the same transaction as the rows, so counting a table never scans it
+    # -> a db file without a table's counter (ie: a partition that was frozen before table_stats existed) is counted with COUNT(*)
+
+    # returns the number of rows in table_name, summed over every partition for TWITCH_PARTITIONED_TABLES
+    def count_rows(self, conn, table_name):
+        return self.get_row_counts(conn, [table_name])[table_name]
+
+    # returns the lookup table of {table name: number of rows} for table_names, read from table_stats
+    def get_row_counts(self, conn, table_names):
+        for table_name in table_names:
+            if (table_name not in TWITCH_COUNTED_TABLES):
+                raise ValueError(table_name + ' has no row counter, count it with SELECT COUNT(*)')
+        counts = dict.fromkeys(table_names, 0)
+        schemas = self.partitions.iter_schemas(conn) if (any([table_name in TWITCH_PARTITIONED_TABLES for table_name in table_names])) else ['main']
+        for schema in schemas:
+            try:
+                stats = dict(conn.execute(self.commands.get('get-row-counts-twitch', schema = schema)).fetchall())
+            except sqlite3.OperationalError:
+                stats = {} # <- a db file created before table_stats
+            for table_name in table_names:
+                if ((schema != 'main') and (table_name not in TWITCH_PARTITIONED_TABLES)):
+                    continue
+                if (table_name in stats):
+                    counts[table_name] += stats[table_name]
+                else:
+                    counts[table_name] += conn.execute(self.commands.get('count-rows-twitch', table_name, schema)).fetchone()[0]
+        return counts
+
+    # recounts every counted table with COUNT(*) and overwrites its counter, returns {table name: (counted before, counted now)}
+    # -> only needed when rows were written without the triggers firing (ie: by hand, with recursive_triggers off)
+    # -> scans every table, so it's run by hand (tools/reconcile_row_counts.py), never by the health checks
+    # -> frozen partitions are read-only, their counters can't drift and aren't recounted
+    def reconcile_row_counts(self, conn):
+        self.prepare_write_connection(conn)
+        counts_before = self.get_row_counts(conn, TWITCH_COUNTED_TABLES)
+        for schema in self.partitions.iter_schemas(conn, include_frozen = False):
+            for table_name in (TWITCH_COUNTED_TABLES if (schema == 'main') else TWITCH_PARTITIONED_TABLES):
+                conn.execute(self.commands.get('reconcile-row-count-twitch', table_name, schema))
+            conn.commit() # <- before iter_schemas() attaches the next partition, ATTACH can't run inside a transaction
+        counts_after = self.get_row_counts(conn, TWITCH_COUNTED_TABLES)
+        return {table_name: (counts_before[table_name], counts_after[table_name]) for table_name in TWITCH_COUNTED_TABLES}
+
+    # adds the triggers that keep schema's table_stats up to date, and counts the rows already in the tables that weren't counted yet
+    # -> the first count and the triggers are added in one transaction, so no row is missed or counted twice
+    def __add_row_counters(self, conn, table_names, schema = 'main'):
+        stats = dict(conn.execute(self.commands.get('get-row-counts-twitch', schema = schema)).fetchall())
+        table_names = [table_name for table_name in table_names if (table_name not in stats)]
+        if (len(table_names) == 0):
+            return
+        conn.execute('BEGIN IMMEDIATE;')
+        for table_name in table_names:
+            for command in self.commands.get('create-row-count-triggers-twitch', table_name, schema):
+                conn.execute(command)
+            conn.execute(self.commands.get('reconcile-row-count-twitch', table_name, schema))
+        conn.commit()
 
-    # Delete -------------------------------------------------------------------
 
-    # deletes all livestream_snapshots with the given livestream ID
-    def delete_livestream_snapshots(self, conn, livestream_id):
-        delete_command = self.commands['delete-livestream-snapshots-twitch']
-        livestream_id_tuple = (str(livestream_id), ) # <- to get sqlite to register it correctly
-        conn.execute(delete_command, livestream_id_tuple)
-        return
+    # Compress -----------------------------------------------------------------
+    # -> the livestreams being compressed are kept in temp.compress_ids, which only exists on conn,
+    #    so all of these need to be called with the same connection (and inside one transaction)
+    # -> snapshots are only looked for in main and the partitions that aren't frozen (a partition isn't frozen while it has snapshots),
+    #    so compressing never reads the frozen history
+
+    # fills temp.compress_ids with up to limit livestream_ids whose last snapshot is older than date_cutoff
+    # -> a livestream that runs over the end of a month has snapshots in two partitions, its last snapshot is the latest of both
+    # returns the number of livestream_ids selected
+    def select_livestreams_to_compress(self, conn, date_cutoff, limit):
+        conn.execute(self.commands['create-compress-ids-table-twitch'])
+        conn.execute(self.commands['clear-compress-ids-twitch'])
+        date_last_snapshot = {}
+        for schema in self.partitions.get_writable_schemas(conn):
+            for livestream_id, date_scraped in conn.execute(self.commands.get('get-livestream-last-snapshot-dates-twitch', schema = schema)):
+                if (date_scraped > date_last_snapshot.get(livestream_id, 0)):
+                    date_last_snapshot[livestream_id] = date_scraped
+
+        # the livestreams that ended most recently first
+        selected = sorted([(date_scraped, livestream_id) for livestream_id, date_scraped in date_last_snapshot.items() if (date_scraped < date_cutoff)], reverse = True)[:limit]
+        conn.executemany(self.commands['insert-livestream-id-to-compress-twitch'], [(livestream_id, ) for date_scraped, livestream_id in selected])
+        return len(selected)
+
+    # returns an iterator over the snapshots of the selected livestreams, ordered by (livestream_id, date_scraped)
+    # -> rows are (livestream_id, streamer_id, game_id, viewers, date_scraped, tag_set_id, language)
+    # -> each partition is read in order, and the partitions are merged as they're read
+    def get_snapshots_to_compress(self, conn):
+        cursors = [conn.execute(self.commands.get('get-snapshots-to-compress-twitch', schema = schema)) for schema in self.partitions.get_writable_schemas(conn)]
+        rows = cursors[0] if (len(cursors) == 1) else heapq.merge(*cursors, key = lambda row: (row[0], row[4]))
+        return self.__with_tag_set_ids(conn, rows)
+
+    # snapshots saved before tag sets have json text instead of a tag_set_id, their tag set is added to tag_sets as they're read
+    def __with_tag_set_ids(self, conn, rows):
+        for row in rows:
+            if (isinstance(row[5], str)):
+                tag_ids = json.loads(row[5])
+                self.insert_tag_sets(conn, [tag_ids])
+                row = row[:5] + (get_tag_set_id(tag_ids), ) + row[6:]
+            yield row
+
+    # deletes every snapshot of the selected livestreams
+    # returns the number of snapshots deleted
+    def delete_compressed_livestream_snapshots(self, conn):
+        num_deleted = 0
+        for schema in self.partitions.get_writable_schemas(conn):
+            num_deleted += conn.execute(self.commands.get('delete-compressed-livestream-snapshots-twitch', schema = schema)).rowcount
+        conn.execute(self.commands['clear-compress-ids-twitch'])
+        return num_deleted
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+__connection_managers = {}  # <- lookup table of {absolute filepath: SQLiteConnectionManager}
+__connection_managers_lock = threading.Lock()
+
+# returns the SQLiteConnectionManager shared by every db wrapper in this process that uses this db file
+# -> settings (ie: mmap_size, cache_size, temp_store) are only applied when the manager is first created
+def get_connection_manager(filepath, **settings):
+    key = os.path.abspath(filepath)
+    with __connection_managers_lock:
+        if (key not in __connection_managers):
+            __connection_managers[key] = SQLiteConnectionManager(filepath, **settings)
+        return __connection_managers[key]
+
+
+# returns a short, stable hash of a tuple of column values
+# -> used to detect profiles that haven't changed since they were last saved
+def get_values_hash(values):
+    return hashlib.blake2b(json.dumps(values).encode('utf-8'), digest_size=8).hexdigest()
+
+# returns a lookup table of {id: value} with the most recent value of each id in ids
+# -> select_command is a "SELECT id, value, MAX(date_scraped) ... WHERE id IN ({ids}) GROUP BY id" command
+# -> ids are looked up in chunks, so one query covers up to IN_LIST_SIZE ids instead of one query per id
+def get_most_recent_values(conn, select_command, ids):
+    return {k: v[0] for k, v in get_most_recent_rows(conn, select_command, ids).items()}
+
+# returns a lookup table of {id: (value, date_scraped)} with the most recent row of each id in ids, see get_most_recent_values()
+def get_most_recent_rows(conn, select_command, ids):
+    ids = list(dict.fromkeys(ids)) # <- removes duplicates, keeps order
+    rows = {}
+    for i in range(0, len(ids), IN_LIST_SIZE):
+        for row in conn.execute(select_command, pad_in_list(ids[i:i + IN_LIST_SIZE])):
+            rows[row[0]] = (row[1], row[2])
+    return rows
+
+# returns the (id, date_scraped, value) rows whose value differs from most_recent_values (or that have no value yet)
+def get_changed_rows(rows, most_recent_values):
+    changed_rows = []
+    for row in rows:
+        if ((row[0] not in most_recent_values) or (most_recent_values[row[0]] != row[2])):
+            changed_rows.append(row)
+    return changed_rows
+
+
+# Run-Length Time Series -------------------------------------------------------
+# the time series tables (ie: followers) store one row per interval in which a value didn't change, instead of one row per scrape
+# -> date_scraped is when the interval's value was first seen, last_confirmed is the last scrape that saw the same value
+# -> rows saved before run-length storage have no last_confirmed, they're intervals of a single scrape
+# -> get_time_series() expands the intervals back into points
+
+# writes (id, date_scraped, value) rows to a run-length time series table
+# -> a row with the same value as its id's most recent interval only moves that interval's last_confirmed forward,
+#    any other row starts a new interval
+# -> select_command is a "SELECT id, value, MAX(date_scraped) ... WHERE id IN ({ids}) GROUP BY id" command
+# -> insert_command binds (id, date_scraped, value, last_confirmed), confirm_command binds (last_confirmed, id, date_scraped)
+# returns (number of intervals started, number of intervals confirmed)
+def write_run_length_rows(conn, rows, select_command, insert_command, confirm_command):
+    intervals = get_most_recent_rows(conn, select_command, [row[0] for row in rows])
+    rows_to_insert, rows_to_confirm = [], []
+    for id, date_scraped, value in rows:
+        interval = intervals.get(id)
+        if ((interval is not None) and (interval[0] == value) and (interval[1] <= date_scraped)):
+            rows_to_confirm.append((date_scraped, id, interval[1]))
+        else:
+            rows_to_insert.append((id, date_scraped, value, date_scraped))
+            intervals[id] = (value, date_scraped)
+    conn.executemany(insert_command, rows_to_insert)
+    conn.executemany(confirm_command, rows_to_confirm) # <- after the inserts, a row can confirm an interval started in this call
+    return len(rows_to_insert), len(rows_to_confirm)
+
+# returns a list of (id, date, value) points for the ids in ids between date_from and date_to, sorted by (id, date)
+# -> select_command is a get-time-series-* command, it returns the (id, date_scraped, value, last_confirmed) intervals that overlap the range
+# -> step is the number of seconds between two points inside an interval (ie: how often the procedure runs),
+#    without it each interval is expanded to the points it was first and last seen at
+def get_time_series(conn, select_command, ids, date_from, date_to, step = False):
+    ids = list(dict.fromkeys(ids))
+    intervals = []
+    for i in range(0, len(ids), IN_LIST_SIZE):
+        intervals += conn.execute(select_command, pad_in_list(ids[i:i + IN_LIST_SIZE]) + [int(date_to), int(date_from)]).fetchall()
+    return expand_intervals(intervals, date_from, date_to, step)
+
+# returns the (id, date, value) points of (id, date_scraped, value, last_confirmed) intervals, clipped to [date_from, date_to]
+def expand_intervals(intervals, date_from, date_to, step = False):
+    points = []
+    for id, date_started, value, last_confirmed in intervals:
+        dates = [date_started, last_confirmed] if (step == False) else list(range(date_started, last_confirmed, step)) + [last_confirmed]
+        for date in sorted(set(dates)):
+            if ((date >= date_from) and (date <= date_to)):
+                points.append((id, date, value))
+    points.sort()
+    return points
+
+# merges the consecutive rows of each id that have the same value into one interval (ie: rows saved before run-length storage)
+# -> select_command is a get-time-series-* command, confirm_command and delete_command bind (last_confirmed, id, date_scraped) and (id, date_scraped)
+# -> ids are merged IN_LIST_SIZE at a time, and each chunk is committed, so a big table doesn't hold the write lock for long
+# returns (number of rows before, number of rows after)
+def merge_run_length_rows(conn, ids, select_command, confirm_command, delete_command):
+    num_before, num_after = 0, 0
+    for i in range(0, len(ids), IN_LIST_SIZE):
+        rows_to_confirm, rows_to_delete = [], []
+        intervals = [] # <- [id, date_scraped, value, last_confirmed, number of rows merged into it]
+        for row in conn.execute(select_command, pad_in_list(ids[i:i + IN_LIST_SIZE]) + [2 ** 62, 0]).fetchall():
+            num_before += 1
+            if ((len(intervals) > 0) and (intervals[-1][0] == row[0]) and (intervals[-1][2] == row[2])):
+                intervals[-1][3] = max(intervals[-1][3], row[3])
+                intervals[-1][4] += 1
+                rows_to_delete.append((row[0], row[1]))
+            else:
+                intervals.append(list(row) + [0])
+        for id, date_scraped, value, last_confirmed, num_merged in intervals:
+            if (num_merged > 0):
+                rows_to_confirm.append((last_confirmed, id, date_scraped))
+        num_after += len(intervals)
+
+        conn.executemany(delete_command, rows_to_delete)
+        conn.executemany(confirm_command, rows_to_confirm)
+        if (conn.in_transaction):
+            conn.commit()
+    return num_before, num_after
+
+
+# returns True if table_name has column_name
+# -> schema is the attached db the table is in (ie: a partition, see partitions.py)
+def has_column(conn, table_name, column_name, schema = 'main'):
+    for row in conn.execute('PRAGMA ' + schema + '.table_info(' + table_name + ');'):
+        if (row[1] == column_name):
+            return True
+    return False
+
+# runs alter_command if table_name doesn't have column_name yet (ie: dbs created before the column existed)
+def add_column_if_missing(conn, table_name, column_name, alter_command, schema = 'main'):
+    if (not has_column(conn, table_name, column_name, schema)):
+        conn.execute(alter_command)
 
 
 # ==============================================================================
@@ -465,10 +1211,10 @@ class CountLogDB():
         conn.close()
         return tables
 
+    # counts is the lookup table of {table name: number of rows} from TwitchDB.get_row_counts()
     def insert_counts(self, counts):
         conn = self.get_connection()
-        for table_name, count in counts.items():
-            tuple_to_insert = (table_name, count, int(time.time()))
-            conn.execute('INSERT INTO counts (table_name, value, date_scraped) VALUES (?, ?, ?);', tuple_to_insert)
+        date_scraped = int(time.time())
+        conn.executemany('INSERT INTO counts (table_name, value, date_scraped) VALUES (?, ?, ?);', [(table_name, count, date_scraped) for table_name, count in counts.items()])
         conn.commit()
         conn.close()
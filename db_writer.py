@@ -0,0 +1,284 @@
+# ==============================================================================
+# About: db_writer.py
+# ==============================================================================
+#
+# db_writer.py contains the single writer that makes every commit to a db file
+# - WriteBatch - one typed unit of work (ie: 'streamers', 'snapshots', 'followers', 'logs') that a procedure wants written
+# - DBWriter   - a thread that owns the db's write connection, and group-commits the batches procedures submit to it
+#
+# Procedures never open a write transaction themselves, they submit WriteBatch objects and carry on scraping.
+# -> submit() never blocks, batches wait in an unbounded queue
+# -> batches are written in the order they were submitted, each inside its own savepoint, so one failing batch doesn't undo the others
+# -> every batch waiting in the queue when a commit starts goes into that commit (group commit),
+#    up to max_batches_per_commit batches or max_latency seconds of writing, so no batch waits on an unbounded commit
+# -> a transaction that fails as a whole (ie: its COMMIT) rolls back its batches, and one that can't be started is retried,
+#    either way every batch gets its on_done() and the writer thread keeps running, so flush() and stop() can't hang
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+import traceback
+
+
+# Constants --------------------------------------------------------------------
+
+# the kinds of batches procedures can submit, stats are kept per kind
+WRITE_BATCH_KINDS = ['streamers', 'channels', 'games', 'tags', 'snapshots', 'followers', 'recordings', 'livestreams', 'logs']
+
+
+# ==============================================================================
+# Class: WriteBatch
+# ==============================================================================
+
+# write(conn)        - writes the batch with the writer's connection, it must not commit or roll back
+# on_done(committed) - called on the writer thread once the batch was committed (True) or rolled back (False)
+class WriteBatch():
+
+    def __init__(self, kind, write, on_done = False):
+        if (kind not in WRITE_BATCH_KINDS):
+            raise ValueError('unknown write batch kind: ' + str(kind))
+        self.kind           = kind
+        self.write          = write
+        self.on_done        = on_done
+        self.date_submitted = 0     # <- time.perf_counter() when it was submitted
+        self.committed      = False
+        self.done           = threading.Event()
+        return
+
+    # blocks until the batch was committed or rolled back, returns True if it was committed
+    # -> only for callers that need the data to be in the db before they continue (ie: benchmarks), procedures shouldn't wait
+    def wait(self, timeout = None):
+        self.done.wait(timeout)
+        return self.committed
+
+
+# ==============================================================================
+# Class: DBWriter
+# ==============================================================================
+
+# db is a MixerDB or TwitchDB, the writer uses its get_connection() on its own thread
+class DBWriter():
+
+    # max_begin_attempts - times a transaction is tried before its batches are dropped (ie: 'database is locked' past the connection's timeout)
+    # retry_delay        - seconds between two tries
+    def __init__(self, db, max_latency = 0.5, max_batches_per_commit = 256, max_begin_attempts = 3, retry_delay = 1):
+        self.db                     = db
+        self.max_latency            = max_latency # <- seconds of writing after which a commit stops taking more batches
+        self.max_batches_per_commit = max_batches_per_commit
+        self.max_begin_attempts     = max_begin_attempts
+        self.retry_delay            = retry_delay
+        self.queue                  = queue.Queue()
+        self.thread                 = False
+        self.lock                   = threading.Lock()
+        self.stats = {
+            'num_batches_submitted': 0,
+            'num_batches_committed': 0,
+            'num_batches_failed':    0,
+            'num_begin_failures':    0,  # <- transactions that couldn't be started, their batches are retried up to max_begin_attempts times
+            'num_transactions_failed': 0, # <- transactions that failed as a whole, every batch in them was rolled back
+            'num_commits':           0,
+            'max_queue_depth':       0,
+            'max_batches_per_commit': 0,
+            'seconds_committing':    0,  # <- total seconds spent writing and committing
+            'max_commit_seconds':    0,
+            'total_latency':         0,  # <- total seconds between submit() and the commit, over all committed batches
+            'max_latency_seconds':   0,
+            'num_batches_by_kind':   {kind: 0 for kind in WRITE_BATCH_KINDS}
+        }
+        return
+
+    def start(self):
+        with self.lock:
+            if (self.thread != False):
+                return
+            self.thread = threading.Thread(target=self.__run, name='DBWriter ' + self.db.filepath, daemon=True)
+            self.thread.start()
+
+    # queues a batch to be written, and returns it right away
+    def submit(self, batch):
+        self.start()
+        batch.date_submitted = time.perf_counter()
+        self.queue.put(batch)
+        with self.lock:
+            self.stats['num_batches_submitted'] += 1
+            self.stats['num_batches_by_kind'][batch.kind] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize())
+        return batch
+
+    # blocks until every batch submitted so far has been committed or rolled back
+    def flush(self):
+        if (self.thread != False):
+            self.queue.join()
+
+    # writes everything that's queued, then stops the writer thread
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, False
+        if (thread != False):
+            self.queue.put(None)
+            thread.join()
+
+    # Writing ------------------------------------------------------------------
+
+    def __run(self):
+        conn = self.db.get_connection()
+        conn.isolation_level = None # <- transactions are started and committed by hand below
+        batches = []     # <- the batches taken off the queue for the next transaction, kept for a retry when it couldn't be started
+        num_attempts = 0 # <- times in a row the transaction for batches couldn't be started
+        while (True):
+            if (len(batches) == 0):
+                batch = self.queue.get()
+                if (batch is None):
+                    self.queue.task_done()
+                    break
+                batches = [batch]
+
+            time_started = time.perf_counter()
+            try:
+                self.db.prepare_write_connection(conn) # <- ie: attaches this month's partition of twitch.db, which can't be done inside a transaction
+            except Exception as e:
+                print('db writer: could not prepare the connection: ' + str(e))
+            try:
+                conn.execute('BEGIN IMMEDIATE;')
+            except Exception as e:
+                num_attempts += 1
+                self.__increment('num_begin_failures')
+                if (num_attempts < self.max_begin_attempts):
+                    print('db writer: could not start a transaction, retrying ' + str(len(batches)) + ' batches: ' + str(e))
+                    time.sleep(self.retry_delay)
+                else:
+                    print('db writer: could not start a transaction after ' + str(num_attempts) + ' tries, ' + str(len(batches)) + ' batches were dropped: ' + str(e))
+                    self.__finish(batches, False, time_started)
+                    batches, num_attempts = [], 0
+                continue
+            num_attempts = 0
+
+            # group commit: take every batch that's already queued, but stop once the commit has been writing for max_latency
+            # -> anything that escapes a savepoint (ie: ROLLBACK TO after sqlite aborted the whole transaction) or the COMMIT
+            #    rolls back every batch of the transaction, the writer thread keeps running
+            stop = False
+            try:
+                for batch in batches:
+                    self.__write(conn, batch)
+                while ((len(batches) < self.max_batches_per_commit) and (time.perf_counter() - time_started < self.max_latency)):
+                    try:
+                        batch = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if (batch is None):
+                        stop = True
+                        break
+                    batches.append(batch)
+                    self.__write(conn, batch)
+                conn.execute('COMMIT;')
+                committed = True
+            except Exception as e:
+                committed = False
+                self.__increment('num_transactions_failed')
+                print('db writer: the transaction failed, ' + str(len(batches)) + ' batches were rolled back: ' + str(e))
+                traceback.print_exc()
+                self.__rollback(conn)
+            self.__finish(batches, committed, time_started)
+            batches = []
+
+            if (stop):
+                self.queue.task_done()
+                break
+        self.db.connections.close_thread_connections()
+
+    # ends whatever is left of a failed transaction
+    def __rollback(self, conn):
+        try:
+            if (conn.in_transaction):
+                conn.execute('ROLLBACK;')
+        except Exception:
+            traceback.print_exc()
+
+    # writes one batch inside a savepoint, a batch that raises is rolled back on its own
+    def __write(self, conn, batch):
+        conn.execute('SAVEPOINT write_batch;')
+        try:
+            batch.write(conn)
+            batch.committed = True
+        except Exception:
+            batch.committed = False
+            print('db writer: a ' + batch.kind + ' batch failed and was rolled back')
+            traceback.print_exc()
+            conn.execute('ROLLBACK TO write_batch;')
+        conn.execute('RELEASE write_batch;')
+
+    def __increment(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def __finish(self, batches, committed, time_started):
+        time_finished = time.perf_counter()
+        with self.lock:
+            self.stats['num_commits'] += 1
+            self.stats['seconds_committing'] += time_finished - time_started
+            self.stats['max_commit_seconds'] = max(self.stats['max_commit_seconds'], time_finished - time_started)
+            self.stats['max_batches_per_commit'] = max(self.stats['max_batches_per_commit'], len(batches))
+            for batch in batches:
+                batch.committed = batch.committed and committed
+                if (batch.committed):
+                    latency = time_finished - batch.date_submitted
+                    self.stats['num_batches_committed'] += 1
+                    self.stats['total_latency'] += latency
+                    self.stats['max_latency_seconds'] = max(self.stats['max_latency_seconds'], latency)
+                else:
+                    self.stats['num_batches_failed'] += 1
+
+        for batch in batches:
+            if (batch.on_done != False):
+                try:
+                    batch.on_done(batch.committed)
+                except Exception:
+                    traceback.print_exc()
+            batch.done.set()
+            self.queue.task_done()
+
+    # Stats --------------------------------------------------------------------
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['num_batches_by_kind'] = dict(self.stats['num_batches_by_kind'])
+        total_latency = stats.pop('total_latency')
+        stats['queue_depth']          = self.queue.qsize()
+        stats['mean_commit_seconds']  = round(stats['seconds_committing'] / stats['num_commits'], 4) if (stats['num_commits'] > 0) else 0
+        stats['mean_latency_seconds'] = round(total_latency / stats['num_batches_committed'], 4) if (stats['num_batches_committed'] > 0) else 0
+        stats['seconds_committing']   = round(stats['seconds_committing'], 3)
+        stats['max_commit_seconds']   = round(stats['max_commit_seconds'], 4)
+        stats['max_latency_seconds']  = round(stats['max_latency_seconds'], 4)
+        return stats
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+db_writers = {}  # <- lookup table of {absolute filepath: DBWriter}
+db_writers_lock = threading.Lock()
+
+# returns the DBWriter shared by every procedure in this process that writes to db's file
+def get_db_writer(db):
+    key = os.path.abspath(db.filepath)
+    with db_writers_lock:
+        if (key not in db_writers):
+            db_writers[key] = DBWriter(db)
+        return db_writers[key]
+
+# writes everything that's still queued before the process exits
+def stop_db_writers():
+    with db_writers_lock:
+        writers = list(db_writers.values())
+    for writer in writers:
+        writer.stop()
+
+atexit.register(stop_db_writers)
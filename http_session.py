@@ -0,0 +1,109 @@
+# ==============================================================================
+# About: http_session.py
+# ==============================================================================
+#
+# http_session.py contains the shared HTTP layer used by TwitchAPI and MixerAPI
+# - HTTPSessions - keeps one keep-alive requests.Session per host so TCP+TLS connections get reused
+#
+# All of the API wrappers in a process share the same HTTPSessions object (shared_http_sessions),
+# so worker threads that talk to the same host draw from the same connection pool.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import threading
+import urllib.parse
+
+import requests
+
+
+# ==============================================================================
+# Class: HTTPSessions
+# ==============================================================================
+
+class HTTPSessions():
+
+    def __init__(self, pool_size = 10):
+        self.pool_size = pool_size # <- max number of open connections per host, should be >= number of threads making requests
+        self.sessions  = {}        # <- lookup table of {host: requests.Session}
+        self.lock      = threading.Lock()
+        self.default_headers = {
+            'Connection': 'keep-alive',
+            'Accept-Encoding': 'gzip, deflate'
+        }
+        return
+
+    # sets the number of connections kept open per host
+    # -> call this before any requests are made, sessions that already exist keep their old pool size
+    def set_pool_size(self, pool_size):
+        with self.lock:
+            self.pool_size = max(1, int(pool_size))
+
+    # Sessions -----------------------------------------------------------------
+
+    # returns the requests.Session for the host in url, creating it if necessary
+    def get_session(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if (host not in self.sessions):
+                self.sessions[host] = self.__create_session()
+            return self.sessions[host]
+
+    def __create_session(self):
+        session = requests.Session()
+        session.headers.update(self.default_headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    # closes all open connections
+    def close(self):
+        with self.lock:
+            for host, session in self.sessions.items():
+                session.close()
+            self.sessions = {}
+
+    # Requests -----------------------------------------------------------------
+
+    def get(self, url, params = None, headers = None, timeout = None):
+        return self.get_session(url).get(url, params=params, headers=headers, timeout=timeout)
+
+    def post(self, url, params = None, headers = None, timeout = None):
+        return self.get_session(url).post(url, params=params, headers=headers, timeout=timeout)
+
+    # Stats --------------------------------------------------------------------
+
+    # returns stats about each host's connection pool
+    # -> num_connections: number of connections the pool has opened
+    # -> num_requests:    number of requests sent through the pool
+    # -> num_reused:      number of requests that reused an already open connection
+    def get_stats(self):
+        stats = {}
+        with self.lock:
+            sessions = dict(self.sessions)
+
+        for host, session in sessions.items():
+            host_stats = {'pool_size': 0, 'num_connections': 0, 'num_requests': 0, 'num_reused': 0}
+            adapters = {}
+            for prefix, adapter in session.adapters.items():
+                adapters[id(adapter)] = adapter
+            for adapter in adapters.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if (pool is None):
+                        continue
+                    host_stats['pool_size']       = max(host_stats['pool_size'], pool.pool.maxsize)
+                    host_stats['num_connections'] += pool.num_connections
+                    host_stats['num_requests']    += pool.num_requests
+            host_stats['num_reused'] = max(0, host_stats['num_requests'] - host_stats['num_connections'])
+            stats[host] = host_stats
+        return stats
+
+
+# Shared Sessions --------------------------------------------------------------
+
+# every TwitchAPI and MixerAPI object in this process sends its requests through this object
+shared_http_sessions = HTTPSessions()
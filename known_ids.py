@@ -0,0 +1,133 @@
+# ==============================================================================
+# About: known_ids.py
+# ==============================================================================
+#
+# known_ids.py contains the sets of ids the scraping procedures check scraped objects against (ie: is this game in the db yet?)
+# - KnownIDSet - the ids of one table, read once and then kept up to date with the rows added since
+#
+# The procedures used to load a whole table into a {id: True} dict every run, a KnownIDSet instead:
+# -> keeps integer ids in a sorted array('q'), 8 bytes an id instead of the ~100 of a dict entry, and looks them up with bisect
+# -> reads the whole table once, after that refresh() only reads the rows whose rowid is above the last one it read
+# -> keeps the ids added since the last merge in a small set, which is merged into the sorted ids once it has
+#    merge_size ids or 1/16th of the number of sorted ids (whichever is more), so merging stays a small share of the work
+# -> is shared by every procedure in a process that reads the same table, see get_known_id_set()
+#
+# ids are never removed, the tables they come from only get rows added (or replaced by a row with the same id).
+# refresh() only reads committed rows: it does nothing on a connection that's inside a transaction,
+# so the rows of a transaction that's rolled back later never get in. Rows the writer commits are added with add().
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import array
+import bisect
+import threading
+
+
+# ==============================================================================
+# Class: KnownIDSet
+# ==============================================================================
+
+class KnownIDSet():
+
+    # select_command - the sql command that returns (rowid, id) for the rows whose rowid > :rowid, ordered by rowid
+    # typecode       - the array typecode the ids are kept in, False for ids that aren't integers (ie: tag_ids), kept in a sorted list
+    # merge_size     - the least number of added ids that are kept in a set before they're merged into the sorted ids
+    def __init__(self, select_command, typecode = 'q', merge_size = 4096):
+        self.select_command = select_command
+        self.typecode   = typecode
+        self.merge_size = merge_size
+        self.ids        = self.__to_sorted_ids([]) # <- sorted, without duplicates
+        self.added      = set() # <- ids added since the last merge, none of them are in self.ids
+        self.rowid      = 0     # <- the highest rowid refresh() has read
+        self.lock       = threading.Lock()
+        self.stats      = {'num_refreshes': 0, 'num_rows_read': 0, 'num_added': 0, 'num_merges': 0}
+        return
+
+    def __contains__(self, id):
+        with self.lock:
+            return self.__contains(id)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.ids) + len(self.added)
+
+    # Updates ------------------------------------------------------------------
+
+    # reads the ids of the rows added to the table since the last refresh, returns self
+    # -> the first refresh reads the whole table
+    # -> does nothing if conn is inside a transaction, refresh with a reader connection (ie: at the start of a procedure)
+    def refresh(self, conn):
+        if (conn.in_transaction):
+            return self
+        with self.lock:
+            rowid = self.rowid
+
+        ids = self.__to_sorted_ids([]) if (self.typecode == False) else array.array(self.typecode)
+        for row_rowid, id in conn.execute(self.select_command, {'rowid': rowid}):
+            ids.append(id)
+            rowid = row_rowid
+
+        with self.lock:
+            self.stats['num_refreshes'] += 1
+            self.stats['num_rows_read'] += len(ids)
+            if ((len(self.ids) == 0) and (len(self.added) == 0)):
+                self.ids = self.__to_sorted_ids(ids) # <- the first refresh, sorted once instead of merged (ids are primary keys, so they're unique)
+            else:
+                self.__add(ids)
+            self.rowid = max(self.rowid, rowid)
+        return self
+
+    # adds ids to the set (ie: the ids of rows the caller just committed)
+    def add(self, ids):
+        with self.lock:
+            self.__add(ids)
+
+    # Helpers ------------------------------------------------------------------
+
+    # both of these need self.lock to be held
+
+    def __contains(self, id):
+        i = bisect.bisect_left(self.ids, id)
+        return ((i < len(self.ids)) and (self.ids[i] == id)) or (id in self.added)
+
+    def __add(self, ids):
+        for id in ids:
+            if (not self.__contains(id)):
+                self.added.add(id)
+                self.stats['num_added'] += 1
+        if (len(self.added) >= max(self.merge_size, len(self.ids) // 16)):
+            self.ids = self.__to_sorted_ids(list(self.ids) + sorted(self.added)) # <- two sorted runs, which sorted() merges in linear time
+            self.added = set()
+            self.stats['num_merges'] += 1
+
+    def __to_sorted_ids(self, ids):
+        ids = sorted(ids)
+        return ids if (self.typecode == False) else array.array(self.typecode, ids)
+
+    # Stats --------------------------------------------------------------------
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['num_ids'] = len(self.ids) + len(self.added)
+            stats['num_bytes'] = (len(self.ids) * self.ids.itemsize) if (self.typecode != False) else False
+        return stats
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+known_id_sets = {}  # <- lookup table of {(absolute filepath, select command): KnownIDSet}
+known_id_sets_lock = threading.Lock()
+
+# returns the KnownIDSet shared by every db wrapper in this process that reads ids from this db file with select_command
+def get_known_id_set(filepath, select_command, typecode = 'q'):
+    key = (os.path.abspath(filepath), select_command)
+    with known_id_sets_lock:
+        if (key not in known_id_sets):
+            known_id_sets[key] = KnownIDSet(select_command, typecode)
+        return known_id_sets[key]
@@ -14,12 +14,14 @@ import csv
 import time
 import math
 import datetime
+import threading
 
 
 # TimeLogs ---------------------------------------------------------------------
 
 # class is used to record timing and number of different actions (ie: API requests)
 # - It is imported by TwitchAPI
+# - It is thread-safe, each thread can have one action of each type in progress at a time
 # NOTE: all times are in milliseconds
 class TimeLogs():
 
@@ -28,48 +30,63 @@ class TimeLogs():
         self.action_categories = action_categories
         for type in action_categories:
             self.logs[type] = []
+        self.open_actions = {} # { (request_name, thread_id): index into self.logs[request_name] }
+        self.counters = {}     # { counter_name: value }, ie: number of retries
+        self.lock = threading.Lock()
         self.time_initialized = self.__get_current_time()
         self.items_processed = 0
 
 
     # resets TimeLogs object
     def reset(self):
-        self.logs = {}
-        for type in self.action_categories:
-            self.logs[type] = []
-        self.time_initialized = self.__get_current_time()
-        self.items_processed = 0
+        with self.lock:
+            self.logs = {}
+            for type in self.action_categories:
+                self.logs[type] = []
+            self.open_actions = {}
+            self.counters = {}
+            self.time_initialized = self.__get_current_time()
+            self.items_processed = 0
 
     # Actions ------------------------------------------------------------------
 
     def start_action(self, action_type):
+        key = (action_type, threading.get_ident())
+        with self.lock:
 
-        # case 0: this action type DNE and needs to be registered
-        if (action_type not in self.logs):
-            self.logs[action_type] = [ {'start': self.__get_current_time(), 'end': 0} ]
-            return
+            # case 0: this action type DNE and needs to be registered
+            if (action_type not in self.logs):
+                self.logs[action_type] = []
 
-        # case 1: there are no actions on record
-        if (len(self.logs[action_type]) == 0):
-            self.logs[action_type].append({'start': self.__get_current_time(), 'end': 0})
-            return
+            # case 1: this thread's latest action is not finished yet, so we can't do anything
+            if (key in self.open_actions):
+                return
 
-        # case 2: the latest action is already finished so we can register a new one
-        # -> note: if the current action is not finished yet, we can't do anything
-        current_action = self.logs[action_type][-1]
-        if (current_action['end'] > 0):
+            # case 2: register a new action for this thread
             self.logs[action_type].append({'start': self.__get_current_time(), 'end': 0})
-            return
+            self.open_actions[key] = len(self.logs[action_type]) - 1
 
 
     def end_action(self, action_type):
+        key = (action_type, threading.get_ident())
+        with self.lock:
+            if (key not in self.open_actions):
+                return
+
+            index = self.open_actions.pop(key)
+            self.logs[action_type][index]['end'] = self.__get_current_time()
 
-        if ((action_type not in self.logs) or (len(self.logs[action_type]) == 0)):
-            return
 
-        last_index = len(self.logs[action_type]) - 1
-        if (self.logs[action_type][last_index]['end'] == 0):
-            self.logs[action_type][last_index]['end'] = self.__get_current_time()
+    # Counters -----------------------------------------------------------------
+
+    # increments a counter (ie: number of retries for a request type)
+    def increment(self, counter_name, n = 1):
+        with self.lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + n
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
 
 
     def get_time_since_start(self):
@@ -97,14 +114,20 @@ class TimeLogs():
                 print(" - std_dev: ", stats['std_dev'], "ms")
                 print(" - min: ", stats['min'], "ms")
                 print(" - max: ", stats['max'], "ms")
+        for counter_name, value in self.get_counters().items():
+            print("Counter: ", counter_name, value)
         print("Total Time: ", self.get_time_since_start(), "ms")
 
     # gets stats about each request in logs
+    # -> counters are included under the 'counters' key if any were incremented
     def get_stats_from_logs(self):
         stats = {}
-        for action_category, actions in self.logs.items():
-            if (len(actions) > 0):
-                stats[action_category] = self.__calc_stats_about_action(actions)
+        with self.lock:
+            for action_category, actions in self.logs.items():
+                if (len(actions) > 0):
+                    stats[action_category] = self.__calc_stats_about_action(actions)
+            if (len(self.counters) > 0):
+                stats['counters'] = dict(self.counters)
         return stats
 
     def __calc_stats_about_action(self, actions):
@@ -131,7 +154,7 @@ class TimeLogs():
         # calc mean
         for t in times:
             mean += t
-        mean = mean / len(times)
+        mean = mean / len(times) if (len(times) > 0) else 0
 
         # calc std_dev
         for t in times:
@@ -16,6 +16,11 @@ import requests
 from logs import *
 from db_manager import *
 from stats_objects import *
+from http_session import *
+from resilience import *
+from worker_pool import *
+from rate_limiter import *
+from db_writer import *
 
 # ==============================================================================
 # Data Classes
@@ -159,6 +164,10 @@ class MixerChannel():
     def get_num_current_viewers(self):
         return self.current_stream_info.get_num_viewers()
 
+    # a short hash of the profile columns saved in the channels table
+    def get_profile_hash(self):
+        return get_values_hash(self.get_db_tuple('update-channel'))
+
 
     def get_db_tuple(self, object_type):
         if (object_type == 'insert-channel'):
@@ -349,33 +358,26 @@ class MixerRecordings():
 # Class MixerAPI
 # ==============================================================================
 
+# every MixerAPI in this process draws from the same rate-limit buckets
+# -> channel-search: 20 requests per 5 seconds
+# -> general:        this wasn't provided by Mixer's documentation, same as the 'Global' rate limit
+mixer_rate_limit_governors = {
+    'channel-search': RateLimitGovernor(20, 5),
+    'general':        RateLimitGovernor(1000, 60)
+}
+
 class MixerAPI():
 
-    def __init__(self, credentials):
-        self.client_id = credentials['client_id']
-        self.rate_limit_bucket = {
-            'channel-search': 20,
-            'general': 1000         # <- this wasn't provided by Mixer's documentation,
-        }
-        self.rate_limit_times = {
-            'channel-search': 5 / 20,  # 20 requests per 5 seconds -> allowed 1 every 0.25 seconds
-            'general': 60 / 1000       # same as the 'Global' rate limit
-        }
-
-
-    # sleeps the appropriate amount to not overload the API's rate limit
-    # pass in the rate-limit object given by Mixer's API request response header
-    def __sleep_before_executing(self, bucket):
-        if (self.rate_limit_bucket[bucket] == 0):
-            time.sleep(self.rate_limit_times[bucket])
-
-    # sleeps the appropriate amount to not overload the API's rate limit
-    # uses r.headers to determine the update rate-limit left in this bucket
-    def __sleep_after_executing(self, header, bucket):
-        if ('X-RateLimit-Remaining' in header):
-            self.rate_limit_bucket[bucket] = int(header['X-RateLimit-Remaining'])
-            if (self.rate_limit_bucket[bucket] <= 1):
-                time.sleep(self.rate_limit_times[bucket])
+    # credentials can optionally set 'api_base_url' to point the scraper at another server
+    # -> ie: tools/api_stand_in_server.py for benchmarking without hitting the live API
+    def __init__(self, credentials, governors = mixer_rate_limit_governors):
+        self.client_id    = credentials['client_id']
+        self.api_base_url = credentials.get('api_base_url', 'https://mixer.com')
+        self.governors    = governors
+        self.breakers     = shared_circuit_breakers
+        self.retry_policy = default_retry_policy
+        self.timeout      = (10, 30) # <- (connect, read) seconds
+        self.channels_page_size = 100
 
 
     def __get_default_headers(self):
@@ -383,45 +385,111 @@ class MixerAPI():
 
 
     # a wrapper for sending requests, wraps TimeLogs actions
-    def __get(self, url, params, timelogs, request_type):
-        if (timelogs != False):
-            timelogs.start_action(request_type)
-        r = requests.get(url, params)
-        if (timelogs != False):
-            timelogs.end_action(request_type)
+    # -> every request waits for a permit from the shared governor for its rate-limit bucket
+    # -> Mixer's X-RateLimit-Remaining/X-RateLimit-Reset headers (reset is in epoch milliseconds) are fed back into the governor
+    # -> connection errors, 5xx and 429 responses are retried with backoff, and each endpoint has its own circuit breaker
+    # -> returns False instead of a response if the request couldn't be sent at all
+    def __get(self, url, params, timelogs, request_type, bucket):
+        governor = self.governors[bucket]
+
+        def send():
+            if (timelogs != False):
+                timelogs.start_action('rate_limit_wait')
+            governor.acquire()
+            if (timelogs != False):
+                timelogs.end_action('rate_limit_wait')
+                timelogs.start_action(request_type)
+            try:
+                r = shared_http_sessions.get(url, params=params, timeout=self.timeout)
+            finally:
+                if (timelogs != False):
+                    timelogs.end_action(request_type)
+
+            if (r.status_code == 429):
+                governor.throttle(r.headers, 'X-RateLimit-Reset', 1000)
+            else:
+                governor.update_from_headers(r.headers, 'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset', 1000)
+            return r
+
+        breaker = self.breakers.get('mixer/' + request_type)
+        r = send_request(send, request_type, breaker, self.retry_policy, timelogs)
         return r, timelogs
 
     # scrapes Mixer's list of live channels and returns them as a MixerChannels object
     # this endpoint can be called from different pages
     def scrape_live_channels(self, channels, page=0, timelogs=False):
+        items, timelogs = self.fetch_live_channels_page(page, timelogs)
+        if (items != False):
+            for channel in items:
+                channels.add_from_api(channel)
+        return channels, page + 1, timelogs
 
-        # pre-request actions
-        self.__sleep_before_executing("channel-search")
+    # fetches one page of live channels without parsing them into MixerChannel objects
+    # returns the list of channel dicts from the API, or False if the request failed
+    def fetch_live_channels_page(self, page, timelogs=False):
 
         # prepare headers
         params = self.__get_default_headers()
         #params['where'] = 'viewersCurrent:gt:2'
-        params['limit'] = 100
+        params['limit'] = self.channels_page_size
         params['order'] = 'viewersCurrent:DESC'
         params['page']  = page
 
         # perform request
-        r, timelogs = self.__get('https://mixer.com/api/v1/channels', params, timelogs, 'get_live_channels')
-        if (r.status_code == 200):
-            for channel in r.json():
-                channels.add_from_api(channel)
+        items = False
+        r, timelogs = self.__get(self.api_base_url + '/api/v1/channels', params, timelogs, 'get_live_channels', 'channel-search')
+        if ((r != False) and (r.status_code == 200)):
+            items = r.json()
+        return items, timelogs
+
+    # scrapes all live channels by requesting windows of window_size pages at a time
+    # -> the crawl stops after the first window with a short, empty or failed page
+    # -> pages are ordered by viewers, so a channel can move between pages while the crawl is running,
+    #    only the first copy of a channel is kept and the rest are counted in num_channels_moved
+    # returns (channels, num_channels_moved, timelogs)
+    def scrape_live_channels_fanout(self, channels, window_size = 4, timelogs = False):
+        pool = WorkerPool(window_size)
+        seen_ids = {}
+        num_channels_moved = 0
+        page = 0
+
+        def fetch(page_num):
+            items, _ = self.fetch_live_channels_page(page_num, timelogs)
+            return items
+
+        while True:
+            window = list(range(page, page + window_size))
+            results = pool.map(fetch, window)
+
+            # add pages in order, so the channels on earlier pages win ties
+            done = False
+            for page_num in window:
+                items = results[page_num]
+                if (items == False):
+                    done = True
+                    break
+                for item in items:
+                    if (item['id'] in seen_ids):
+                        num_channels_moved += 1
+                        continue
+                    seen_ids[item['id']] = True
+                    channels.add_from_api(item)
+                if (len(items) < self.channels_page_size):
+                    done = True
+                    break
+
+            if (done):
+                break
+            page += window_size
 
-        # post-request actions
-        self.__sleep_after_executing(r.headers, 'channel-search')
-        return channels, page + 1, timelogs
+        return channels, num_channels_moved, timelogs
 
 
     # scrapes a channel's recordings on Mixer
     # this endpoint can be called from different pages
+    # -> returns False instead of the next page number if the request failed
     def scrape_recordings(self, channel_id, recordings, page=0, timelogs=False):
 
-        self.__sleep_before_executing('general')
-
         # prepare headers
         params = self.__get_default_headers()
         params['limit'] = 100
@@ -429,40 +497,36 @@ class MixerAPI():
         params['page']  = page
 
         # perform request
-        r, timelogs = self.__get('https://mixer.com/api/v1/recordings', params, timelogs, 'get_recordings')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/api/v1/recordings', params, timelogs, 'get_recordings', 'general')
+        next_page = False
+        if ((r != False) and (r.status_code == 200)):
             for row in r.json():
                 recordings.add_from_api(row)
+            next_page = page + 1
 
-        self.__sleep_after_executing(r.headers, 'general')
-        return recordings, page + 1, timelogs
+        return recordings, next_page, timelogs
 
 
     # gets a specified game
     def scrape_game(self, game_id, timelogs = False):
-        self.__sleep_before_executing('general')
-
         # prepare headers
         game = False
         params = self.__get_default_headers()
-        url = 'https://mixer.com/api/v1/types/' + str(game_id)
-        r, timelogs = self.__get(url, params, timelogs, 'get_game')
-        if (r.status_code == 200):
+        url = self.api_base_url + '/api/v1/types/' + str(game_id)
+        r, timelogs = self.__get(url, params, timelogs, 'get_game', 'general')
+        if ((r != False) and (r.status_code == 200)):
             game = MixerGame(r.json(), 'api/channels')
 
-        self.__sleep_after_executing(r.headers, 'general')
         return game, timelogs
 
 
     def scrape_channel(self, channel_id, timelogs = False):
-        self.__sleep_before_executing('channel-search')
         channel = False
         params = self.__get_default_headers()
-        url = 'https://mixer.com/api/v1/channels/' + str(channel_id)
-        r, timelogs = self.__get(url, params, timelogs, 'get_channel')
-        if (r.status_code == 200):
+        url = self.api_base_url + '/api/v1/channels/' + str(channel_id)
+        r, timelogs = self.__get(url, params, timelogs, 'get_channel', 'channel-search')
+        if ((r != False) and (r.status_code == 200)):
             channel = MixerChannel(r.json(), 'api/channels')
-        self.__sleep_after_executing(r.headers, 'channel-search')
         return channel, timelogs
 
 
@@ -478,17 +542,35 @@ class MixerScraper():
         credentials = json.load(open('credentials.json'))
         self.mixer = MixerAPI(credentials['mixer'])
         self.db = MixerDB()
+        self.writer = get_db_writer(self.db) # <- every write goes through the process' one writer thread, see db_writer.py
         self.timelog_actions = []
         self.print_mode_on = False
+        self.num_page_workers = 4 # <- number of live channel pages requested at once, 1 crawls one page at a time
+        self.num_recording_workers = 8        # <- number of channels whose recordings are crawled at once
+        self.num_channels_for_recordings = 100
+        self.num_channels_for_inactive = 1001 # <- channels re-scraped per run of procedure_scrape_inactive
+        self.recordings_write_batch_size = 25 # <- finished channels are written to the db in batches of this size
         return
 
     def set_print_mode(self, v):
         self.print_mode_on = v;
 
+    # sets how many live channel pages procedure_scrape_livestreams requests at once
+    def set_num_page_workers(self, n):
+        self.num_page_workers = max(1, int(n))
+
+    # sets how many channels procedure_scrape_recordings crawls at once
+    def set_num_recording_workers(self, n):
+        self.num_recording_workers = max(1, int(n))
+
     def __print(self, message):
         if (self.print_mode_on == True):
             print(message)
 
+    # queues write(conn) for the db writer thread and returns right away
+    def __submit(self, kind, write, on_done = False):
+        return self.writer.submit(WriteBatch(kind, write, on_done))
+
 
     # Procedure: Scrape Livestreams --------------------------------------------
 
@@ -506,83 +588,99 @@ class MixerScraper():
     def procedure_scrape_livestreams(self):
 
         time_started = int(time.time())
-        stats = {'num_new_games': 0, 'num_channels_inserted': 0, 'num_channels_updated': 0}
+        stats = {'num_new_games': 0, 'num_channels_inserted': 0, 'num_channels_updated': 0, 'num_channels_changed': 0, 'num_channels_unchanged': 0, 'num_channels_moved': 0}
 
         # Phase 1: Scrape all live channels and games --------------------------
 
-        # 1) scrape all live mixer channels
+        # 1) scrape all live mixer channels, either a window of pages at a time or one page at a time
         channels, page, timelogs = MixerChannels(), 0, TimeLogs(self.timelog_actions)
-        old_num_channels = 0
-        while(True):
-            self.__print(" - page:" + str(page))
-            channels, page, timelogs = self.mixer.scrape_live_channels(channels, page, timelogs)
+        if (self.num_page_workers > 1):
+            self.__print(" - scraping pages in windows of " + str(self.num_page_workers))
+            channels, stats['num_channels_moved'], timelogs = self.mixer.scrape_live_channels_fanout(channels, self.num_page_workers, timelogs)
+        else:
+            old_num_channels = 0
+            while(True):
+                self.__print(" - page:" + str(page))
+                channels, page, timelogs = self.mixer.scrape_live_channels(channels, page, timelogs)
 
-            # if we haven't scraped any new channels this round, break from the loop
-            if (old_num_channels == len(channels.get_channel_ids())):
-                break
-            old_num_channels = len(channels.get_channel_ids())
+                # if we haven't scraped any new channels this round, break from the loop
+                if (old_num_channels == len(channels.get_channel_ids())):
+                    break
+                old_num_channels = len(channels.get_channel_ids())
 
         # get games from live channels and aggregate stats about that data
         live_games = channels.get_all_games()
         platform_stats = self.get_platform_stats_for_games(channels)
 
+        # the game_ids already in the db, a KnownIDSet shared with the other procedures that only reads the games added since its last refresh
+        conn = self.db.get_reader_connection()
+        known_game_ids = self.db.get_all_game_ids(conn)
+        self.db.release_connection(conn)
 
-        # Phase 2: Insert Games Data into DB -----------------------------------
 
-        # connect to the database and get a list of all the channels that are already in the db
-        conn = self.db.get_connection()
-        existing_channel_ids = self.db.get_all_channel_ids(conn)
-        existing_game_ids    = self.db.get_all_game_ids(conn)
+        # Phase 2: Queue Games Data for the db writer --------------------------
+        # -> the batches are written in this order on the writer thread, this thread doesn't wait for them
+        # -> the channels already in the db are read on the writer's connection, right before they're written
 
-        # Insert new games
-        for game_id, game in live_games.items():
-            if (game.id not in existing_game_ids):
-                self.db.insert_game(conn, game)
-                stats['num_new_games'] += 1
+        # insert new games, and aggregate game data from all live channels and save stats about each game
+        new_games = []
+        def write_games(conn):
+            new_games[:] = [game for game_id, game in live_games.items() if (game.id not in known_game_ids)]
+            self.db.insert_games(conn, new_games)
+            stats['num_new_games'] += len(new_games)
+            self.db.insert_game_snapshots(conn, platform_stats.values())
 
+        # committed games are known from now on, without waiting for the next refresh
+        def on_games_done(committed):
+            if (committed):
+                known_game_ids.add([game.id for game in new_games])
 
-        # 4) aggregate game data from all live channels and save stats about each game
-        for game_id, stats_object in platform_stats.items():
-            self.db.insert_game_snapshot(conn, stats_object)
+        self.__submit('games', write_games, on_games_done)
 
-        # Phase 3: Insert Channels Data into DB --------------------------------
+        # Phase 3: Queue Channels Data for the db writer -----------------------
 
         # for each valid channel, save their info to tables
-        for channel_id in channels.get_channel_ids_with_viewers():
-            channel = channels.get(channel_id)
+        live_channels = [channels.get(channel_id) for channel_id in channels.get_channel_ids_with_viewers()]
 
-            # insert or update channel
-            if (channel_id not in existing_channel_ids):
-                self.db.insert_new_channel(conn, channel)
-                stats['num_channels_inserted'] += 1
-            else:
-                self.db.update_channel(conn, channel)
-                stats['num_channels_updated'] += 1
+        def write_channels(conn):
+            existing_channels  = self.db.get_channel_profile_hashes(conn, [channel.id for channel in live_channels]) # <- {channel_id: profile_hash}
+            new_channels       = [channel for channel in live_channels if (channel.id not in existing_channels)]
+            channels_to_update = [channel for channel in live_channels if (channel.id in existing_channels)]
+
+            # insert or update channels
+            self.db.insert_new_channels(conn, new_channels)
+            num_changed = self.db.update_channels_if_changed(conn, channels_to_update, existing_channels)
+            stats['num_channels_inserted']  += len(new_channels)
+            stats['num_channels_updated']   += len(channels_to_update)
+            stats['num_channels_changed']   += num_changed
+            stats['num_channels_unchanged'] += len(channels_to_update) - num_changed
 
             # insert regular time-series data
-            self.db.insert_time_series_data(conn, channel, 'followers')
-            self.db.insert_time_series_data(conn, channel, 'lifetime_viewers')
-            self.db.insert_time_series_data(conn, channel, 'sparks')
-            self.db.insert_time_series_data(conn, channel, 'experience')
+            self.db.insert_time_series_data_for_channels(conn, live_channels, 'followers')
+            self.db.insert_time_series_data_for_channels(conn, live_channels, 'lifetime_viewers')
+            self.db.insert_time_series_data_for_channels(conn, live_channels, 'sparks')
+            self.db.insert_time_series_data_for_channels(conn, live_channels, 'experience')
 
             # insert value-sensitive time-series data
-            self.db.insert_time_series_data_by_value(conn, channel, 'partnered')
+            self.db.insert_time_series_data_by_value_for_channels(conn, live_channels, 'partnered')
+
+        self.__submit('channels', write_channels)
 
-            # insert livestreams snapshot
-            self.db.insert_livestream_snapshot(conn, channel)
+        # insert livestreams snapshots
+        self.__submit('snapshots', lambda conn: self.db.insert_livestream_snapshots(conn, live_channels))
 
 
         # Phase 4: Save Logs ---------------------------------------------------
 
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
-        stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-livestreams', time_started, timelog_str, stats_str)
 
-        conn.commit()
-        conn.close()
+        # written after the batches above, so the stats they fill in are in the log
+        def write_logs(conn):
+            self.db.insert_logs(conn, 'scrape-livestreams', time_started, timelog_str, json.dumps(stats))
+            for k, v in stats.items():
+                self.__print(k + ': ' + str(v))
 
-        for k, v in stats.items():
-            self.__print(k + ': ' + str(v))
+        self.__submit('logs', write_logs)
         return
 
 
@@ -607,84 +705,110 @@ class MixerScraper():
 
     # gets a list of channels in the database that have recordings enabled but don't have any in the recordings table
     # This procedure is broken into 3 parts in order to minimize non-writing time spent holding the database lock
+    # -> channels are crawled by a pool of worker threads, and finished channels are written in small batches as they complete
     def procedure_scrape_recordings(self):
 
         time_started = int(time.time())
+        stats = {'num_channels_with_recordings': 0, 'num_channels_no_recordings': 0, 'num_channels_failed': 0, 'num_recordings': 0, 'num_games_added': 0, 'num_game_lookups_coalesced': 0}
 
         # Phase 1: Get info from DB about what needs to be scraped -------------
 
         # 1.a) get list of channels we want to grab recordings for
-        #   -> reduce total sample space to a batch of 500 channels
-        conn = self.db.get_connection()
-        all_channel_ids = self.db.get_channel_ids_that_need_recordings(conn)
-        ids_to_scrape = []
-        for i in range(min(len(all_channel_ids), 100)):
-            ids_to_scrape.append(all_channel_ids[i])
-        self.__print('channels available: ' + str(len(all_channel_ids)))
+        #   -> reduce total sample space to a batch of channels
+        #   -> only reads the first num_channels_for_recordings rows of the channel_work index, however many channels are waiting
+        conn = self.db.get_reader_connection()
+        ids_to_scrape = self.db.get_channel_ids_that_need_recordings(conn, self.num_channels_for_recordings)
         self.__print('channels being scraped this round: ' + str(len(ids_to_scrape)))
 
 
         # 1.b) get a lookup table of all game_ids that are already in our dataset
         #   -> we will use this so we know when to add new games found in the scraped recordings
         known_game_ids = self.db.get_all_game_ids(conn)
-        conn.close()
+        self.db.release_connection(conn)
 
 
         # Phase 2: Use API to scrape all recordings and games ------------------
 
-        recordings_by_channels = {} # lookup table { channel_id -> MixerRecordings() }
-        new_games = {}              # lookup table { game_id -> MixerGame() }
         timelogs = TimeLogs(self.timelog_actions)
-
-        for channel_id in ids_to_scrape:
-
-            # Grab all the recordings for this channel
-            recordings, timelogs = self.get_all_recordings_for_channel(channel_id, timelogs)
-            recordings_by_channels[channel_id] = recordings
-
-            # add any new games that are in these recordings
+        game_lookups = InFlightLookups() # <- channels that find the same new game at the same time share one scrape_game request
+
+        def scrape_game(game_id):
+            game, _ = self.mixer.scrape_game(game_id, timelogs)
+            return game
+
+        # grabs all the recordings for a channel, and any new games that are in these recordings
+        # returns (recordings, {game_id -> MixerGame}), recordings is False if the channel failed
+        def crawl_channel(channel_id):
+            recordings, _ = self.get_all_recordings_for_channel(channel_id, timelogs)
+            games = {}
+            if (recordings == False):
+                return recordings, games
             for recording_id in recordings.get_all_recording_ids():
                 recording = recordings.get(recording_id)
                 if ((recording.game_id not in known_game_ids) and (recording.game_id != -1)):
-                    game, timelogs = self.mixer.scrape_game(recording.game_id, timelogs)
+                    game = game_lookups.get(recording.game_id, lambda game_id = recording.game_id: scrape_game(game_id))
                     if (game != False):
-                        new_games[game.id]      = game
-                        known_game_ids[game.id] = True
-
-
-
-        # Phase 3: Write recordings and games to the database ------------------
-
-        stats = {'num_channels_with_recordings': 0, 'num_channels_no_recordings': 0, 'num_recordings': 0, 'num_games_added': 0}
-
-        conn = self.db.get_connection()
-
-        # save games
-        for game_id, game in new_games.items():
-            stats['num_games_added'] += 1
-            self.db.insert_game(conn, game)
-
-        # save recordings
-        for channel_id, recordings in recordings_by_channels.items():
-            recording_ids = recordings.get_all_recording_ids()
-            if (len(recording_ids) > 0):
-                stats['num_channels_with_recordings'] += 1
-                for id in recording_ids:
-                    stats['num_recordings'] += 1
-                    self.db.insert_recording_for_channel(conn, recordings.get(id))
-            else:
-                self.db.insert_channel_with_no_recordings(conn, channel_id)
-                stats['num_channels_no_recordings'] += 1
+                        games[game.id] = game
+            return recordings, games
+
+
+        # Phase 3: Queue recordings and games for the db writer as channels finish
+
+        finished_channels = [] # <- list of (channel_id, recordings, games) that haven't been written yet
+        written_game_ids  = {}
+
+        def write_finished_channels():
+            games_to_insert, recordings_to_insert, channel_ids_with_no_recordings = [], [], []
+            for channel_id, recordings, games in finished_channels:
+
+                # collect games
+                for game_id, game in games.items():
+                    if (game_id not in written_game_ids):
+                        written_game_ids[game_id] = True
+                        games_to_insert.append(game)
+
+                # collect recordings
+                recording_ids = recordings.get_all_recording_ids()
+                if (len(recording_ids) > 0):
+                    stats['num_channels_with_recordings'] += 1
+                    for id in recording_ids:
+                        recordings_to_insert.append(recordings.get(id))
+                else:
+                    channel_ids_with_no_recordings.append(channel_id)
+
+            # save everything in one batch
+            def write_recordings(conn):
+                self.db.insert_games(conn, games_to_insert)
+                self.db.insert_recordings(conn, recordings_to_insert)
+                self.db.insert_channels_with_no_recordings(conn, channel_ids_with_no_recordings)
+
+            def on_recordings_done(committed):
+                if (committed):
+                    known_game_ids.add([game.id for game in games_to_insert])
+
+            self.__submit('recordings', write_recordings, on_recordings_done)
+            stats['num_games_added']            += len(games_to_insert)
+            stats['num_recordings']             += len(recordings_to_insert)
+            stats['num_channels_no_recordings'] += len(channel_ids_with_no_recordings)
+            del finished_channels[:]
+
+        pool = WorkerPool(self.num_recording_workers)
+        for channel_id, (recordings, games) in pool.map_unordered(crawl_channel, ids_to_scrape):
+            if (recordings == False):
+                stats['num_channels_failed'] += 1 # <- channels that failed will be retried next run
+                continue
+            finished_channels.append((channel_id, recordings, games))
+            if (len(finished_channels) >= self.recordings_write_batch_size):
+                write_finished_channels()
+        write_finished_channels()
+        stats['num_game_lookups_coalesced'] = game_lookups.get_stats()['num_coalesced']
 
 
         # Phase 4: Write logs to database --------------------------------------
 
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
         stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-recordings', time_started, timelog_str, stats_str)
-
-        conn.commit()
-        conn.close()
+        self.__submit('logs', lambda conn: self.db.insert_logs(conn, 'scrape-recordings', time_started, timelog_str, stats_str))
 
         # print stats
         for key, value in stats.items():
@@ -694,6 +818,8 @@ class MixerScraper():
 
 
     # calls the MixerAPI to get a MixerRecordings object containing all the recordings for a given channel
+    # -> returns False instead of a MixerRecordings object if one of the requests failed,
+    #    so the channel isn't mistaken for a channel with no recordings
     def get_all_recordings_for_channel(self, channel_id, timelogs):
 
         recordings, page = MixerRecordings(), 0
@@ -701,6 +827,8 @@ class MixerScraper():
 
         while(True):
             recordings, page, timelogs = self.mixer.scrape_recordings(channel_id, recordings, page, timelogs)
+            if (page == False):
+                return False, timelogs
 
             # if we haven't scraped any new recordings this round, break from the loop
             if (old_num_recordings == len(recordings.get_all_recording_ids())):
@@ -715,22 +843,16 @@ class MixerScraper():
     def procedure_scrape_inactive(self):
 
         time_started = int(time.time())
-        stats = {'num_channels_updated': 0, 'num_channels_total': 0}
+        stats = {'num_channels_updated': 0, 'num_channels_changed': 0, 'num_channels_unchanged': 0, 'num_channels_selected': 0}
 
         # Phase 1: Get all "inactive" channels from DB -------------------------
 
         self.__print('Get all innactive channels')
-        conn = self.db.get_connection()
-        all_inactive_ids = self.db.get_inactive_channel_ids(conn)
-        conn.close()
-
-        # filter list of IDs to be a reasonably sized subset
-        inactive_ids = []
-        stats['num_channels_total'] = len(all_inactive_ids)
-        for i, id in enumerate(all_inactive_ids):
-            if (i > 1000):
-                break
-            inactive_ids.append(id)
+        # -> limited to a reasonably sized subset, the channels scraped longest ago first
+        conn = self.db.get_reader_connection()
+        inactive_ids = self.db.get_inactive_channel_ids(conn, self.num_channels_for_inactive)
+        self.db.release_connection(conn)
+        stats['num_channels_selected'] = len(inactive_ids)
 
 
 
@@ -747,33 +869,34 @@ class MixerScraper():
                 channels[channel.id] = channel
 
 
-        # Phase 3: Update channel info in the database -------------------------
+        # Phase 3: Queue channel info for the db writer ------------------------
 
-        self.__print('Saving channel info to database')
-        conn = self.db.get_connection()
-        for channel_id, channel in channels.items():
+        self.__print('Queueing channel info for the db')
+        scraped_channels = list(channels.values())
+        stats['num_channels_updated'] += len(scraped_channels)
 
-            stats['num_channels_updated'] += 1
+        def write_channels(conn):
+            existing_channels = self.db.get_channel_profile_hashes(conn, [channel.id for channel in scraped_channels]) # <- {channel_id: profile_hash}
 
-            # update channel
-            self.db.update_channel(conn, channel)
+            # update channels, only if their profile changed
+            num_changed = self.db.update_channels_if_changed(conn, scraped_channels, existing_channels)
+            stats['num_channels_changed']   += num_changed
+            stats['num_channels_unchanged'] += len(scraped_channels) - num_changed
 
             # insert regular time-series data
-            self.db.insert_time_series_data(conn, channel, 'followers')
-            self.db.insert_time_series_data(conn, channel, 'lifetime_viewers')
-            self.db.insert_time_series_data(conn, channel, 'sparks')
-            self.db.insert_time_series_data(conn, channel, 'experience')
+            self.db.insert_time_series_data_for_channels(conn, scraped_channels, 'followers')
+            self.db.insert_time_series_data_for_channels(conn, scraped_channels, 'lifetime_viewers')
+            self.db.insert_time_series_data_for_channels(conn, scraped_channels, 'sparks')
+            self.db.insert_time_series_data_for_channels(conn, scraped_channels, 'experience')
 
             # insert value-sensitive time-series data
-            self.db.insert_time_series_data_by_value(conn, channel, 'partnered')
+            self.db.insert_time_series_data_by_value_for_channels(conn, scraped_channels, 'partnered')
+
+        self.__submit('channels', write_channels)
 
         # Phase 4: Write logs to the database ----------------------------------
 
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
-        stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-inactive', time_started, timelog_str, stats_str)
-
-        conn.commit()
-        conn.close()
+        self.__submit('logs', lambda conn: self.db.insert_logs(conn, 'scrape-inactive', time_started, timelog_str, json.dumps(stats)))
         self.__print('Done')
         return
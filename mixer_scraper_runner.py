@@ -40,6 +40,18 @@ __sleep = {
 }
 
 
+# HTTP Related Variables -------------------------------------------------------
+
+# number of live channel pages the livestreams thread requests at once
+__num_page_workers = 4
+
+# number of channels the recordings thread crawls at once
+__num_recording_workers = 8
+
+# every thread shares one keep-alive connection pool per host, so size it to the most requests that can be in flight at once
+__http_pool_size = len(__sleep) + __num_page_workers + __num_recording_workers
+
+
 # Scraper Health Variables -----------------------------------------------------
 
 # for keeping track of process IDs so only 1 version of the scraper can ever run
@@ -54,10 +66,14 @@ sms = TwilioSMS()
 
 # Threading Functions ----------------------------------------------------------
 
-def thread_scrape_procedure(thread_id, scraping_procedure):
+def thread_scrape_procedure(thread_id, scraping_procedure, db):
     while(True):
         print_from_thread(thread_id, "starting work")
         scraping_procedure()
+        print_from_thread(thread_id, "connection pools: " + json.dumps(shared_http_sessions.get_stats()))
+        print_from_thread(thread_id, "channel-search rate limit: " + json.dumps(mixer_rate_limit_governors['channel-search'].get_stats()))
+        print_from_thread(thread_id, "mixer.db: " + json.dumps(db.get_stats()))
+        print_from_thread(thread_id, "db writer: " + json.dumps(get_db_writer(db).get_stats()))
         print_from_thread(thread_id, "sleeping")
         for i in range(__sleep[thread_id]):
             if (thread_status[thread_id] == 'end'):
@@ -77,17 +93,19 @@ def create_worker_thread(thread_id):
     mixer_scraper = MixerScraper()
     procedure_to_run = False
     if (thread_id == __thread_id_livestreams):
+        mixer_scraper.set_num_page_workers(__num_page_workers)
         procedure_to_run = mixer_scraper.procedure_scrape_livestreams
     elif (thread_id == __thread_id_inactive):
         procedure_to_run = mixer_scraper.procedure_scrape_inactive
     elif (thread_id == __thread_id_recordings):
+        mixer_scraper.set_num_recording_workers(__num_recording_workers)
         procedure_to_run = mixer_scraper.procedure_scrape_recordings
     else:
         print('Invalid thread ID found: ', thread_id)
         return
 
     # run the thread
-    worker_threads[thread_id] = threading.Thread(target=thread_scrape_procedure, args=(thread_id, procedure_to_run))
+    worker_threads[thread_id] = threading.Thread(target=thread_scrape_procedure, args=(thread_id, procedure_to_run, mixer_scraper.db))
     thread_status[thread_id]  = 'live'
     worker_threads[thread_id].start()
     return
@@ -113,6 +131,9 @@ def stop_scraper(sig, frame):
         worker_threads[thread_id].join()
         print_from_thread(thread_id, "terminated")
 
+    # write everything the threads queued before they stopped
+    print('waiting for the db writer to commit queued writes...')
+    stop_db_writers()
     print('shut down complete!\n')
     sys.exit(0)
 
@@ -164,6 +185,9 @@ def run():
         sys.exit(0)
     atexit.register(on_program_shutdown)
 
+    # size the shared connection pools before any thread makes a request
+    shared_http_sessions.set_pool_size(__http_pool_size)
+
     # initialize databases if need be
     mixer_db = MixerDB()
     mixer_db.create_tables()
@@ -0,0 +1,194 @@
+# ==============================================================================
+# About: oauth_tokens.py
+# ==============================================================================
+#
+# oauth_tokens.py contains the app access token cache used by TwitchAPI
+# - OAuthTokenManager - fetches a client_credentials token, caches it on disk, and refreshes it ahead of expiry
+#
+# Every TwitchAPI in a process shares one OAuthTokenManager per client_id and token server (see get_token_manager()),
+# so worker threads don't each POST for their own token, and a restarted process reuses the token on disk.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import threading
+
+import requests
+
+from http_session import *
+
+
+# ==============================================================================
+# Class: OAuthTokenManager
+# ==============================================================================
+
+class OAuthTokenManager():
+
+    def __init__(self, client_id, client_secret, token_url, cache_filepath):
+        self.client_id      = client_id
+        self.client_secret  = client_secret
+        self.token_url      = token_url
+        self.cache_filepath = cache_filepath
+        self.access_token   = False
+        self.date_fetched   = 0   # <- epoch seconds
+        self.date_expires   = 0   # <- epoch seconds
+        self.lock           = threading.Lock() # <- guards the token fields
+        self.refresh_lock   = threading.Lock() # <- makes sure only one thread refreshes at a time
+        self.refreshing     = False
+        self.stats = {'num_fetched': 0, 'num_loaded_from_disk': 0, 'num_refreshed_early': 0, 'num_unauthorized': 0, 'num_failed': 0}
+        self.__load_from_disk()
+        return
+
+    # Tokens -------------------------------------------------------------------
+
+    # returns a valid access token, or False if one couldn't be fetched
+    # -> a token close to expiring is refreshed in a background thread, and the current token is used in the meantime
+    def get_token(self):
+        with self.lock:
+            token, date_expires, should_refresh_early = self.access_token, self.date_expires, self.__should_refresh_early()
+
+        if ((token == False) or (time.time() >= date_expires)):
+            return self.__refresh(token)
+
+        if (should_refresh_early):
+            self.__start_background_refresh()
+        return token
+
+    # called when the API rejected bad_token with a 401
+    # -> if no other thread has replaced it yet, the token is refreshed right away
+    # returns the token that should be used for the retry
+    def handle_unauthorized(self, bad_token):
+        with self.lock:
+            self.stats['num_unauthorized'] += 1
+        return self.__refresh(bad_token)
+
+    # Refreshing ---------------------------------------------------------------
+
+    # fetches a new token unless another thread already replaced stale_token while we waited
+    def __refresh(self, stale_token):
+        with self.refresh_lock:
+            with self.lock:
+                if ((self.access_token != False) and (self.access_token != stale_token) and (time.time() < self.date_expires)):
+                    return self.access_token
+            return self.__fetch()
+
+    def __start_background_refresh(self):
+        with self.lock:
+            if (self.refreshing):
+                return
+            self.refreshing = True
+            self.stats['num_refreshed_early'] += 1
+
+        def refresh():
+            try:
+                with self.refresh_lock:
+                    self.__fetch()
+            finally:
+                with self.lock:
+                    self.refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    # a token is refreshed early once 90% of its lifetime has passed (at least 1 minute before it expires)
+    # NOTE: assumes self.lock is held
+    def __should_refresh_early(self):
+        lifetime = self.date_expires - self.date_fetched
+        refresh_margin = max(60, lifetime * 0.1)
+        return time.time() >= self.date_expires - refresh_margin
+
+    # POSTs for a new token and saves it to memory and disk
+    # returns the new token, or the current one if the request failed
+    # NOTE: assumes self.refresh_lock is held
+    def __fetch(self):
+        params = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'client_credentials'
+        }
+        try:
+            r = shared_http_sessions.post(self.token_url, params=params, timeout=(10, 30))
+        except requests.exceptions.RequestException as e:
+            r = False
+            print('oauth token request failed: ' + str(e))
+
+        if ((r == False) or (r.status_code != 200)):
+            with self.lock:
+                self.stats['num_failed'] += 1
+                if (r != False):
+                    print('oauth token request failed: ' + str(r.status_code) + ' ' + r.text)
+                return self.access_token if (time.time() < self.date_expires) else False
+
+        data = r.json()
+        with self.lock:
+            self.access_token = data['access_token']
+            self.date_fetched = int(time.time())
+            self.date_expires = self.date_fetched + int(data['expires_in'])
+            self.stats['num_fetched'] += 1
+            token = self.access_token
+        self.__save_to_disk()
+        return token
+
+    # Disk Cache ---------------------------------------------------------------
+
+    def __load_from_disk(self):
+        if (not os.path.isfile(self.cache_filepath)):
+            return
+        try:
+            with open(self.cache_filepath) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        # tokens from another client or another server (ie: tools/api_stand_in_server.py) aren't reused
+        if ((data.get('client_id') == self.client_id) and (data.get('token_url') == self.token_url) and (data.get('date_expires', 0) > time.time())):
+            self.access_token = data['access_token']
+            self.date_fetched = data['date_fetched']
+            self.date_expires = data['date_expires']
+            self.stats['num_loaded_from_disk'] += 1
+
+    # writes the token to a temporary file and moves it into place, so a crash can't leave a half-written cache
+    def __save_to_disk(self):
+        with self.lock:
+            data = {
+                'client_id':    self.client_id,
+                'token_url':    self.token_url,
+                'access_token': self.access_token,
+                'date_fetched': self.date_fetched,
+                'date_expires': self.date_expires
+            }
+        tmp_filepath = self.cache_filepath + '.tmp'
+        try:
+            fd = os.open(tmp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # <- the token is a secret
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_filepath, self.cache_filepath)
+        except OSError as e:
+            print('could not save oauth token to ' + self.cache_filepath + ': ' + str(e))
+
+    # Stats --------------------------------------------------------------------
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['seconds_until_expired'] = max(0, int(self.date_expires - time.time()))
+        return stats
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+__token_managers = {}  # <- lookup table of {(client_id, token_url): OAuthTokenManager}
+__token_managers_lock = threading.Lock()
+
+# returns the OAuthTokenManager shared by every API wrapper in this process that uses this client_id and token server
+def get_token_manager(client_id, client_secret, token_url, cache_filepath):
+    key = (client_id, token_url)
+    with __token_managers_lock:
+        if (key not in __token_managers):
+            __token_managers[key] = OAuthTokenManager(client_id, client_secret, token_url, cache_filepath)
+        return __token_managers[key]
@@ -0,0 +1,260 @@
+# ==============================================================================
+# About: partitions.py
+# ==============================================================================
+#
+# partitions.py contains the manager that splits a db's time series tables into one file per month
+# - PartitionManager - creates, attaches, routes to and freezes the monthly partition files of one db file
+#
+# The time series tables (ie: livestream_snapshots, followers in twitch.db) grow forever, so instead of one huge file:
+# -> rows are written to ./data/<db name>_partitions/YYYY_MM.db, the partition of the month they were scraped in (UTC)
+# -> partitions are ATTACHed to a connection as schema 'p_YYYY_MM', so a statement reads p_2020_05.followers instead of followers
+# -> the 'partitions' table in the main db file is the catalog of every partition and its date range
+# -> the rows that were in the main db file before partitioning stay there, the main db file is the partition of every date
+#    before the first monthly partition
+# -> the current month and the month before it are hot (they take writes), older partitions are frozen once they're done:
+#    vacuumed, switched out of WAL mode, made read-only on disk and only ever attached read-only again
+#
+# sqlite allows 10 attached dbs per connection, so partitions are attached on demand (see iter_schemas()),
+# and the ones that aren't hot are detached again when a connection runs out of room.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import calendar
+import threading
+
+
+# Constants --------------------------------------------------------------------
+
+# the schema name a partition is attached as is this prefix + its name (ie: 'p_2020_05')
+PARTITION_SCHEMA_PREFIX = 'p_'
+
+
+# ==============================================================================
+# Class: PartitionManager
+# ==============================================================================
+
+# the catalog and partition tables are created with the db's sql commands, for platform 'twitch' those are:
+# -> create-partition-tables-twitch, get-partitions-twitch, insert-partition-twitch, freeze-partition-twitch
+# -> get-partition-has-snapshots-twitch, a partition that still has rows to compress isn't frozen
+class PartitionManager():
+
+    # directory      - the folder the partition files are kept in (ie: ./data/twitch_partitions)
+    # commands       - the db's SQLCommandRegistry, see sql_commands.py
+    # num_hot_months - the current month and the (num_hot_months - 1) months before it take writes
+    # max_attached   - partitions one connection keeps attached at most, sqlite allows 10
+    # check_interval - seconds between two checks for partitions that can be frozen
+    def __init__(self, directory, commands, platform, num_hot_months = 2, max_attached = 8, check_interval = 10 * 60):
+        self.directory      = directory
+        self.commands       = commands
+        self.platform       = platform
+        self.num_hot_months = num_hot_months
+        self.max_attached   = max_attached
+        self.check_interval = check_interval
+        self.date_checked   = 0     # <- when prepare_write_connection() last created and froze partitions
+        self.month          = (0, 0, False) # <- (date_start, date_end, schema) of the last month get_schema_for_date() looked up
+        self.lock           = threading.RLock() # <- reentrant, prepare_write_connection() attaches while holding it
+        self.stats          = {'num_created': 0, 'num_frozen': 0, 'num_attached': 0, 'num_detached': 0}
+        return
+
+    # Names --------------------------------------------------------------------
+
+    # returns the name of the partition that rows scraped at date go to (ie: '2020_05')
+    @staticmethod
+    def get_partition_name(date):
+        return time.strftime('%Y_%m', time.gmtime(date))
+
+    @staticmethod
+    def get_schema_name(partition_name):
+        return PARTITION_SCHEMA_PREFIX + partition_name
+
+    # returns the (date_start, date_end) of a partition, date_end is the first second of the next month
+    @staticmethod
+    def get_partition_range(partition_name):
+        year, month = [int(v) for v in partition_name.split('_')]
+        date_start = calendar.timegm((year, month, 1, 0, 0, 0))
+        date_end   = calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+        return date_start, date_end
+
+    def get_filepath(self, partition_name):
+        return os.path.join(self.directory, partition_name + '.db')
+
+    # returns the names of the partitions that take writes at date, the current month first
+    def get_hot_partition_names(self, date):
+        names = [PartitionManager.get_partition_name(date)]
+        while (len(names) < self.num_hot_months):
+            date_start, date_end = PartitionManager.get_partition_range(names[-1])
+            names.append(PartitionManager.get_partition_name(date_start - 1))
+        return names
+
+    # Routing ------------------------------------------------------------------
+
+    # returns the schema that rows scraped at date are written to
+    # -> the partition must already be attached to the connection the rows are written with, see prepare_write_connection()
+    def get_schema_for_date(self, date):
+        date_start, date_end, schema = self.month
+        if ((date < date_start) or (date >= date_end)):
+            partition_name = PartitionManager.get_partition_name(date)
+            date_start, date_end = PartitionManager.get_partition_range(partition_name)
+            schema = PartitionManager.get_schema_name(partition_name)
+            self.month = (date_start, date_end, schema)
+        return schema
+
+    # returns a list of (name, date_start, date_end, frozen) for every partition in the catalog, newest first
+    def get_partitions(self, conn):
+        try:
+            return [tuple(row) for row in conn.execute(self.commands['get-partitions-' + self.platform])]
+        except sqlite3.OperationalError:
+            return [] # <- a db that was created before partitioning, create_tables() hasn't added the catalog yet
+
+    # yields the schemas that hold rows scraped between date_from and date_to, newest first, attaching them as it goes
+    # -> 'main' comes last when the range starts before the first partition
+    # -> finish reading from one schema before asking for the next one, a schema that's still being read can't be detached
+    # -> include_frozen = False skips the read-only partitions (ie: to rewrite rows)
+    def iter_schemas(self, conn, date_from = 0, date_to = None, include_frozen = True):
+        partitions = self.get_partitions(conn)
+        for partition_name, date_start, date_end, frozen in partitions:
+            if ((frozen) and (not include_frozen)):
+                continue
+            if ((date_end > date_from) and ((date_to is None) or (date_start <= date_to))):
+                yield self.attach(conn, partition_name, frozen)
+        if ((len(partitions) == 0) or (date_from < partitions[-1][1])):
+            yield 'main'
+
+    # returns the schemas that can be written to on conn: 'main' and the partitions that aren't frozen and are attached
+    # -> this doesn't attach anything, so it can be called inside a transaction
+    def get_writable_schemas(self, conn):
+        attached = self.get_attached_schemas(conn)
+        schemas = ['main']
+        for partition_name, date_start, date_end, frozen in self.get_partitions(conn):
+            schema = PartitionManager.get_schema_name(partition_name)
+            if ((not frozen) and (schema in attached)):
+                schemas.append(schema)
+        return schemas
+
+    # Attaching ----------------------------------------------------------------
+
+    # returns the schema names of the partitions attached to conn, in the order they were attached
+    def get_attached_schemas(self, conn):
+        return [row[1] for row in conn.execute('PRAGMA database_list;') if (row[1].startswith(PARTITION_SCHEMA_PREFIX))]
+
+    # attaches a partition to conn (creating its file if it doesn't exist yet), and returns its schema name
+    # -> frozen partitions are attached read-only
+    # -> ATTACH can't run inside a transaction, so this must be called between transactions
+    def attach(self, conn, partition_name, frozen = False):
+        schema = PartitionManager.get_schema_name(partition_name)
+        if (not re.match(r'^\d{4}_\d{2}$', partition_name)):
+            raise ValueError('not a partition name: ' + str(partition_name))
+        attached = self.get_attached_schemas(conn)
+        if (schema in attached):
+            return schema
+
+        # make room by detaching the partitions that were attached first, except for hot ones
+        hot_schemas = [PartitionManager.get_schema_name(name) for name in self.get_hot_partition_names(time.time())]
+        for attached_schema in list(attached):
+            if (len(attached) < self.max_attached):
+                break
+            if (attached_schema not in hot_schemas):
+                self.detach(conn, attached_schema)
+                attached.remove(attached_schema)
+
+        filepath = os.path.abspath(self.get_filepath(partition_name))
+        if (not frozen):
+            os.makedirs(self.directory, exist_ok = True)
+        conn.execute('ATTACH DATABASE ? AS ' + schema + ';', ('file:' + filepath + ('?mode=ro' if (frozen) else ''), ))
+        if (not frozen):
+            conn.execute('PRAGMA ' + schema + '.synchronous = NORMAL;')
+        self.__increment('num_attached')
+        return schema
+
+    def detach(self, conn, schema):
+        conn.execute('DETACH DATABASE ' + schema + ';')
+        self.__increment('num_detached')
+
+    # Rollover -----------------------------------------------------------------
+
+    # gets conn ready to write rows scraped from now on: creates and attaches the hot partitions, and freezes the ones that are done
+    # -> called by the db writer before every transaction, it only does work when the month changed or every check_interval seconds
+    def prepare_write_connection(self, conn):
+        now = time.time()
+        hot_names = self.get_hot_partition_names(now)
+        attached = self.get_attached_schemas(conn)
+        with self.lock:
+            if ((now - self.date_checked < self.check_interval) and (all([PartitionManager.get_schema_name(name) in attached for name in hot_names]))):
+                return
+            self.date_checked = now
+
+            for partition_name in hot_names:
+                self.__create_partition(conn, partition_name)
+
+            # partitions that are no longer hot are frozen, or kept attached until their snapshots have been compressed
+            for partition_name, date_start, date_end, frozen in self.get_partitions(conn):
+                if ((frozen) or (partition_name in hot_names)):
+                    continue
+                schema = self.attach(conn, partition_name)
+                if (conn.execute(self.commands.get('get-partition-has-snapshots-' + self.platform, schema = schema)).fetchone()[0] == 0):
+                    self.__freeze(conn, partition_name, schema)
+        return
+
+    # creates the partition's file and tables if they don't exist yet, and adds it to the catalog
+    def __create_partition(self, conn, partition_name):
+        is_new = not os.path.exists(self.get_filepath(partition_name))
+        schema = self.attach(conn, partition_name)
+        if (is_new):
+            conn.execute('PRAGMA ' + schema + '.journal_mode = WAL;')
+            self.__increment('num_created')
+        for command in self.commands.get('create-partition-tables-' + self.platform, schema = schema):
+            conn.execute(command)
+        date_start, date_end = PartitionManager.get_partition_range(partition_name)
+        conn.execute(self.commands['insert-partition-' + self.platform], {'name': partition_name, 'date_start': date_start, 'date_end': date_end})
+        if (conn.in_transaction):
+            conn.commit()
+
+    # compacts a partition that no longer takes writes and makes it read-only
+    # -> a partition that's still open somewhere else (ie: a reader in status_checker.py) can't leave WAL mode,
+    #    it stays as it is and is frozen by a later check
+    def __freeze(self, conn, partition_name, schema):
+        try:
+            conn.execute('VACUUM ' + schema + ';')
+            conn.execute('PRAGMA ' + schema + '.journal_mode = DELETE;') # <- a read-only file can't have -wal/-shm files next to it
+        except sqlite3.OperationalError as e:
+            print('partitions: could not freeze ' + partition_name + ' yet: ' + str(e))
+            return
+        self.detach(conn, schema)
+        os.chmod(self.get_filepath(partition_name), 0o444)
+        conn.execute(self.commands['freeze-partition-' + self.platform], {'name': partition_name})
+        if (conn.in_transaction):
+            conn.commit()
+        self.__increment('num_frozen')
+
+    # Stats --------------------------------------------------------------------
+
+    def __increment(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+partition_managers = {}  # <- lookup table of {absolute filepath: PartitionManager}
+partition_managers_lock = threading.Lock()
+
+# returns the PartitionManager shared by every db wrapper in this process that uses this db file
+# -> the partitions of ./data/twitch.db are kept in ./data/twitch_partitions/
+def get_partition_manager(filepath, commands, platform, **settings):
+    key = os.path.abspath(filepath)
+    with partition_managers_lock:
+        if (key not in partition_managers):
+            partition_managers[key] = PartitionManager(os.path.splitext(filepath)[0] + '_partitions', commands, platform, **settings)
+        return partition_managers[key]
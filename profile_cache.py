@@ -0,0 +1,105 @@
+# ==============================================================================
+# About: profile_cache.py
+# ==============================================================================
+#
+# profile_cache.py contains the cache that decides which streamer profiles need to be re-fetched
+# - ProfileFreshnessCache - remembers when each streamer's profile was last refreshed, and which profiles are being fetched right now
+#
+# Profiles barely change between runs, so a profile refreshed less than ttl seconds ago is skipped.
+# The scraping procedures in a process share one cache, so a profile that one procedure is already fetching
+# isn't fetched a second time by another procedure running at the same time.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import time
+import threading
+
+
+# ==============================================================================
+# Class: ProfileFreshnessCache
+# ==============================================================================
+
+class ProfileFreshnessCache():
+
+    def __init__(self, ttl = 60 * 60, claim_timeout = 30 * 60):
+        self.ttl            = ttl           # <- seconds a refreshed profile stays fresh
+        self.claim_timeout  = claim_timeout # <- seconds before a claim is given up on (ie: the procedure that claimed it crashed)
+        self.date_refreshed = {}            # <- lookup table of {streamer_id: epoch seconds the profile was last saved}
+        self.in_flight      = {}            # <- lookup table of {streamer_id: epoch seconds it was claimed} for profiles being fetched right now
+        self.seeded         = False
+        self.lock           = threading.Lock()
+        self.stats          = {'num_fresh': 0, 'num_in_flight': 0, 'num_claimed': 0}
+        return
+
+    def set_ttl(self, ttl):
+        with self.lock:
+            self.ttl = max(0, int(ttl))
+
+    # seeds the cache with {streamer_id: date_last_scraped}, only the first call does anything
+    # -> get_rows is only called if the cache hasn't been seeded yet, so the db is read once per process
+    def seed(self, get_rows):
+        with self.lock:
+            if (self.seeded):
+                return
+            self.seeded = True
+        rows = get_rows()
+        with self.lock:
+            for streamer_id, date_refreshed in rows.items():
+                if (date_refreshed > self.date_refreshed.get(streamer_id, 0)):
+                    self.date_refreshed[streamer_id] = date_refreshed
+
+    # returns the date before which a profile is stale
+    def get_cutoff(self):
+        return int(time.time()) - self.ttl
+
+    # Claims -------------------------------------------------------------------
+
+    # splits streamer_ids into the profiles the caller should fetch and the ones it can skip
+    # -> the returned ids are marked as in flight until complete() is called, or until the claim times out
+    # returns (ids_to_fetch, run_stats) where run_stats = {num_fresh, num_in_flight, num_claimed}
+    def claim(self, streamer_ids):
+        now = time.time()
+        cutoff = self.get_cutoff()
+        ids_to_fetch = []
+        run_stats = {'num_fresh': 0, 'num_in_flight': 0, 'num_claimed': 0}
+        with self.lock:
+            for streamer_id in streamer_ids:
+                if (self.date_refreshed.get(streamer_id, 0) > cutoff):
+                    run_stats['num_fresh'] += 1
+                elif (now - self.in_flight.get(streamer_id, 0) < self.claim_timeout):
+                    run_stats['num_in_flight'] += 1 # <- another procedure is fetching it and will save it
+                else:
+                    self.in_flight[streamer_id] = now
+                    ids_to_fetch.append(streamer_id)
+                    run_stats['num_claimed'] += 1
+            for k, v in run_stats.items():
+                self.stats[k] += v
+        return ids_to_fetch, run_stats
+
+    # releases the claim on claimed_ids, and marks refreshed_ids as fresh
+    # -> call this after the profiles have been committed, ids that weren't refreshed will be claimed again next time
+    def complete(self, claimed_ids, refreshed_ids = [], date_refreshed = False):
+        date_refreshed = int(time.time()) if (date_refreshed == False) else date_refreshed
+        with self.lock:
+            for streamer_id in refreshed_ids:
+                self.date_refreshed[streamer_id] = date_refreshed
+            for streamer_id in claimed_ids:
+                self.in_flight.pop(streamer_id, None)
+
+    # Stats --------------------------------------------------------------------
+
+    # returns the share of profile lookups that didn't need a request
+    @staticmethod
+    def get_hit_rate(run_stats):
+        total = run_stats['num_fresh'] + run_stats['num_in_flight'] + run_stats['num_claimed']
+        return round((run_stats['num_fresh'] + run_stats['num_in_flight']) / total, 4) if (total > 0) else 0
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['num_cached']      = len(self.date_refreshed)
+            stats['num_claimed_now'] = len(self.in_flight)
+        stats['hit_rate'] = ProfileFreshnessCache.get_hit_rate(stats)
+        return stats
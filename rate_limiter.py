@@ -0,0 +1,139 @@
+# ==============================================================================
+# About: rate_limiter.py
+# ==============================================================================
+#
+# rate_limiter.py contains the rate limiting objects shared by every API wrapper in a process
+# - RateLimitGovernor - a thread-safe token bucket that hands out request permits in priority order
+#
+# The bucket refills continuously at capacity / refill_period tokens per second.
+# After each response, the governor is corrected with the rate-limit headers the API sent back,
+# so requests made by other processes (or lost in flight) are accounted for.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import time
+import heapq
+import threading
+import itertools
+
+
+# Priorities -------------------------------------------------------------------
+
+# lower values are served first when several threads are waiting for a permit
+PRIORITY_HIGH   = 0 # <- time sensitive crawls (ie: livestream snapshots)
+PRIORITY_NORMAL = 1
+PRIORITY_LOW    = 2 # <- background work that can always wait (ie: follower counts)
+
+
+# ==============================================================================
+# Class: RateLimitGovernor
+# ==============================================================================
+
+class RateLimitGovernor():
+
+    # capacity      - the number of points in the bucket (ie: 800 for Helix)
+    # refill_period - seconds it takes for an empty bucket to refill completely (ie: 60 for Helix)
+    def __init__(self, capacity, refill_period):
+        self.capacity      = capacity
+        self.refill_period = refill_period
+        self.tokens        = float(capacity)
+        self.last_refill   = time.time()
+        self.blocked_until = 0     # <- epoch seconds, no permits are handed out before this time
+        self.condition     = threading.Condition()
+        self.waiting       = []    # <- heap of (priority, ticket_number) for threads waiting on a permit
+        self.tickets       = itertools.count()
+        self.stats = {'num_permits': 0, 'num_waits': 0, 'total_wait_ms': 0, 'num_throttled': 0}
+        return
+
+    # Permits ------------------------------------------------------------------
+
+    # blocks until a permit for a request costing `cost` points is available
+    # -> threads are served in (priority, arrival) order
+    def acquire(self, priority = PRIORITY_NORMAL, cost = 1):
+        time_started = time.time()
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            waited = False
+
+            while True:
+                self.__refill()
+                if ((self.waiting[0] == ticket) and (self.tokens >= cost) and (time.time() >= self.blocked_until)):
+                    heapq.heappop(self.waiting)
+                    self.tokens -= cost
+                    break
+
+                waited = True
+                self.condition.wait(self.__time_until_available(cost) if (self.waiting[0] == ticket) else None)
+
+            self.stats['num_permits'] += 1
+            if (waited):
+                self.stats['num_waits'] += 1
+                self.stats['total_wait_ms'] += int((time.time() - time_started) * 1000)
+
+            # let the next thread in line check if it can go
+            self.condition.notify_all()
+        return
+
+
+    # corrects the bucket using the rate-limit headers returned by the API
+    # -> limit_key:     header with the size of the bucket
+    # -> remaining_key: header with the number of points left
+    # -> reset_key:     header with the epoch time (in reset_units) when the bucket will be full again
+    def update_from_headers(self, headers, limit_key = 'Ratelimit-Limit', remaining_key = 'Ratelimit-Remaining', reset_key = 'Ratelimit-Reset', reset_units = 1):
+        if (remaining_key not in headers):
+            return
+
+        with self.condition:
+            self.__refill()
+            if (limit_key in headers):
+                self.capacity = int(headers[limit_key])
+
+            # the API's count is authoritative, but it doesn't know about requests that are still in flight
+            remaining = int(headers[remaining_key])
+            self.tokens = min(self.tokens, float(remaining))
+
+            # an empty bucket won't hand out any permits until the API says it has refilled
+            if ((remaining <= 0) and (reset_key in headers)):
+                self.blocked_until = max(self.blocked_until, float(headers[reset_key]) / reset_units)
+            self.condition.notify_all()
+        return
+
+
+    # called when the API rejected a request for exceeding its rate limit (ie: HTTP 429)
+    def throttle(self, headers, reset_key = 'Ratelimit-Reset', reset_units = 1):
+        with self.condition:
+            self.stats['num_throttled'] += 1
+            self.tokens = 0
+            if (reset_key in headers):
+                self.blocked_until = max(self.blocked_until, float(headers[reset_key]) / reset_units)
+            else:
+                self.blocked_until = max(self.blocked_until, time.time() + (self.refill_period / self.capacity))
+            self.condition.notify_all()
+        return
+
+    # Helpers ------------------------------------------------------------------
+
+    def __refill(self):
+        now = time.time()
+        self.tokens = min(float(self.capacity), self.tokens + (now - self.last_refill) * (self.capacity / self.refill_period))
+        self.last_refill = now
+
+    # returns the number of seconds until a permit costing `cost` points could be handed out
+    def __time_until_available(self, cost):
+        now = time.time()
+        time_until_refilled = max(0, cost - self.tokens) * (self.refill_period / self.capacity)
+        time_until_unblocked = max(0, self.blocked_until - now)
+        return max(time_until_refilled, time_until_unblocked, 0.001)
+
+    # Stats --------------------------------------------------------------------
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['tokens']      = round(self.tokens, 2)
+            stats['capacity']    = self.capacity
+            stats['num_waiting'] = len(self.waiting)
+        return stats
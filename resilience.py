@@ -0,0 +1,192 @@
+# ==============================================================================
+# About: resilience.py
+# ==============================================================================
+#
+# resilience.py contains the objects that keep one bad request from killing a whole scraping procedure
+# - RetryPolicy     - decides how many times a request is retried and how long to wait between attempts
+# - CircuitBreaker  - stops sending requests to an endpoint that keeps failing, until it has had time to recover
+# - CircuitBreakers - a thread-safe lookup table of CircuitBreaker objects, one per endpoint
+# - send_request    - sends a request using a RetryPolicy and a CircuitBreaker, and reports counters into TimeLogs
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import time
+import random
+import threading
+
+import requests
+
+
+# ==============================================================================
+# Class: RetryPolicy
+# ==============================================================================
+
+class RetryPolicy():
+
+    def __init__(self, max_attempts = 4, base_delay = 0.5, max_delay = 30):
+        self.max_attempts = max_attempts # <- total number of attempts, including the first one
+        self.base_delay   = base_delay   # <- seconds to wait before the first retry
+        self.max_delay    = max_delay    # <- the backoff never waits longer than this
+        return
+
+    # returns True if a response with this status code should be retried
+    def should_retry_status(self, status_code):
+        return (status_code == 429) or (status_code >= 500)
+
+    # exponential backoff with "full jitter": a random delay between 0 and base_delay * 2^attempt
+    # -> jitter keeps worker threads that failed at the same time from retrying at the same time
+    def get_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+# ==============================================================================
+# Class: CircuitBreaker
+# ==============================================================================
+
+# closed    -> requests are sent normally
+# open      -> requests fail fast without being sent, until reset_timeout seconds have passed
+# half-open -> one trial request is let through, its result decides if the breaker closes or re-opens
+#              (a 429 re-opens it too, and a trial that never reports back is replaced after reset_timeout seconds)
+class CircuitBreaker():
+
+    def __init__(self, name, failure_threshold = 5, reset_timeout = 60):
+        self.name              = name
+        self.failure_threshold = failure_threshold # <- consecutive failures needed to open the breaker
+        self.reset_timeout     = reset_timeout     # <- seconds to stay open before allowing a trial request
+        self.state             = 'closed'
+        self.num_failures      = 0
+        self.date_opened       = 0
+        self.date_half_opened  = 0 # <- when the current trial request was let through
+        self.lock              = threading.Lock()
+        return
+
+    # returns True if a request to this endpoint is allowed right now
+    def allow_request(self):
+        with self.lock:
+            if (self.state == 'closed'):
+                return True
+            now = time.time()
+            if ((self.state == 'open') and (now - self.date_opened >= self.reset_timeout)):
+                self.state = 'half-open'
+                self.date_half_opened = now
+                return True
+            if ((self.state == 'half-open') and (now - self.date_half_opened >= self.reset_timeout)):
+                self.date_half_opened = now # <- the last trial never reported back (ie: its thread died), let another one through
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state        = 'closed'
+            self.num_failures = 0
+
+    # returns True if this failure opened the breaker
+    def record_failure(self):
+        with self.lock:
+            self.num_failures += 1
+            if ((self.state == 'half-open') or (self.state == 'closed' and self.num_failures >= self.failure_threshold)):
+                self.state       = 'open'
+                self.date_opened = time.time()
+                return True
+            return False
+
+    # a 429 doesn't say if the endpoint is up, so a half-open breaker whose trial got one goes back to open for another reset_timeout
+    def record_rate_limited(self):
+        with self.lock:
+            if (self.state == 'half-open'):
+                self.state       = 'open'
+                self.date_opened = time.time()
+
+    def is_open(self):
+        with self.lock:
+            return self.state == 'open'
+
+
+# ==============================================================================
+# Class: CircuitBreakers
+# ==============================================================================
+
+class CircuitBreakers():
+
+    def __init__(self, failure_threshold = 5, reset_timeout = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout     = reset_timeout
+        self.breakers          = {} # <- lookup table of {endpoint name: CircuitBreaker}
+        self.lock              = threading.Lock()
+        return
+
+    def get(self, name):
+        with self.lock:
+            if (name not in self.breakers):
+                self.breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            return self.breakers[name]
+
+    # returns {endpoint name: state} for every endpoint that has been used
+    def get_states(self):
+        with self.lock:
+            breakers = dict(self.breakers)
+        states = {}
+        for name, breaker in breakers.items():
+            states[name] = breaker.state
+        return states
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+# sends a request with retries and a circuit breaker
+# -> send() performs one attempt and returns a requests.Response
+# -> returns the last response received, or False if no response was received at all (connection errors, open breaker)
+# -> counters are reported into timelogs as '<request_type>_retries', '<request_type>_failures', '<request_type>_circuit_open'
+def send_request(send, request_type, breaker, retry_policy, timelogs = False):
+
+    if (not breaker.allow_request()):
+        __increment(timelogs, request_type + '_circuit_open')
+        return False
+
+    r = False
+    for attempt in range(retry_policy.max_attempts):
+
+        # send the request, connection errors and timeouts are treated like a 5xx response
+        try:
+            r = send()
+            failed = retry_policy.should_retry_status(r.status_code)
+        except requests.exceptions.RequestException as e:
+            print('request failed: ' + request_type + ' -> ' + str(e))
+            r, failed = False, True
+
+        if (not failed):
+            breaker.record_success()
+            return r
+
+        # 429s mean we were too fast, not that the API is down, so they don't count towards the breaker
+        __increment(timelogs, request_type + '_failures')
+        if ((r == False) or (r.status_code != 429)):
+            if (breaker.record_failure()):
+                __increment(timelogs, request_type + '_circuit_opened')
+        else:
+            breaker.record_rate_limited()
+
+        # give up if we are out of attempts or the endpoint has been marked as down
+        if ((attempt + 1 >= retry_policy.max_attempts) or (not breaker.allow_request())):
+            break
+
+        __increment(timelogs, request_type + '_retries')
+        time.sleep(retry_policy.get_delay(attempt))
+
+    return r
+
+
+def __increment(timelogs, counter):
+    if (timelogs != False):
+        timelogs.increment(counter)
+
+
+# Shared Objects ---------------------------------------------------------------
+
+# every TwitchAPI and MixerAPI object in this process shares these, so an endpoint that is down fails fast for every thread
+shared_circuit_breakers = CircuitBreakers()
+default_retry_policy    = RetryPolicy()
@@ -0,0 +1,203 @@
+# ==============================================================================
+# About: sql_commands.py
+# ==============================================================================
+#
+# sql_commands.py contains the registry of the sql statements in ./sql/*.json
+# - SQLCommand         - one named statement, its kind (create, select, insert, ...) and the parameters it binds
+# - SQLCommandRegistry - loads, expands and validates the statements, and estimates how often a command is reused
+#
+# Values (ids, dates, limits) are never pasted into the sql text, they're bound as parameters:
+# -> ':name' placeholders are bound with a dict (ie: conn.execute(commands['get-inactive-streamer-ids'], {'date': date}))
+# -> '?' placeholders are bound with a tuple
+# -> '{table_name}' templates are expanded once, at load time, for the tables listed in table_variants
+# -> '{ids}' is expanded once, at load time, to IN_LIST_SIZE '?' placeholders (see pad_in_list())
+# -> '{schema}' is expanded the first time a command is asked for with that schema (ie: the 'p_2020_05' partition, see partitions.py)
+# so each command has one fixed sql text, and sqlite3 can reuse its prepared statement instead of preparing it every call.
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import threading
+import collections
+
+
+# Constants --------------------------------------------------------------------
+
+# number of '?' placeholders '{ids}' is expanded to
+IN_LIST_SIZE = 500
+
+# number of prepared statements sqlite3 keeps per connection (the cached_statements argument of sqlite3.connect)
+STATEMENT_CACHE_SIZE = 128
+
+# the first word of a statement decides its kind
+COMMAND_KINDS = ['create', 'alter', 'insert', 'update', 'select', 'delete']
+
+# params     - the names of its ':name' placeholders (bound with a dict)
+# num_params - the number of its '?' placeholders (bound with a tuple)
+SQLCommand = collections.namedtuple('SQLCommand', ['name', 'kind', 'sql', 'params', 'num_params'])
+
+
+# ==============================================================================
+# Class: SQLCommandRegistry
+# ==============================================================================
+
+class SQLCommandRegistry():
+
+    # filepaths      - json files of {command name: [sql statement, ...]}
+    # table_variants - lookup table of {command name: [table names]} for the commands with a '{table_name}' template
+    def __init__(self, filepaths, table_variants = {}):
+        self.commands = {}  # <- lookup table of {command name or (command name, table name): SQLCommand}
+        self.schema_templates = {} # <- lookup table of {command key: sql list} for the commands with a '{schema}' template
+        self.schema_variants  = {} # <- lookup table of {(command key, schema): sql text or list} expanded so far
+        self.local    = threading.local() # <- holds .recent, the commands this thread asked for most recently
+        self.lock     = threading.Lock()
+        self.stats    = {'num_command_lookups': 0, 'num_command_reuses': 0}
+
+        for filepath in filepaths:
+            with open(filepath) as f:
+                for name, statements in json.load(f).items():
+                    self.__add(name, statements, table_variants.get(name, []))
+        self.__validate()
+        return
+
+    # Commands -----------------------------------------------------------------
+
+    # returns the sql text of a command, or a list of sql texts for commands with several statements (ie: create-tables-twitch)
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    # returns the sql text of a command
+    # -> table_name picks the variant of a command with a '{table_name}' template, it must be one of its table_variants
+    # -> schema picks the attached db a command with a '{schema}' template runs on, 'main' if it isn't given
+    def get(self, name, table_name = False, schema = False):
+        key = name if (table_name == False) else (name, table_name)
+        if (key not in self.commands):
+            raise KeyError('unknown sql command: ' + str(key))
+        sql = self.commands[key].sql
+        if ((schema != False) and (schema != 'main') and (key in self.schema_templates)):
+            sql = self.__get_schema_variant(key, schema)
+        if (isinstance(sql, str)):
+            self.__count(sql)
+        return sql
+
+    def get_command(self, name, table_name = False):
+        return self.commands[name if (table_name == False) else (name, table_name)]
+
+    # Loading ------------------------------------------------------------------
+
+    def __add(self, name, statements, table_names):
+        if (('{table_name}' in statements[0]) and (len(table_names) == 0)):
+            raise ValueError('sql command ' + name + ' has a {table_name} template but no table_variants')
+
+        def create_command(sql_list):
+            sql_list = [sql.replace('{ids}', ', '.join(['?'] * IN_LIST_SIZE)) for sql in sql_list]
+            kind = sql_list[0].split(None, 1)[0].lower()
+            params = tuple(dict.fromkeys(re.findall(r':([a-z_]+)', ' '.join(sql_list))))
+            num_params = max([sql.count('?') for sql in sql_list])
+            return SQLCommand(name, kind, sql_list if (len(sql_list) > 1) else sql_list[0], params, num_params)
+
+        # '{schema}' commands are validated with their 'main' variant, the other variants are expanded when they're asked for
+        def add_command(key, sql_list):
+            if ('{schema}' in sql_list[0]):
+                self.schema_templates[key] = [sql.replace('{ids}', ', '.join(['?'] * IN_LIST_SIZE)) for sql in sql_list]
+                sql_list = [sql.replace('{schema}', 'main') for sql in sql_list]
+            self.commands[key] = create_command(sql_list)
+
+        if (len(table_names) == 0):
+            add_command(name, statements)
+        for table_name in table_names:
+            add_command((name, table_name), [sql.replace('{table_name}', table_name) for sql in statements])
+
+    def __get_schema_variant(self, key, schema):
+        sql = self.schema_variants.get((key, schema))
+        if (sql is None):
+            if (not re.match(r'^[a-z_][a-z0-9_]*$', schema)):
+                raise ValueError('not a schema name: ' + str(schema)) # <- schema names are pasted into the sql text, they can't be bound
+            sql_list = [sql.replace('{schema}', schema) for sql in self.schema_templates[key]]
+            sql = sql_list if (len(sql_list) > 1) else sql_list[0]
+            with self.lock:
+                self.schema_variants[(key, schema)] = sql
+        return sql
+
+    # makes sure every statement is complete, has no templates left, and compiles against the tables it's run on
+    # -> raises ValueError naming the command that's broken, so a bad edit to ./sql/*.json fails at startup instead of mid-procedure
+    def __validate(self):
+        conn = sqlite3.connect(':memory:')
+        commands = sorted(self.commands.values(), key = lambda command: command.kind != 'create') # <- tables first
+        for command in commands:
+            for sql in (command.sql if (isinstance(command.sql, list)) else [command.sql]):
+                if (command.kind not in COMMAND_KINDS):
+                    raise ValueError('sql command ' + command.name + ' has an unknown kind: ' + command.kind)
+                if ((not sqlite3.complete_statement(sql)) and (not sqlite3.complete_statement(sql + ';'))):
+                    raise ValueError('sql command ' + command.name + ' is not a complete statement: ' + sql)
+                if (re.search(r'\{[a-z_]+\}', sql)):
+                    raise ValueError('sql command ' + command.name + ' has a template that was not expanded: ' + sql)
+                try:
+                    if (command.kind == 'create'):
+                        conn.execute(sql)
+                    elif (command.kind != 'alter'): # <- the columns alter commands add are already in the create commands
+                        conn.execute('EXPLAIN ' + sql, dict.fromkeys(command.params) if (len(command.params) > 0) else [None] * command.num_params)
+                except sqlite3.Error as e:
+                    raise ValueError('sql command ' + command.name + ' does not compile: ' + str(e))
+        conn.close()
+
+    # Stats --------------------------------------------------------------------
+
+    # counts a command as reused when this thread asked for it within its last STATEMENT_CACHE_SIZE distinct commands
+    # -> an estimate of how often sqlite3 could reuse a prepared statement, not sqlite3's statement cache itself:
+    #    calls to get() are counted, not executions, and this thread's reader and writer connections are counted as one
+    def __count(self, sql):
+        recent = getattr(self.local, 'recent', None)
+        if (recent is None):
+            recent = self.local.recent = collections.OrderedDict()
+
+        is_reuse = sql in recent
+        if (is_reuse):
+            recent.move_to_end(sql)
+        else:
+            recent[sql] = True
+            if (len(recent) > STATEMENT_CACHE_SIZE):
+                recent.popitem(last = False)
+        with self.lock:
+            self.stats['num_command_lookups'] += 1
+            if (is_reuse):
+                self.stats['num_command_reuses'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['num_commands'] = len(self.commands)
+        stats['command_reuse_rate'] = round(stats['num_command_reuses'] / stats['num_command_lookups'], 4) if (stats['num_command_lookups'] > 0) else 0
+        return stats
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+command_registries = {}  # <- lookup table of {absolute filepaths: SQLCommandRegistry}
+command_registries_lock = threading.Lock()
+
+# returns the SQLCommandRegistry shared by every db wrapper in this process that loads these files
+# -> the files are loaded and validated once per process
+def load_command_registry(filepaths, table_variants = {}):
+    key = tuple([os.path.abspath(filepath) for filepath in filepaths])
+    with command_registries_lock:
+        if (key not in command_registries):
+            command_registries[key] = SQLCommandRegistry(filepaths, table_variants)
+        return command_registries[key]
+
+# pads ids to IN_LIST_SIZE values by repeating the last one, so an '{ids}' command always gets the same number of parameters
+# -> repeated values don't change the result of "x IN (...)"
+def pad_in_list(ids):
+    if ((len(ids) == 0) or (len(ids) > IN_LIST_SIZE)):
+        raise ValueError('an IN list needs between 1 and ' + str(IN_LIST_SIZE) + ' values, got ' + str(len(ids)))
+    return list(ids) + [ids[-1]] * (IN_LIST_SIZE - len(ids))
@@ -56,9 +56,9 @@ if (args.twilio):
 def handle_procedure_logs():
     # get most recent logs
     db = TwitchDB()
-    conn = db.get_connection()
+    conn = db.get_reader_connection(allow_writer = False) # <- read-only, so the checker never blocks the scraper's writes or changes the db
     logs = db.get_most_recent_logs(conn)
-    conn.close()
+    db.release_connection(conn)
 
     needs_attention = []
     current_time = int(time.time())
@@ -73,19 +73,17 @@ def handle_procedure_logs():
     return
 
 
-# calls COUNT(*) on different tables in the twitch.db
+# reads the number of rows of different tables in the twitch.db
 def count_tables():
 
     needs_attention = []
 
-    # Get COUNT(*) values from twitch.db
+    # Get row counts from twitch.db
+    # -> read from the counters in table_stats (summed over the monthly partitions), so this doesn't scan the tables
     twitch_db = TwitchDB()
-    conn = twitch_db.get_connection()
-    counts = {}
-    for table in TWITCH_TABLE_NAMES:
-        for row in conn.execute(f"SELECT COUNT(*) FROM {table};"):
-            counts[table] = row[0]
-    conn.close()
+    conn = twitch_db.get_reader_connection(allow_writer = False)
+    counts = twitch_db.get_row_counts(conn, TWITCH_TABLE_NAMES)
+    twitch_db.release_connection(conn)
 
 
     # check the previous counts
@@ -0,0 +1,70 @@
+# ==============================================================================
+# About: test_resilience.py
+# ==============================================================================
+# test_resilience.py checks that a CircuitBreaker can't get stuck half-open
+# -> run it from the root folder of the repo: `python -m unittest tests/test_resilience.py`
+#
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import unittest
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import *
+
+
+# a stand-in for requests.Response, send_request() only reads status_code
+Response = collections.namedtuple('Response', ['status_code'])
+
+
+# ==============================================================================
+# Tests
+# ==============================================================================
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold = 1, reset_timeout = 0.05)
+        self.retry_policy = RetryPolicy(max_attempts = 1)
+        self.num_sent = 0
+
+    def send(self, status_code):
+        def send():
+            self.num_sent += 1
+            return Response(status_code)
+        return send_request(send, 'test', self.breaker, self.retry_policy)
+
+    # open -> half-open -> 429 goes back to open, and the next trial after reset_timeout is sent
+    def test_rate_limited_trial_reopens(self):
+        self.send(500)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.send(200), False)
+        self.assertEqual(self.num_sent, 1)
+
+        time.sleep(0.06)
+        self.assertEqual(self.send(429).status_code, 429)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.send(200), False) # <- open again, fails fast
+
+        time.sleep(0.06)
+        self.assertEqual(self.send(200).status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.num_sent, 3)
+
+    # a trial that never reports back doesn't keep the breaker half-open forever
+    def test_lost_trial_is_replaced(self):
+        self.send(500)
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.allow_request()) # <- the trial, its result is never recorded
+        self.assertFalse(self.breaker.allow_request())
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.allow_request())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,674 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: api_stand_in_server.py
+# ==============================================================================
+# api_stand_in_server.py is a local stand-in for the Twitch and Mixer APIs, used to benchmark the scrapers offline
+# -> it serves the endpoints TwitchAPI and MixerAPI use from a synthetic (seeded, repeatable) set of streams and channels
+# -> it sends the same rate-limit headers as the real APIs and answers with 429 when a bucket is empty
+# -> latency, jitter and server errors can be injected with command line flags
+# -> --record proxies requests to the real APIs and saves the responses, --replay serves those saved responses again
+#
+# Point the scrapers at it with these keys in credentials.json:
+#   credentials['twitch']['helix']['api_base_url']   = 'http://localhost:8800'
+#   credentials['twitch']['helix']['oauth_base_url'] = 'http://localhost:8800'
+#   credentials['mixer']['api_base_url']             = 'http://localhost:8800'
+#
+# Endpoints
+# - Twitch: /helix/streams, /helix/games, /helix/tags/streams, /helix/users, /helix/users/follows, /oauth2/token
+# - Mixer:  /api/v1/channels, /api/v1/channels/{id}, /api/v1/recordings, /api/v1/types/{id}
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import gzip
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+import urllib.parse
+import http.server
+
+import requests
+
+
+# Constants --------------------------------------------------------------------
+
+UPSTREAM_URLS = {
+    '/helix/':  'https://api.twitch.tv',
+    '/oauth2/': 'https://id.twitch.tv',
+    '/api/v1/': 'https://mixer.com'
+}
+
+# roughly the share of Twitch streams in each language
+TWITCH_LANGUAGES = [
+    ('en', 45), ('es', 9), ('ru', 8), ('de', 6), ('pt', 6), ('fr', 5), ('ko', 4), ('ja', 3), ('zh', 2), ('it', 2),
+    ('pl', 2), ('tr', 2), ('ar', 1), ('th', 1), ('cs', 1), ('sv', 1), ('nl', 1), ('other', 1)
+]
+
+# query params that identify the client rather than the request, left out of recorded response keys
+UNRECORDED_PARAMS = ['client_id', 'client_secret', 'Client-ID']
+
+
+# ==============================================================================
+# Class: SyntheticData
+# ==============================================================================
+
+# SyntheticData generates the streams, channels, games and users served by the stand-in server
+# -> everything is generated from a seed, so two runs with the same options serve the same data
+# -> viewer counts drift over time, so streams move between pages while a crawl is running (like the real APIs)
+class SyntheticData():
+
+    def __init__(self, num_streams = 20000, num_channels = 2000, num_games = 500, seed = 0):
+        self.num_games = num_games
+        self.seed      = seed
+        rng = random.Random(seed)
+
+        self.tag_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for i in range(200)]
+        languages, weights = zip(*TWITCH_LANGUAGES)
+
+        # Twitch livestreams, viewer counts follow a long tail and ~15% of streams have no viewers
+        self.streams = []
+        for i in range(num_streams):
+            self.streams.append({
+                'id':            str(30000000000 + i),
+                'user_id':       str(100000000 + i),
+                'user_name':     'streamer_' + str(i),
+                'game_id':       '' if (rng.random() < 0.01) else str(self.__pick_game(rng)),
+                'type':          'live',
+                'title':         'stream ' + str(i),
+                'base_viewers':  0 if (rng.random() < 0.15) else int(50000 / ((i + 1) ** 0.9)) + rng.randint(0, 3),
+                'language':      rng.choices(languages, weights)[0],
+                'started_at':    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - rng.randint(60, 12 * 3600))),
+                'tag_ids':       rng.sample(self.tag_ids, rng.randint(0, 3)) if (rng.random() < 0.9) else None,
+                'thumbnail_url': ''
+            })
+
+        # Mixer channels
+        self.channels = []
+        self.channels_by_id = {}
+        for i in range(num_channels):
+            channel = self.__create_channel(rng, 1000 + i, i)
+            self.channels.append(channel)
+            self.channels_by_id[channel['id']] = channel
+
+        self.sorted_lock  = threading.Lock()
+        self.sorted_cache = {} # <- lookup table of {name: (second, sorted list)}
+        return
+
+    def __pick_game(self, rng):
+        return 1 + int(self.num_games * (rng.random() ** 3)) # <- a few games have most of the streams
+
+    def __create_channel(self, rng, channel_id, rank):
+        username = 'channel_' + str(channel_id)
+        game_id = self.__pick_game(rng)
+        return {
+            'id':             channel_id,
+            'userId':         channel_id + 500000,
+            'token':          username,
+            'name':           'stream ' + str(channel_id),
+            'online':         True,
+            'audience':       rng.choice(['family', 'teen', '18+']),
+            'viewersTotal':   rng.randint(0, 5000000),
+            'base_viewers':   int(8000 / ((rank + 1) ** 1.1)),
+            'numFollowers':   rng.randint(0, 200000),
+            'description':    'a synthetic channel',
+            'partnered':      rng.random() < 0.05,
+            'hasVod':         rng.random() < 0.5,
+            'vodsEnabled':    True,
+            'bannerUrl':      None,
+            'createdAt':      '2018-01-01T00:00:00.000Z',
+            'languageId':     rng.choice(['en', 'en', 'en', 'es', 'de', 'fr', None]),
+            'featureLevel':   0,
+            'typeId':         game_id,
+            'num_recordings': int(rng.random() ** 2 * 250),
+            'user': {
+                'id':         channel_id + 500000,
+                'username':   username,
+                'avatarUrl':  None,
+                'level':      rng.randint(1, 100),
+                'social':     {'verified': []},
+                'verified':   rng.random() < 0.5,
+                'sparks':     rng.randint(0, 1000000),
+                'experience': rng.randint(0, 1000000),
+                'bio':        None
+            }
+        }
+
+    # Viewers ------------------------------------------------------------------
+
+    # viewer counts drift a few percent every few seconds
+    def __get_viewers(self, base_viewers, i, now):
+        if (base_viewers == 0):
+            return 0
+        return max(1, int(base_viewers * (1 + 0.05 * math.sin(now / 7.0 + i))))
+
+    # returns items sorted by current viewers, the sort is cached for up to a second
+    def __get_sorted(self, name, items):
+        second = int(time.time())
+        with self.sorted_lock:
+            if ((name in self.sorted_cache) and (self.sorted_cache[name][0] == second)):
+                return self.sorted_cache[name][1]
+
+        ranked = []
+        for i in range(len(items)):
+            ranked.append((self.__get_viewers(items[i]['base_viewers'], i, second), i))
+        ranked.sort(key=lambda v: -v[0])
+
+        with self.sorted_lock:
+            self.sorted_cache[name] = (second, ranked)
+        return ranked
+
+    # Twitch -------------------------------------------------------------------
+
+    # returns the streams matching filters (a lookup table of {param: [values]}), sorted by viewers
+    def get_streams(self, filters):
+        streams = []
+        for viewers, i in self.__get_sorted('streams', self.streams):
+            stream = self.streams[i]
+            if (('language' in filters) and (stream['language'] not in filters['language'])):
+                continue
+            if (('game_id' in filters) and (stream['game_id'] not in filters['game_id'])):
+                continue
+            if (('user_id' in filters) and (stream['user_id'] not in filters['user_id'])):
+                continue
+            streams.append((viewers, stream))
+        return streams
+
+    def to_api_stream(self, viewers, stream):
+        obj = dict(stream)
+        del obj['base_viewers']
+        obj['viewer_count'] = viewers
+        return obj
+
+    def get_game(self, game_id):
+        if ((not game_id.isdigit()) or (not (1 <= int(game_id) <= self.num_games))):
+            return False
+        return {'id': game_id, 'name': 'Game ' + game_id, 'box_art_url': 'https://example.com/' + game_id + '-{width}x{height}.jpg'}
+
+    def get_tag(self, tag_id):
+        if (tag_id not in self.tag_ids):
+            return False
+        return {
+            'tag_id':                    tag_id,
+            'is_auto':                   False,
+            'localization_names':        {'en-us': 'Tag ' + tag_id[:8]},
+            'localization_descriptions': {'en-us': 'Synthetic tag ' + tag_id[:8]}
+        }
+
+    # any numeric id is a user, so streamers that are no longer live can still be looked up
+    def get_user(self, user_id):
+        if (not user_id.isdigit()):
+            return False
+        rng = random.Random(self.seed * 1000003 + int(user_id))
+        return {
+            'id':                user_id,
+            'login':             'user_' + user_id,
+            'display_name':      'User_' + user_id,
+            'type':              '',
+            'broadcaster_type':  rng.choice(['', '', '', 'affiliate', 'affiliate', 'partner']),
+            'description':       'a synthetic user',
+            'profile_image_url': '',
+            'offline_image_url': '',
+            'view_count':        rng.randint(0, 1000000)
+        }
+
+    def get_num_followers(self, user_id):
+        if (not user_id.isdigit()):
+            return 0
+        return random.Random(self.seed * 1000003 + int(user_id)).randint(0, 100000)
+
+    # Mixer --------------------------------------------------------------------
+
+    # returns the live channels sorted by viewers, in the format of /api/v1/channels
+    def get_channels(self):
+        channels = []
+        for viewers, i in self.__get_sorted('channels', self.channels):
+            channels.append(self.to_api_channel(self.channels[i], viewers))
+        return channels
+
+    def get_channel(self, channel_id):
+        channel = self.channels_by_id.get(int(channel_id), False) if (channel_id.isdigit()) else False
+        if (channel == False):
+            for c in self.channels:
+                if (c['token'].lower() == channel_id.lower()):
+                    channel = c
+        return self.to_api_channel(channel, channel['base_viewers']) if (channel != False) else False
+
+    def to_api_channel(self, channel, viewers):
+        obj = dict(channel)
+        del obj['base_viewers']
+        del obj['num_recordings']
+        obj['viewersCurrent'] = viewers
+        obj['type'] = self.get_type(str(channel['typeId']))
+        return obj
+
+    def get_type(self, type_id):
+        if ((not type_id.isdigit()) or (not (1 <= int(type_id) <= self.num_games))):
+            return False
+        return {
+            'id':             int(type_id),
+            'name':           'Game ' + type_id,
+            'parent':         'Games',
+            'description':    None,
+            'source':         'igdb',
+            'viewersCurrent': random.Random(int(type_id)).randint(0, 20000),
+            'online':         random.Random(int(type_id)).randint(0, 500),
+            'coverUrl':       None,
+            'backgroundUrl':  None
+        }
+
+    def get_recordings(self, channel_id, page, limit):
+        channel = self.channels_by_id.get(channel_id, False)
+        if (channel == False):
+            return []
+
+        recordings = []
+        for n in range(page * limit, min(channel['num_recordings'], (page + 1) * limit)):
+            rng = random.Random(channel_id * 1000 + n)
+            recordings.append({
+                'id':         channel_id * 1000 + n,
+                'name':       'recording ' + str(n),
+                'typeId':     self.__pick_game(rng) if (rng.random() < 0.95) else None,
+                'viewsTotal': rng.randint(0, 10000),
+                'duration':   rng.uniform(60, 6 * 3600),
+                'channelId':  channel_id,
+                'createdAt':  '2019-01-01T00:00:00.000Z',
+                'state':      'AVAILABLE'
+            })
+        return recordings
+
+
+# ==============================================================================
+# Class: RateLimitBuckets
+# ==============================================================================
+
+# RateLimitBuckets keeps one token bucket per (bucket name, client id), like the real APIs do
+class RateLimitBuckets():
+
+    def __init__(self, limits):
+        self.limits  = limits # <- lookup table of {bucket name: (capacity, refill_period)}
+        self.buckets = {}     # <- lookup table of {(bucket name, client id): [tokens, last_refill]}
+        self.lock    = threading.Lock()
+        return
+
+    # takes a point from the bucket, returns (allowed, limit, remaining, reset) where reset is in epoch seconds
+    def take(self, name, client_id):
+        capacity, refill_period = self.limits[name]
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.setdefault((name, client_id), [float(capacity), now])
+            bucket[0] = min(float(capacity), bucket[0] + (now - bucket[1]) * (capacity / refill_period))
+            bucket[1] = now
+            allowed = bucket[0] >= 1
+            if (allowed):
+                bucket[0] -= 1
+            remaining = int(bucket[0])
+            reset = now + (capacity - bucket[0]) * (refill_period / capacity)
+        return allowed, capacity, remaining, reset
+
+
+# ==============================================================================
+# Class: ResponseTape
+# ==============================================================================
+
+# ResponseTape saves responses from the real APIs (record mode) and serves them again (replay mode)
+# -> responses are saved to <directory>/responses.jsonl, one JSON object per line
+# -> a request is matched by its method, path and query params (ignoring client credentials)
+# -> if the same request was recorded several times, replay cycles through the recorded responses in order
+class ResponseTape():
+
+    def __init__(self, directory):
+        self.filepath  = os.path.join(directory, 'responses.jsonl')
+        self.responses = {} # <- lookup table of {key: [response]}
+        self.positions = {} # <- lookup table of {key: index of the next response to replay}
+        self.lock      = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        return
+
+    @staticmethod
+    def get_key(method, path, params):
+        params = sorted([(k, v) for k, v in params if (k not in UNRECORDED_PARAMS)])
+        return method + ' ' + path + '?' + urllib.parse.urlencode(params)
+
+    def load(self):
+        if (not os.path.isfile(self.filepath)):
+            return 0
+        with open(self.filepath) as f:
+            for line in f:
+                response = json.loads(line)
+                self.responses.setdefault(response['key'], []).append(response)
+        return sum([len(v) for v in self.responses.values()])
+
+    def save(self, key, status, body):
+        with self.lock:
+            with open(self.filepath, 'a') as f:
+                f.write(json.dumps({'key': key, 'status': status, 'body': body}) + '\n')
+
+    # returns (status, body) or False if this request wasn't recorded
+    def replay(self, key):
+        with self.lock:
+            if (key not in self.responses):
+                return False
+            position = self.positions.get(key, 0)
+            self.positions[key] = (position + 1) % len(self.responses[key])
+            response = self.responses[key][position]
+        return response['status'], response['body']
+
+
+# ==============================================================================
+# Class: StandInServer
+# ==============================================================================
+
+class StandInServer():
+
+    # options is an argparse.Namespace (or any object) with the fields defined in get_argument_parser()
+    def __init__(self, options):
+        self.options  = options
+        self.data     = SyntheticData(options.num_streams, options.num_channels, options.num_games, options.seed)
+        self.tokens   = {}  # <- lookup table of {access_token: date_expires}
+        self.lock     = threading.Lock()
+        self.rng      = random.Random(options.seed)
+        self.stats    = {'num_requests': 0, 'num_throttled': 0, 'num_errors_injected': 0, 'num_unauthorized': 0, 'num_not_recorded': 0}
+        self.buckets  = RateLimitBuckets({
+            'helix':          (options.helix_rate_limit, 60),
+            'channel-search': (20, 5),
+            'general':        (1000, 60)
+        })
+
+        self.tape = False
+        if (options.record != False):
+            self.tape = ResponseTape(options.record)
+        elif (options.replay != False):
+            self.tape = ResponseTape(options.replay)
+            print('loaded ' + str(self.tape.load()) + ' recorded responses from ' + self.tape.filepath)
+
+        self.httpd = http.server.ThreadingHTTPServer((options.host, options.port), self.__create_handler())
+        self.httpd.daemon_threads = True
+        self.thread = False
+        return
+
+    def get_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://' + host + ':' + str(port)
+
+    # Running ------------------------------------------------------------------
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    # runs the server in a background thread (ie: from tools/benchmark_procedures.py)
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.get_url()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def __increment(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    # Handler ------------------------------------------------------------------
+
+    def __create_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # <- keep-alive, so the scrapers' connection pools behave like they do in production
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                if (server.options.verbose):
+                    http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+        return Handler
+
+    def handle(self, handler, method):
+        self.__increment('num_requests')
+        url = urllib.parse.urlsplit(handler.path)
+        params = urllib.parse.parse_qsl(url.query, keep_blank_values=True)
+        if (method == 'POST'):
+            length = int(handler.headers.get('Content-Length', 0))
+            params += urllib.parse.parse_qsl(handler.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+
+        # injected latency and errors
+        delay_ms = self.options.latency_ms + self.rng.uniform(0, self.options.jitter_ms)
+        if (delay_ms > 0):
+            time.sleep(delay_ms / 1000.0)
+        if (self.rng.random() < self.options.error_rate):
+            self.__increment('num_errors_injected')
+            return self.__send(handler, self.rng.choice([500, 502, 503]), {'error': 'Injected Error'})
+
+        if (self.options.record != False):
+            return self.__proxy(handler, method, url.path, params)
+
+        # rate limits
+        headers = {}
+        if (url.path.startswith('/helix/')):
+            client_id = handler.headers.get('Client-ID', '')
+            allowed, limit, remaining, reset = self.buckets.take('helix', client_id)
+            headers = {'Ratelimit-Limit': str(limit), 'Ratelimit-Remaining': str(remaining), 'Ratelimit-Reset': str(int(math.ceil(reset)))}
+        elif (url.path.startswith('/api/v1/')):
+            client_id = handler.headers.get('Client-ID', dict(params).get('Client-ID', ''))
+            bucket = 'channel-search' if (url.path.startswith('/api/v1/channels')) else 'general'
+            allowed, limit, remaining, reset = self.buckets.take(bucket, client_id)
+            headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(int(reset * 1000))}
+        else:
+            allowed = True
+        if (not allowed):
+            self.__increment('num_throttled')
+            return self.__send(handler, 429, {'error': 'Too Many Requests', 'status': 429}, headers)
+
+        # Helix requests need a token from /oauth2/token
+        if (url.path.startswith('/helix/') and (not self.__is_authorized(handler))):
+            self.__increment('num_unauthorized')
+            return self.__send(handler, 401, {'error': 'Unauthorized', 'status': 401, 'message': 'Invalid OAuth token'}, headers)
+
+        if ((self.tape != False) and (url.path != '/oauth2/token')):
+            response = self.tape.replay(ResponseTape.get_key(method, url.path, params))
+            if (response == False):
+                self.__increment('num_not_recorded')
+                return self.__send(handler, 404, {'error': 'Not Recorded', 'status': 404}, headers)
+            return self.__send(handler, response[0], response[1], headers)
+
+        status, body = self.__route(method, url.path, params)
+        return self.__send(handler, status, body, headers)
+
+    # sends a JSON response, gzipped if the client accepts it
+    def __send(self, handler, status, body, headers = {}):
+        data = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        if ('gzip' in handler.headers.get('Accept-Encoding', '')):
+            data = gzip.compress(data, compresslevel=1)
+            handler.send_header('Content-Encoding', 'gzip')
+        handler.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    # Routes -------------------------------------------------------------------
+
+    # returns (status, body) for a request served from the synthetic data
+    def __route(self, method, path, params):
+        values = {}
+        for k, v in params:
+            values.setdefault(k, []).append(v)
+
+        if ((method == 'POST') and (path == '/oauth2/token')):
+            return self.__route_token(values)
+        if (method != 'GET'):
+            return 405, {'error': 'Method Not Allowed', 'status': 405}
+
+        if (path == '/helix/streams'):
+            return self.__route_streams(values)
+        if (path == '/helix/games'):
+            return 200, {'data': self.__lookup(values.get('id', []), self.data.get_game)}
+        if (path == '/helix/tags/streams'):
+            return 200, {'data': self.__lookup(values.get('tag_id', []), self.data.get_tag), 'pagination': {}}
+        if (path == '/helix/users'):
+            return 200, {'data': self.__lookup(values.get('id', []), self.data.get_user)}
+        if (path == '/helix/users/follows'):
+            return 200, {'total': self.data.get_num_followers(values.get('to_id', [''])[0]), 'data': [], 'pagination': {}}
+
+        if (path == '/api/v1/channels'):
+            page, limit = self.__get_int(values, 'page', 0), min(100, self.__get_int(values, 'limit', 50))
+            return 200, self.data.get_channels()[page * limit:(page + 1) * limit]
+        if (path.startswith('/api/v1/channels/')):
+            return self.__found(self.data.get_channel(path.split('/')[-1]))
+        if (path == '/api/v1/recordings'):
+            return self.__route_recordings(values)
+        if (path.startswith('/api/v1/types/')):
+            return self.__found(self.data.get_type(path.split('/')[-1]))
+
+        return 404, {'error': 'Not Found', 'status': 404}
+
+    def __route_token(self, values):
+        if ((values.get('grant_type', [''])[0] != 'client_credentials') or ('client_id' not in values)):
+            return 400, {'status': 400, 'message': 'invalid client'}
+        access_token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[access_token] = time.time() + self.options.token_ttl
+        return 200, {'access_token': access_token, 'expires_in': self.options.token_ttl, 'token_type': 'bearer'}
+
+    # cursors are base64 encoded offsets, so (like the real API) streams that move while a crawl is running can be missed or seen twice
+    def __route_streams(self, values):
+        first = min(100, self.__get_int(values, 'first', 20))
+        offset = 0
+        if ('after' in values):
+            try:
+                offset = int(base64.urlsafe_b64decode(values['after'][0].encode('utf-8')).decode('utf-8'))
+            except ValueError:
+                return 400, {'error': 'Bad Request', 'status': 400, 'message': 'invalid cursor'}
+
+        streams = self.data.get_streams(values)
+        page = [self.data.to_api_stream(viewers, stream) for viewers, stream in streams[offset:offset + first]]
+        pagination = {}
+        if (offset + first < len(streams)):
+            pagination['cursor'] = base64.urlsafe_b64encode(str(offset + first).encode('utf-8')).decode('utf-8')
+        return 200, {'data': page, 'pagination': pagination}
+
+    def __route_recordings(self, values):
+        where = values.get('where', [''])[0].split(':')
+        if ((len(where) != 3) or (where[0] != 'channelId') or (where[1] != 'eq') or (not where[2].isdigit())):
+            return 400, {'error': 'Bad Request', 'statusCode': 400}
+        page, limit = self.__get_int(values, 'page', 0), min(100, self.__get_int(values, 'limit', 50))
+        return 200, self.data.get_recordings(int(where[2]), page, limit)
+
+    def __is_authorized(self, handler):
+        authorization = handler.headers.get('Authorization', '')
+        if (not authorization.startswith('Bearer ')):
+            return False
+        with self.lock:
+            return self.tokens.get(authorization[len('Bearer '):], 0) > time.time()
+
+    def __lookup(self, ids, fn):
+        items = []
+        for id in ids:
+            item = fn(id)
+            if (item != False):
+                items.append(item)
+        return items
+
+    def __found(self, item):
+        if (item == False):
+            return 404, {'error': 'Not Found', 'statusCode': 404}
+        return 200, item
+
+    def __get_int(self, values, key, default):
+        try:
+            return int(values[key][0]) if (key in values) else default
+        except ValueError:
+            return default
+
+    # Recording ----------------------------------------------------------------
+
+    # forwards the request to the real API and saves the response (token responses are never saved)
+    def __proxy(self, handler, method, path, params):
+        upstream = False
+        for prefix, url in UPSTREAM_URLS.items():
+            if (path.startswith(prefix)):
+                upstream = url
+        if (upstream == False):
+            return self.__send(handler, 404, {'error': 'Not Found', 'status': 404})
+
+        headers = {}
+        for key in ['Authorization', 'Client-ID']:
+            if (key in handler.headers):
+                headers[key] = handler.headers[key]
+        try:
+            r = requests.request(method, upstream + path, params=params, headers=headers, timeout=(10, 30))
+        except requests.exceptions.RequestException as e:
+            return self.__send(handler, 502, {'error': 'Bad Gateway', 'message': str(e)})
+
+        try:
+            body = r.json()
+        except ValueError:
+            body = {'error': r.text}
+
+        if ((path != '/oauth2/token') and (r.status_code != 429)):
+            self.tape.save(ResponseTape.get_key(method, path, params), r.status_code, body)
+
+        headers = {}
+        for key, value in r.headers.items():
+            if (key.lower().startswith('ratelimit-') or key.lower().startswith('x-ratelimit-')):
+                headers[key] = value
+        return self.__send(handler, r.status_code, body, headers)
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+# returns the parser for the server's command line options, shared with tools/benchmark_procedures.py
+def get_argument_parser(description = 'Serves a local stand-in for the Twitch and Mixer APIs.'):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--host', dest='host', default='localhost', help='Host to listen on.')
+    parser.add_argument('--port', dest='port', type=int, default=8800, help='Port to listen on, 0 picks a free port.')
+    parser.add_argument('--num-streams', dest='num_streams', type=int, default=20000, help='Number of synthetic Twitch livestreams.')
+    parser.add_argument('--num-channels', dest='num_channels', type=int, default=2000, help='Number of synthetic Mixer channels.')
+    parser.add_argument('--num-games', dest='num_games', type=int, default=500, help='Number of synthetic games.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Seed for the synthetic data.')
+    parser.add_argument('--latency-ms', dest='latency_ms', type=float, default=0, help='Latency added to every response, in milliseconds.')
+    parser.add_argument('--jitter-ms', dest='jitter_ms', type=float, default=0, help='Random extra latency of up to this many milliseconds.')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0, help='Share of requests (0 to 1) answered with a 5xx error.')
+    parser.add_argument('--helix-rate-limit', dest='helix_rate_limit', type=int, default=800, help='Helix points per minute per client id.')
+    parser.add_argument('--token-ttl', dest='token_ttl', type=int, default=3600, help='Seconds before an issued OAuth token expires.')
+    parser.add_argument('--record', dest='record', default=False, help='Proxy requests to the real APIs and save the responses in this directory.')
+    parser.add_argument('--replay', dest='replay', default=False, help='Serve the responses saved in this directory instead of synthetic data.')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='Log every request.')
+    return parser
+
+
+def main():
+    options = get_argument_parser().parse_args()
+    server = StandInServer(options)
+    print('serving the Twitch and Mixer API stand-in on ' + server.get_url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.get_stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: benchmark_db_writes.py
+# ==============================================================================
+# benchmark_db_writes.py compares the rows per second of the db write helpers
+# -> 'execute':     one conn.execute per row, the way the procedures used to write (ie: insert_livestream_snapshot in a loop)
+# -> 'executemany': the batch helpers the procedures use now (ie: insert_livestream_snapshots)
+# -> rows are built from tools/api_stand_in_server.py's synthetic data and written to temporary dbs
+# -> run it from the root folder of the repo: `python tools/benchmark_db_writes.py --num-rows 20000`
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_stand_in_server import SyntheticData
+
+
+# Command Line Arguments -------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='Compares per-row and batch writes for the db helpers.')
+parser.add_argument('--num-rows', dest='num_rows', type=int, default=20000, help='Number of rows written by each benchmark.')
+parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='Number of times each benchmark is run, the best run is reported.')
+args = parser.parse_args()
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+# builds the objects the scrapers would have in memory after scraping num_rows streams/channels
+def create_objects(num_rows):
+    from twitch_scraper import TwitchLivestreamSnapshot, TwitchStreamer
+    from mixer_scraper import MixerChannel
+
+    data = SyntheticData(num_streams=num_rows, num_channels=num_rows)
+    objects = {'livestreams': [], 'streamers': [], 'channels': []}
+    for viewers, stream in data.get_streams({}):
+        objects['livestreams'].append(TwitchLivestreamSnapshot(data.to_api_stream(viewers, stream), 'api/livestreams'))
+        objects['streamers'].append(TwitchStreamer(data.get_user(stream['user_id']), 'api/users'))
+    for channel in data.get_channels():
+        objects['channels'].append(MixerChannel(channel, 'api/channels'))
+    return objects
+
+
+# returns a list of (name, write_per_row, write_batch) benchmarks
+# -> write_per_row(db, conn, objects) and write_batch(db, conn, objects) write the same rows
+def get_benchmarks():
+
+    def per_row(helper):
+        def write(db, conn, items):
+            for item in items:
+                helper(db, conn, item)
+        return write
+
+    return [
+        ('twitch livestream_snapshots', 'twitch', 'livestreams',
+            per_row(lambda db, conn, v: db.insert_livestream_snapshot(conn, v)),
+            lambda db, conn, items: db.insert_livestream_snapshots(conn, items)),
+        ('twitch streamers', 'twitch', 'streamers',
+            per_row(lambda db, conn, v: db.insert_new_streamer(conn, v)),
+            lambda db, conn, items: db.insert_new_streamers(conn, items)),
+        ('twitch total_views', 'twitch', 'streamers',
+            per_row(lambda db, conn, v: db.insert_total_views_for_streamer(conn, v)),
+            lambda db, conn, items: db.insert_total_views_for_streamers(conn, items)),
+        ('twitch followers', 'twitch', 'streamers',
+            per_row(lambda db, conn, v: db.insert_followers_count(conn, v.id, v.view_count)),
+            lambda db, conn, items: db.insert_followers_counts(conn, [(v.id, v.view_count) for v in items])),
+        ('mixer channels', 'mixer', 'channels',
+            per_row(lambda db, conn, v: db.insert_new_channel(conn, v)),
+            lambda db, conn, items: db.insert_new_channels(conn, items)),
+        ('mixer followers', 'mixer', 'channels',
+            per_row(lambda db, conn, v: db.insert_time_series_data(conn, v, 'followers')),
+            lambda db, conn, items: db.insert_time_series_data_for_channels(conn, items, 'followers')),
+        ('mixer livestream_snapshots', 'mixer', 'channels',
+            per_row(lambda db, conn, v: db.insert_livestream_snapshot(conn, v)),
+            lambda db, conn, items: db.insert_livestream_snapshots(conn, items))
+    ]
+
+
+# writes items into a new db and returns the number of seconds it took (including the commit)
+def time_write(platform, write, items):
+    from db_manager import TwitchDB, MixerDB, get_connection_manager, get_partition_manager
+
+    db = TwitchDB() if (platform == 'twitch') else MixerDB()
+    path = tempfile.mkdtemp(prefix='db_write_benchmark_')
+    db.filepath = os.path.join(path, platform + '.db')
+    db.connections = get_connection_manager(db.filepath)
+    if (platform == 'twitch'):
+        db.partitions = get_partition_manager(db.filepath, db.commands, 'twitch')
+    db.create_tables()
+
+    conn = db.get_connection()
+    db.prepare_write_connection(conn)
+    time_started = time.perf_counter()
+    write(db, conn, items)
+    conn.commit()
+    seconds = time.perf_counter() - time_started
+    db.connections.close_thread_connections()
+    shutil.rmtree(path)
+    return seconds
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # <- the db classes load ./sql/*.json
+    objects = create_objects(args.num_rows)
+
+    print('benchmark'.ljust(30) + 'rows'.rjust(8) + 'execute rows/s'.rjust(18) + 'executemany rows/s'.rjust(22) + 'speedup'.rjust(10))
+    for name, platform, object_type, write_per_row, write_batch in get_benchmarks():
+        items = objects[object_type]
+        per_row_seconds = min([time_write(platform, write_per_row, items) for i in range(args.repeat)])
+        batch_seconds   = min([time_write(platform, write_batch, items) for i in range(args.repeat)])
+        print(
+            name.ljust(30) +
+            str(len(items)).rjust(8) +
+            ('%.0f' % (len(items) / per_row_seconds)).rjust(18) +
+            ('%.0f' % (len(items) / batch_seconds)).rjust(22) +
+            ('%.2fx' % (per_row_seconds / batch_seconds)).rjust(10)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: benchmark_procedures.py
+# ==============================================================================
+# benchmark_procedures.py times the scraping procedures end to end against tools/api_stand_in_server.py
+# -> the procedures run in a temporary folder with their own credentials.json, data/ and tmp/, so production dbs aren't touched
+# -> every option of api_stand_in_server.py can be used here (ie: --latency-ms, --error-rate, --replay)
+# -> run it from the root folder of the repo: `python tools/benchmark_procedures.py --latency-ms 80 --jitter-ms 40`
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_stand_in_server import *
+
+
+# Constants --------------------------------------------------------------------
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the procedures that can be benchmarked, in the order they should run (later procedures use the rows earlier ones insert)
+PROCEDURES = [
+    'twitch-livestreams',
+    'twitch-followers',
+    'twitch-inactive',
+    'twitch-compress',
+    'mixer-livestreams',
+    'mixer-recordings',
+    'mixer-inactive'
+]
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+# creates a working folder with credentials that point both scrapers at the stand-in server
+def create_working_folder(url):
+    path = tempfile.mkdtemp(prefix='scraper_benchmark_')
+    os.mkdir(os.path.join(path, 'data'))
+    os.mkdir(os.path.join(path, 'tmp'))
+    os.symlink(os.path.join(REPO_PATH, 'sql'), os.path.join(path, 'sql'))
+
+    credentials = {
+        'twitch': {'helix': {'client_id': 'benchmark', 'client_secret': 'benchmark', 'api_base_url': url, 'oauth_base_url': url}},
+        'mixer':  {'client_id': 'benchmark', 'api_base_url': url}
+    }
+    with open(os.path.join(path, 'credentials.json'), 'w') as f:
+        json.dump(credentials, f)
+    return path
+
+
+# returns {procedure name: function} for the procedures that were asked for
+def get_procedures(names):
+    from twitch_scraper import TwitchScraper
+    from mixer_scraper import MixerScraper
+
+    procedures = {}
+    if (any([name.startswith('twitch') for name in names])):
+        twitch_scraper = TwitchScraper()
+        twitch_scraper.db.create_tables()
+        procedures['twitch-livestreams'] = twitch_scraper.procedure_scrape_livestream_snapshots
+        procedures['twitch-followers']   = twitch_scraper.procedure_scrape_followers
+        procedures['twitch-inactive']    = twitch_scraper.procedure_scrape_inactive
+        procedures['twitch-compress']    = twitch_scraper.procedure_compress_livestreams
+    if (any([name.startswith('mixer') for name in names])):
+        mixer_scraper = MixerScraper()
+        mixer_scraper.db.create_tables()
+        procedures['mixer-livestreams'] = mixer_scraper.procedure_scrape_livestreams
+        procedures['mixer-recordings']  = mixer_scraper.procedure_scrape_recordings
+        procedures['mixer-inactive']    = mixer_scraper.procedure_scrape_inactive
+    return procedures
+
+
+def main():
+    parser = get_argument_parser('Times the scraping procedures against a local stand-in for the Twitch and Mixer APIs.')
+    parser.set_defaults(port=0)
+    parser.add_argument('--procedures', dest='procedures', nargs='+', choices=PROCEDURES, default=PROCEDURES, help='Procedures to run.')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=1, help='Number of times each procedure is run.')
+    parser.add_argument('--url', dest='url', default=False, help='Use an already running stand-in server instead of starting one.')
+    options = parser.parse_args()
+
+    server = False
+    url = options.url
+    if (url == False):
+        server = StandInServer(options)
+        url = server.start()
+
+    path = create_working_folder(url)
+    print('benchmarking against ' + url + ' in ' + path)
+    os.chdir(path)
+
+    from http_session import shared_http_sessions
+    shared_http_sessions.set_pool_size(32)
+
+    procedures = get_procedures(options.procedures)
+    results = []
+    for name in [name for name in PROCEDURES if (name in options.procedures)]:
+        for i in range(options.repeat):
+            time.sleep(1) # <- logs are keyed by (log_name, date_started), so two runs can't start in the same second
+            num_requests = server.get_stats()['num_requests'] if (server != False) else 0
+            time_started = time.time()
+            procedures[name]()
+            procedures[name].__self__.writer.flush() # <- procedures only queue their writes, wait until they're committed
+            seconds = time.time() - time_started
+            num_requests = (server.get_stats()['num_requests'] - num_requests) if (server != False) else 0
+            results.append((name, seconds, num_requests))
+
+    # print results
+    print('')
+    print('procedure'.ljust(24) + 'seconds'.rjust(10) + 'requests'.rjust(10) + 'requests/s'.rjust(12))
+    for name, seconds, num_requests in results:
+        print(name.ljust(24) + ('%.2f' % seconds).rjust(10) + str(num_requests).rjust(10) + ('%.1f' % (num_requests / max(seconds, 0.001))).rjust(12))
+    if (server != False):
+        print('')
+        print('server stats: ' + json.dumps(server.get_stats()))
+        server.stop()
+    for writer in set([procedure.__self__.writer for procedure in procedures.values()]):
+        print(writer.db.filepath + ' writer stats: ' + json.dumps(writer.get_stats()))
+
+
+if __name__ == '__main__':
+    main()
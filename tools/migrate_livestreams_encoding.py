@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: migrate_livestreams_encoding.py
+# ==============================================================================
+# migrate_livestreams_encoding.py rewrites the livestreams saved before compact_codec.py
+# -> tag_ids json text becomes a tag_set_id into the tag_sets table, viewer_counts json text becomes a BLOB
+# -> rows are rewritten in batches, one commit per batch, so it can run while the scrapers are running and can be stopped at any time
+# -> sqlite only gives the freed pages back to the file system with VACUUM, pass --vacuum once the scrapers are stopped
+# -> run it from the root folder of the repo: `python tools/migrate_livestreams_encoding.py --batch-size 5000`
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import *
+
+
+# Command Line Arguments -------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='Rewrites livestreams from json text to the compact encoding of compact_codec.py.')
+parser.add_argument('--batch-size', dest='batch_size', type=int, default=5000, help='Number of livestreams rewritten per commit.')
+parser.add_argument('--vacuum', dest='vacuum', action='store_true', help='Run VACUUM on twitch.db once every livestream was rewritten.')
+args = parser.parse_args()
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+def main():
+    db = TwitchDB()
+    db.create_tables() # <- adds the tag_sets table and tag_set_id columns to a db created before them
+    conn = db.get_connection()
+
+    size_before = os.path.getsize(db.filepath)
+    time_started = time.time()
+    num_rewritten, rowid = 0, 0
+    while (True):
+        num_rows, rowid = db.encode_legacy_livestreams(conn, rowid, args.batch_size)
+        conn.commit()
+        if (num_rows == 0):
+            break
+        num_rewritten += num_rows
+        print('rewrote ' + str(num_rewritten) + ' livestreams (up to rowid ' + str(rowid) + ') in ' + ('%.1f' % (time.time() - time_started)) + 's')
+
+    if (args.vacuum):
+        print('vacuuming ' + db.filepath + '...')
+        conn.execute('VACUUM;')
+    db.release_connection(conn)
+    print('done: rewrote ' + str(num_rewritten) + ' livestreams, ' + db.filepath + ' went from ' + str(size_before) + ' to ' + str(os.path.getsize(db.filepath)) + ' bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: migrate_run_length_time_series.py
+# ==============================================================================
+# migrate_run_length_time_series.py merges the time series rows saved before run-length storage into intervals
+# -> consecutive rows of a streamer/channel with the same value become one row, whose last_confirmed is the last of them
+# -> twitch.db: followers and total_views, in twitch.db and every partition that isn't frozen
+# -> mixer.db: followers, lifetime_viewers, sparks, experience and partnered
+# -> each chunk of streamers/channels is committed on its own, so it can be stopped at any time
+# -> stop the scrapers first: a chunk is read and then rewritten without the db writer, so it could overwrite a last_confirmed a scraper just wrote
+# -> sqlite only gives the freed pages back to the file system with VACUUM, pass --vacuum once the scrapers are stopped
+# -> run it from the root folder of the repo: `python tools/migrate_run_length_time_series.py --dbs twitch mixer`
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import *
+
+
+# Command Line Arguments -------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='Merges unchanged time series rows into run-length intervals.')
+parser.add_argument('--dbs', dest='dbs', nargs='+', choices=['twitch', 'mixer'], default=['twitch', 'mixer'], help='Databases to migrate.')
+parser.add_argument('--vacuum', dest='vacuum', action='store_true', help='Run VACUUM on each db once its tables were merged.')
+args = parser.parse_args()
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+def main():
+    for name in args.dbs:
+        db = TwitchDB() if (name == 'twitch') else MixerDB()
+        table_names = TWITCH_TIME_SERIES_TABLES if (name == 'twitch') else MIXER_TIME_SERIES_TABLES
+        db.create_tables() # <- adds the last_confirmed columns to a db created before them, and to its partitions that aren't frozen
+        conn = db.get_connection()
+
+        for table_name in table_names:
+            time_started = time.time()
+            num_before, num_after = db.merge_time_series_rows(conn, table_name)
+            print(name + '.db ' + table_name + ': ' + str(num_before) + ' rows -> ' + str(num_after) + ' intervals in ' + ('%.1f' % (time.time() - time_started)) + 's')
+
+        if (args.vacuum):
+            print('vacuuming ' + db.filepath + '...')
+            conn.execute('VACUUM;')
+        db.release_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# ==============================================================================
+# About: reconcile_row_counts.py
+# ==============================================================================
+# reconcile_row_counts.py recounts the rows of every counted twitch.db table with COUNT(*) and overwrites its counter in table_stats
+# -> the counters are kept up to date by triggers, this is only needed if rows were written without them (ie: by hand in the sqlite3 shell)
+# -> scans every table of twitch.db and of the partitions that aren't frozen, each db file is recounted in its own transaction
+# -> run it from the root folder of the repo: `python tools/reconcile_row_counts.py`
+#
+
+
+# Imports ----------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import *
+
+
+# ==============================================================================
+# Functions
+# ==============================================================================
+
+def main():
+    db = TwitchDB()
+    db.create_tables() # <- adds table_stats and its triggers to a db created before them
+    conn = db.get_connection()
+
+    time_started = time.time()
+    counts = db.reconcile_row_counts(conn)
+    db.release_connection(conn)
+
+    for table_name, (num_before, num_after) in counts.items():
+        print(table_name.ljust(24) + str(num_after).rjust(12) + ('' if (num_before == num_after) else ('   (was ' + str(num_before) + ')')))
+    print('recounted in ' + ('%.1f' % (time.time() - time_started)) + 's')
+
+
+if __name__ == '__main__':
+    main()
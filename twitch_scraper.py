@@ -19,11 +19,21 @@
 import sys
 import json
 import time
+import queue
+import itertools
 import requests
+import threading
 
 from logs import *
 from db_manager import *
 from stats_objects import *
+from worker_pool import *
+from http_session import *
+from rate_limiter import *
+from resilience import *
+from oauth_tokens import *
+from profile_cache import *
+from db_writer import *
 
 # ==============================================================================
 # Classes: Twitch<Objects>
@@ -72,7 +82,7 @@ class TwitchLivestreamSnapshot():
             self.viewer_count,
             self.started_at,
             self.date_scraped,
-            json.dumps(self.tag_ids),
+            get_tag_set_id(self.get_tag_ids()),
             self.language
         )
 
@@ -159,12 +169,34 @@ class TwitchLivestreamSnapshots():
     def add_from_api(self, obj):
         livestream = TwitchLivestreamSnapshot(obj, 'api/livestreams')
         if (livestream.is_valid()):
-            if (livestream.viewer_count > 0):
-                self.livestreams[livestream.id] = livestream
-            else:
-                self.livestreams_no_viewers[livestream.id] = livestream
+            self.add(livestream)
         return
 
+    # adds a TwitchLivestreamSnapshot, replacing any older snapshot of the same livestream
+    # returns True if the livestream was already in the collection
+    def add(self, livestream):
+        existing = self.get(livestream.id)
+        if (existing != False):
+            if (existing.date_scraped > livestream.date_scraped):
+                return True
+            self.livestreams.pop(livestream.id, None)
+            self.livestreams_no_viewers.pop(livestream.id, None)
+
+        if (livestream.viewer_count > 0):
+            self.livestreams[livestream.id] = livestream
+        else:
+            self.livestreams_no_viewers[livestream.id] = livestream
+        return existing != False
+
+    # adds every livestream from another TwitchLivestreamSnapshots object into this one
+    # returns the number of livestreams that were in both (ie: a stream that changed games between two game_id shards)
+    def merge(self, other):
+        num_duplicates = 0
+        for livestream_id in other.get_all_livestream_ids():
+            if (self.add(other.get(livestream_id))):
+                num_duplicates += 1
+        return num_duplicates
+
 
 # Twitch Game ------------------------------------------------------------------
 
@@ -301,6 +333,10 @@ class TwitchStreamer():
         return
 
 
+    # a short hash of the profile columns saved in the streamers table (everything but date_last_scraped)
+    def get_profile_hash(self):
+        return get_values_hash(self.to_db_tuple('update')[:-1])
+
 
     def to_db_tuple(self, object_type):
         if (object_type == 'insert'):
@@ -361,52 +397,91 @@ class TwitchStreamers():
 # Class: TwitchAPI
 # ==============================================================================
 
+# Helix gives each client 800 points per minute, and every TwitchAPI in this process draws from the same bucket
+helix_rate_limit_governor = RateLimitGovernor(800, 60)
+
+# the order that requests get their permits in when the bucket runs low
+HELIX_REQUEST_PRIORITIES = {
+    'get_livestream': PRIORITY_HIGH,
+    'get_games':      PRIORITY_NORMAL,
+    'get_tags':       PRIORITY_NORMAL,
+    'get_users':      PRIORITY_NORMAL,
+    'get_followers':  PRIORITY_LOW
+}
+
 class TwitchAPI():
 
-    def __init__(self, credentials):
+    # credentials['helix'] can optionally set 'api_base_url' and 'oauth_base_url' to point the scraper at another server
+    # -> ie: tools/api_stand_in_server.py for benchmarking without hitting the live API
+    def __init__(self, credentials, governor = helix_rate_limit_governor):
         self.helix_client_id = credentials['helix']['client_id']
-        self.__set_oauth(credentials['helix'])
+        self.api_base_url    = credentials['helix'].get('api_base_url', 'https://api.twitch.tv')
+        self.oauth_base_url  = credentials['helix'].get('oauth_base_url', 'https://id.twitch.tv')
+        self.governor        = governor
+        self.breakers        = shared_circuit_breakers
+        self.retry_policy    = default_retry_policy
+        self.timeout         = (10, 30) # <- (connect, read) seconds
+        self.tokens          = self.__get_token_manager(credentials['helix'])
         return
 
     # OAuth2 and Headers -------------------------------------------------------
 
-    # Twitch uses OAuth2, so we need to grab an access token
-    def __set_oauth(self, credentials):
-        params = {
-            'client_id': credentials['client_id'],
-            'client_secret': credentials['client_secret'],
-            'grant_type': 'client_credentials'
-        }
-        r = requests.post('https://id.twitch.tv/oauth2/token', params=params)
-        if (r.status_code == 200):
-            data = r.json()
-            self.access_token = data['access_token']
-        else:
-            self.access_token = False
-            print('FALSE')
+    # Twitch uses OAuth2, so we need an app access token
+    # -> the token is shared by every TwitchAPI in this process and cached in ./tmp so restarts don't need to POST for a new one
+    def __get_token_manager(self, credentials):
+        return get_token_manager(credentials['client_id'], credentials['client_secret'], self.oauth_base_url + '/oauth2/token', './tmp/twitch_token.json')
 
 
-    def __get_helix_headers(self):
-        return {'Authorization': 'Bearer ' + self.access_token, 'Client-ID': self.helix_client_id}
+    def __get_helix_headers(self, access_token):
+        return {'Authorization': 'Bearer ' + access_token, 'Client-ID': self.helix_client_id}
 
 
     # Requests and Sleeping ----------------------------------------------------
 
-    def __get(self, url, params, headers, timelogs, request_type):
-        if (timelogs != False):
-            timelogs.start_action(request_type)
-        r = requests.get(url, params=params, headers=headers)
-        if (timelogs != False):
-            timelogs.end_action(request_type)
+    # every request waits for a permit from the shared governor before it is sent
+    # -> Helix's Ratelimit-Remaining/Ratelimit-Reset headers are fed back into the governor after each response
+    # -> a 401 refreshes the shared token and the request is sent again with the new one
+    # -> connection errors, 5xx and 429 responses are retried with backoff, and each endpoint has its own circuit breaker
+    # -> returns False instead of a response if the request couldn't be sent at all
+    def __get(self, url, params, timelogs, request_type):
+        priority = HELIX_REQUEST_PRIORITIES.get(request_type, PRIORITY_NORMAL)
+
+        def send_with_token(access_token):
+            if (timelogs != False):
+                timelogs.start_action('rate_limit_wait')
+            self.governor.acquire(priority)
+            if (timelogs != False):
+                timelogs.end_action('rate_limit_wait')
+                timelogs.start_action(request_type)
+            try:
+                r = shared_http_sessions.get(url, params=params, headers=self.__get_helix_headers(access_token), timeout=self.timeout)
+            finally:
+                if (timelogs != False):
+                    timelogs.end_action(request_type)
+
+            if (r.status_code == 429):
+                self.governor.throttle(r.headers)
+            else:
+                self.governor.update_from_headers(r.headers)
+            return r
+
+        def send():
+            access_token = self.tokens.get_token()
+            if (access_token == False):
+                raise requests.exceptions.RequestException('no oauth token available')
+            r = send_with_token(access_token)
+            if (r.status_code == 401):
+                if (timelogs != False):
+                    timelogs.increment(request_type + '_unauthorized')
+                access_token = self.tokens.handle_unauthorized(access_token)
+                if (access_token != False):
+                    r = send_with_token(access_token)
+            return r
+
+        breaker = self.breakers.get('twitch/' + request_type)
+        r = send_request(send, request_type, breaker, self.retry_policy, timelogs)
         return r, timelogs
 
-    def __sleep(self, header, min_sleep = 0):
-        if (('ratelimit_remaining' in header) and (header['ratelimit_remaining'] <= 1)):
-            print('sleeping...')
-            time.sleep(1)
-        elif (min_sleep > 0):
-            time.sleep(min_sleep)
-
 
     # takes in a list of items and converts them into a list of tuples
     # [v1, v2, ... ] -> [(key, v1), (key, v2), ... ]
@@ -421,74 +496,130 @@ class TwitchAPI():
 
     # scrapes Twitch for a page of 100 livestreams
     def scrape_livestreams(self, livestreams, previous_cursor, timelogs):
+        items, cursor, timelogs = self.fetch_livestreams_page(previous_cursor, timelogs)
+        for item in items:
+            livestreams.add_from_api(item)
+        return livestreams, cursor, timelogs
+
+    # fetches a page of 100 livestreams without parsing them into TwitchLivestreamSnapshot objects
+    # returns the list of livestream dicts from the API, and the cursor for the next page (False if there isn't one)
+    # -> this lets the next page be requested as soon as the cursor is known
+    # -> filters is an optional list of (key, value) query filters, ie: [('language', 'en'), ('language', 'es')]
+    def fetch_livestreams_page(self, previous_cursor, timelogs, filters = False):
 
-        cursor = False
+        items, cursor = [], False
 
         # prepare request headers
-        params = {'first': 100}
+        params = [('first', 100)]
         if (previous_cursor != False):
-            params['after'] = previous_cursor
+            params.append(('after', previous_cursor))
+        if (filters != False):
+            params += filters
 
         # make request
-        r, timelogs = self.__get('https://api.twitch.tv/helix/streams', params, self.__get_helix_headers(), timelogs, 'get_livestream')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/helix/streams', params, timelogs, 'get_livestream')
+        if ((r != False) and (r.status_code == 200)):
             results = r.json()
 
             # get cursor so we can continue where we left off next time
             if (('cursor' in results['pagination']) and (results['pagination']['cursor'] != '')):
                 cursor = results['pagination']['cursor']
+            items = results['data']
 
-            # add livestreams data
-            for item in results['data']:
-                livestreams.add_from_api(item)
-
-        self.__sleep(r.headers)
-        return livestreams, cursor, timelogs
+        return items, cursor, timelogs
 
     # given an array of game_ids, return a TwitchGames object with games
     def scrape_games(self, game_ids, games, timelogs):
         params = self.__format_tuple_params(game_ids, 'id')
-        r, timelogs = self.__get('https://api.twitch.tv/helix/games', params, self.__get_helix_headers(), timelogs, 'get_games')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/helix/games', params, timelogs, 'get_games')
+        if ((r != False) and (r.status_code == 200)):
             results = r.json()
             for row in results['data']:
                 games.add_from_api(row)
-        self.__sleep(r.headers)
         return games, timelogs
 
     # given an array of tag_ids, return a TwitchTags object with tags
     def scrape_tags(self, tag_ids, tags, timelogs):
         params = self.__format_tuple_params(tag_ids, 'tag_id')
-        r, timelogs = self.__get('https://api.twitch.tv/helix/tags/streams', params, self.__get_helix_headers(), timelogs, 'get_tags')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/helix/tags/streams', params, timelogs, 'get_tags')
+        if ((r != False) and (r.status_code == 200)):
             results = r.json()
             for row in results['data']:
                 tags.add_from_api(row)
-        self.__sleep(r.headers)
         return tags, timelogs
 
 
     # given an array of user_ids, return a TwitchStreamers object with streamer profiles
     def scrape_users(self, user_ids, users, timelogs):
         params = self.__format_tuple_params(user_ids, 'id')
-        r, timelogs = self.__get('https://api.twitch.tv/helix/users', params, self.__get_helix_headers(), timelogs, 'get_users')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/helix/users', params, timelogs, 'get_users')
+        if ((r != False) and (r.status_code == 200)):
             results = r.json()
             for row in results['data']:
                 users.add_from_api(row)
-        self.__sleep(r.headers)
         return users, timelogs
 
     # for a given streamer, get the number of users following them
     def scrape_num_followers(self, streamer_id, timelogs):
         num_followers = -1
         params = {'to_id': streamer_id}
-        r, timelogs = self.__get('https://api.twitch.tv/helix/users/follows', params, self.__get_helix_headers(), timelogs, 'get_followers')
-        if (r.status_code == 200):
+        r, timelogs = self.__get(self.api_base_url + '/helix/users/follows', params, timelogs, 'get_followers')
+        if ((r != False) and (r.status_code == 200)):
             results = r.json()
             num_followers = results['total']
         return num_followers, timelogs
 
+    # gets the number of followers for every streamer in streamer_ids, keeping up to max_workers requests in flight
+    # returns a lookup table {streamer_id -> num_followers}
+    # -> timelogs is shared by all of the worker threads
+    # -> the workers are paced by the shared rate limit governor, so they can't starve the other procedures
+    def scrape_num_followers_concurrently(self, streamer_ids, timelogs, max_workers = 8, on_progress = False):
+        followers_lookup = {}
+        pool = WorkerPool(max_workers)
+
+        def scrape(streamer_id):
+            num_followers, _ = self.scrape_num_followers(streamer_id, timelogs)
+            return num_followers
+
+        for i, (streamer_id, num_followers) in enumerate(pool.map_unordered(scrape, streamer_ids)):
+            followers_lookup[streamer_id] = num_followers
+            if (on_progress != False):
+                on_progress(i + 1)
+        return followers_lookup, timelogs
+
+
+# Livestream Shards ------------------------------------------------------------
+
+# partitions /helix/streams by broadcaster language
+# -> a stream has exactly one broadcaster language, so the shards don't overlap
+# -> they only cover the languages listed here: a stream in any other language (ie: 'he', 'lt') is only seen if it's in the
+#    top 100 sample of crawl_livestreams_sharded(), where it's counted in num_missed_in_sample and added to the snapshot
+# -> so twitch_scraper_runner.py keeps the single cursor walk, which sees every stream
+# -> the biggest languages get their own cursor walk, the long tail shares one
+TWITCH_LANGUAGE_SHARDS = [
+    [('language', 'en')],
+    [('language', 'es')],
+    [('language', 'ru')],
+    [('language', 'de')],
+    [('language', 'pt')],
+    [('language', 'fr')],
+    [('language', 'ko'), ('language', 'ja')],
+    [('language', code) for code in ['zh', 'zh-hk', 'it', 'pl', 'tr', 'ar', 'th', 'cs', 'sv', 'nl', 'hu', 'fi', 'no', 'da', 'el', 'vi',
+                                     'id', 'ms', 'tl', 'ro', 'uk', 'sk', 'bg', 'hi', 'ca', 'asl', 'other']]
+]
+
+# partitions /helix/streams by game, one shard per batch of game_ids
+# -> game_id shards can't cover streams outside of game_ids, the missed-stream sample shows how much that costs
+def build_game_shards(game_ids, batch_size = 10):
+    shards = []
+    for i in range(0, len(game_ids), batch_size):
+        shards.append([('game_id', game_id) for game_id in game_ids[i:i + batch_size]])
+    return shards
+
+
+# every TwitchScraper in a process shares this, so the procedures don't re-fetch profiles another procedure just refreshed
+twitch_profile_freshness = ProfileFreshnessCache()
+
 
 # ==============================================================================
 # Class: TwitchScraper
@@ -500,17 +631,41 @@ class TwitchScraper():
         credentials = json.load(open('credentials.json'))
         self.twitch = TwitchAPI(credentials['twitch'])
         self.db = TwitchDB()
+        self.writer = get_db_writer(self.db) # <- every write goes through the process' one writer thread, see db_writer.py
         self.print_mode_on = False
         self.timelog_actions = []
+        self.num_follower_workers = 8      # <- max number of /helix/users/follows requests in flight at once
+        self.num_streamers_for_followers = 750
+        self.num_livestreams_to_compress = 5000 # <- max livestreams compressed per run, bounds how long compressing holds the write lock
+        self.livestream_shards = False     # <- list of filter lists for a sharded livestream crawl, False for a single cursor walk
+        self.profiles = twitch_profile_freshness
         return
 
     def set_print_mode(self, v):
         self.print_mode_on = v == True
 
+    # sets how many follower requests procedure_scrape_followers keeps in flight at once
+    def set_num_follower_workers(self, n):
+        self.num_follower_workers = max(1, int(n))
+
+    # makes procedure_scrape_livestream_snapshots crawl each shard with its own cursor walk, in parallel
+    # -> shards is a list of filter lists (ie: TWITCH_LANGUAGE_SHARDS), or False for a single cursor walk
+    def set_livestream_shards(self, shards):
+        self.livestream_shards = shards
+
+    # sets how many seconds a streamer profile stays fresh before the procedures fetch it again
+    # -> the cache is shared, so this applies to every TwitchScraper in the process
+    def set_profile_refresh_ttl(self, ttl):
+        self.profiles.set_ttl(ttl)
+
     def __print(self, message):
         if (self.print_mode_on == True):
             print(message)
 
+    # queues write(conn) for the db writer thread and returns right away
+    def __submit(self, kind, write, on_done = False):
+        return self.writer.submit(WriteBatch(kind, write, on_done))
+
 
     # Procedure: Scrape Livestreams --------------------------------------------
 
@@ -523,37 +678,40 @@ class TwitchScraper():
             'num_livestreams_no_viewers':  0,
             'num_streamers_inserted':      0,
             'num_streamers_updated':       0,
+            'num_streamers_changed':       0,
+            'num_streamers_unchanged':     0,
             'num_game_snapshots_inserted': 0,
             'num_games_inserted':          0,
-            'num_tags_inserted':           0
+            'num_tags_inserted':           0,
+            'num_profiles_fresh':          0,
+            'num_profiles_in_flight':      0,
+            'num_profiles_fetched':        0,
+            'profile_cache_hit_rate':      0
         }
 
         # Phase 1: check what resources the db already has ---------------------
 
-        conn = self.db.get_connection()
+        # -> the known game and tag ids are KnownIDSets shared with the other procedures, only the rows added since the last run are read
+        conn = self.db.get_reader_connection()
         known_game_ids     = self.db.get_all_game_ids(conn)
         known_tag_ids      = self.db.get_all_tag_ids(conn)
-        known_streamer_ids = self.db.get_all_streamer_ids(conn)
-        conn.close()
+        self.profiles.seed(lambda: self.db.get_streamers_scraped_since(conn, self.profiles.get_cutoff()))
+        self.db.release_connection(conn)
 
 
         # Phase 2: Scrape Twitch API for livestreams and related resources -----
 
         self.__print('\nScraping Data ----------------------------------------')
 
-        # 2.a) Scrape for all livestreams
-        livestreams, cursor, timelogs = TwitchLivestreamSnapshots(), False, TimeLogs(self.timelog_actions)
-        num_old_livestreams, page_num = 0, 0
-        self.__print('Scraping Livestreams...')
-        while True:
-            self.__print('Page: ' + str(page_num) + ' -> ' + str(num_old_livestreams) + ' livestreams seen')
-            livestreams, cursor, timelogs = self.twitch.scrape_livestreams(livestreams, cursor, timelogs)
-
-            num_livestreams = livestreams.get_num_livestreams()
-            if ((cursor == False) or (num_old_livestreams == num_livestreams)):
-                break
-            num_old_livestreams = num_livestreams
-            page_num += 1
+        # 2.a) Scrape for all livestreams, either with one cursor walk or with parallel sharded walks
+        livestreams, timelogs = TwitchLivestreamSnapshots(), TimeLogs(self.timelog_actions)
+        if (self.livestream_shards == False):
+            self.__print('Scraping Livestreams...')
+            livestreams, timelogs = self.crawl_livestreams(livestreams, timelogs)
+        else:
+            self.__print('Scraping Livestreams in ' + str(len(self.livestream_shards)) + ' shards...')
+            livestreams, shard_stats, timelogs = self.crawl_livestreams_sharded(self.livestream_shards, timelogs)
+            stats.update(shard_stats)
         self.__print('Scraping Livestreams complete!\n')
 
 
@@ -584,9 +742,11 @@ class TwitchScraper():
             new_tags, timelogs = self.twitch.scrape_tags(batch_of_ids, new_tags, timelogs)
         self.__print('Scraping tags complete\n')
 
-        # 2.d) Scrape all user profiles for streamers that have enough viewers
+        # 2.d) Scrape user profiles for streamers that have enough viewers
+        # -> profiles that were refreshed recently, or that another procedure is fetching right now, are skipped
         streamers = TwitchStreamers()
-        streamer_ids_to_scrape  = livestreams.get_streamer_ids_with_more_than_n_views(3)
+        streamer_ids_to_scrape, profile_stats = self.profiles.claim(livestreams.get_streamer_ids_with_more_than_n_views(3))
+        stats.update(self.__get_profile_cache_stats(profile_stats))
         streamer_ids_in_batches = self.__break_list_into_batches(streamer_ids_to_scrape, 100)
         self.__print('Scraping ' + str(len(streamer_ids_to_scrape)) + ' streamer profiles in ' + str(len(streamer_ids_in_batches)) + ' batches...')
         for i, batch_of_ids in enumerate(streamer_ids_in_batches):
@@ -595,54 +755,68 @@ class TwitchScraper():
         self.__print('Scraping streamer profiles complete')
 
 
-        # Phase 3: Commit everything to the database ---------------------------
+        # Phase 3: Queue everything for the db writer --------------------------
+        # -> the batches are written in this order on the writer thread, this thread doesn't wait for them
 
         self.__print('\nSaving Data ------------------------------------------')
-        conn = self.db.get_connection()
-
-        # save streamer profiles
-        self.__print('Inserting streamers into db...')
-        for streamer_id in streamers.get_streamer_ids():
-            streamer = streamers.get(streamer_id)
-            if (streamer_id not in known_streamer_ids):
-                self.db.insert_new_streamer(conn, streamer)
-                stats['num_streamers_inserted'] += 1
-            else:
-                self.db.update_streamer(conn, streamer)
-                stats['num_streamers_updated'] += 1
-
-            # add time-series data for streamers
-            self.db.insert_total_views_for_streamer(conn, streamer)
-            self.db.insert_broadcaster_type_for_streamer(conn, streamer)
-
-        # save games
-        self.__print('Inserting games into db...')
-        for game_id in new_games.get_game_ids():
-            game = new_games.get(game_id)
-            self.db.insert_game(conn, game)
-            stats['num_games_inserted'] += 1
 
-
-        # save platform stats
-        self.__print('Inserting game snapshots into db...')
-        for game_id, game in game_platform_stats.items():
-            self.db.insert_game_snapshot(conn, game)
-            stats['num_game_snapshots_inserted'] += 1
+        # save streamer profiles and their time-series data
+        # -> the profile hashes of just these streamers are read on the writer's connection, they also tell which streamers are new
+        all_streamers = [streamers.get(streamer_id) for streamer_id in streamers.get_streamer_ids()]
+
+        def write_streamers(conn):
+            known_streamers    = self.db.get_streamer_profile_hashes(conn, [streamer.id for streamer in all_streamers])
+            new_streamers      = [streamer for streamer in all_streamers if (streamer.id not in known_streamers)]
+            existing_streamers = [streamer for streamer in all_streamers if (streamer.id in known_streamers)]
+            stats['num_streamers_inserted'] += len(new_streamers)
+            stats['num_streamers_updated']  += len(existing_streamers)
+            self.db.insert_new_streamers(conn, new_streamers)
+            num_changed = self.db.update_streamers_if_changed(conn, existing_streamers, known_streamers)
+            stats['num_streamers_changed']   += num_changed
+            stats['num_streamers_unchanged'] += len(existing_streamers) - num_changed
+            self.db.insert_total_views_for_streamers(conn, all_streamers)
+            self.db.insert_broadcaster_types_for_streamers(conn, all_streamers)
+
+        # profiles are only marked as fresh once they're committed, claims are released either way
+        def on_streamers_done(committed):
+            self.profiles.complete(streamer_ids_to_scrape, streamers.get_streamer_ids() if (committed) else [])
+
+        self.__print('Queueing streamers for the db...')
+        self.__submit('streamers', write_streamers, on_streamers_done)
+
+        # save games and platform stats
+        games_to_insert = [new_games.get(game_id) for game_id in new_games.get_game_ids()]
+        stats['num_games_inserted']          += len(games_to_insert)
+        stats['num_game_snapshots_inserted'] += len(game_platform_stats)
+
+        def write_games(conn):
+            self.db.insert_games(conn, games_to_insert)
+            self.db.insert_game_snapshots(conn, game_platform_stats.values())
+
+        # committed games are known from now on, without waiting for the next refresh
+        def on_games_done(committed):
+            if (committed):
+                known_game_ids.add([int(game.id) for game in games_to_insert])
+
+        self.__print('Queueing games and game snapshots for the db...')
+        self.__submit('games', write_games, on_games_done)
 
         # save twitch tags
-        self.__print('Inserting twitch tags into db...')
-        for tag_id in new_tags.get_tag_ids():
-            tag = new_tags.get(tag_id)
-            self.db.insert_tag(conn, tag)
-            stats['num_tags_inserted'] += 1
+        tags_to_insert = [new_tags.get(tag_id) for tag_id in new_tags.get_tag_ids()]
+        stats['num_tags_inserted'] += len(tags_to_insert)
+
+        def on_tags_done(committed):
+            if (committed):
+                known_tag_ids.add([tag.id for tag in tags_to_insert])
 
+        self.__print('Queueing twitch tags for the db...')
+        self.__submit('tags', lambda conn: self.db.insert_tags(conn, tags_to_insert), on_tags_done)
 
         # save livestreams
-        self.__print('Inserting livestreams into db...')
-        for livestream_id in livestreams.get_livestream_ids_with_more_than_n_views(3):
-            livestream = livestreams.get(livestream_id)
-            self.db.insert_livestream_snapshot(conn, livestream)
-            stats['num_livestreams_inserted'] += 1
+        livestreams_to_insert = [livestreams.get(livestream_id) for livestream_id in livestreams.get_livestream_ids_with_more_than_n_views(3)]
+        stats['num_livestreams_inserted'] += len(livestreams_to_insert)
+        self.__print('Queueing livestreams for the db...')
+        self.__submit('snapshots', lambda conn: self.db.insert_livestream_snapshots(conn, livestreams_to_insert))
 
 
         # Phase 4: Save logs to the database -----------------------------------
@@ -650,22 +824,109 @@ class TwitchScraper():
         self.__print('\nSaving Logs ------------------------------------------')
         stats['num_livestreams']            = livestreams.get_num_livestreams()
         stats['num_livestreams_no_viewers'] = len(livestreams.get_livestream_ids_with_no_viewers())
-
-        self.__print('Inserting scraping logs into db...')
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
-        stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-livestreams', time_started, timelog_str, stats_str)
 
-        conn.commit()
-        conn.close()
+        # written after the batches above, so the stats they fill in (ie: num_streamers_changed) are in the log
+        def write_logs(conn):
+            self.db.insert_logs(conn, 'scrape-livestreams', time_started, timelog_str, json.dumps(stats))
+            self.__print('\nStats:')
+            for k, v in stats.items():
+                self.__print(k + ': ' + str(v))
 
-        self.__print('\nStats:')
-        for k, v in stats.items():
-            self.__print(k + ': ' + str(v))
+        self.__print('Queueing scraping logs for the db...')
+        self.__submit('logs', write_logs)
         self.__print('\nScrape Livestreams Procedure completed!\n')
         return
 
 
+    # walks every page of /helix/streams and adds the livestreams to a TwitchLivestreamSnapshots object
+    # the crawl is pipelined into 2 stages so network time and parse time overlap:
+    # -> producer (worker thread): requests the next page as soon as it has the cursor from the previous one
+    # -> consumer (this thread):   builds TwitchLivestreamSnapshot objects from the pages the producer hands it
+    # the crawl stops when there is no cursor left, or when a page doesn't add any new livestreams
+    # -> filters restricts the crawl to a subset of livestreams (see TwitchAPI.fetch_livestreams_page)
+    def crawl_livestreams(self, livestreams, timelogs, filters = False):
+        pages  = queue.Queue(maxsize = 1) # <- one page waiting and one in flight at most, so a stop wastes 2 requests at most
+        stop   = threading.Event()
+        errors = []
+
+        def produce():
+            cursor = False
+            try:
+                while (not stop.is_set()):
+                    items, cursor, _ = self.twitch.fetch_livestreams_page(cursor, timelogs, filters)
+                    if (stop.is_set()):
+                        break # <- the consumer stopped while this page was in flight, it would only be drained
+                    pages.put(items)
+                    if ((cursor == False) or (len(items) == 0)):
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pages.put(None) # <- tells the consumer there are no more pages
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+
+        page_num = 0
+        while True:
+            timelogs.start_action('wait_for_livestreams_page')
+            items = pages.get()
+            timelogs.end_action('wait_for_livestreams_page')
+            if (items is None):
+                break
+            if (stop.is_set()):
+                continue # <- drain pages the producer fetched before it saw the stop signal
+
+            num_old_livestreams = livestreams.get_num_livestreams()
+            self.__print('Page: ' + str(page_num) + ' -> ' + str(num_old_livestreams) + ' livestreams seen')
+            timelogs.start_action('parse_livestreams_page')
+            for item in items:
+                livestreams.add_from_api(item)
+            timelogs.end_action('parse_livestreams_page')
+
+            if (num_old_livestreams == livestreams.get_num_livestreams()):
+                stop.set()
+            page_num += 1
+
+        producer.join()
+        if (len(errors) > 0):
+            raise errors[0]
+        return livestreams, timelogs
+
+
+    # runs an independent cursor walk for each shard in parallel, then merges them into one TwitchLivestreamSnapshots object
+    # -> shards is a list of filter lists, ie: [[('language', 'en')], [('language', 'es'), ('language', 'pt')]]
+    # -> the first page of an unfiltered walk (the top 100 livestreams) is fetched as a sample to estimate missed livestreams
+    # returns (livestreams, shard_stats, timelogs)
+    def crawl_livestreams_sharded(self, shards, timelogs):
+        shard_stats = {'num_shards': len(shards), 'num_shard_overlaps': 0, 'num_missed_in_sample': 0, 'sample_size': 0}
+
+        def crawl(shard_index):
+            if (shard_index == -1):
+                items, _, _ = self.twitch.fetch_livestreams_page(False, timelogs)
+                return items
+            shard_livestreams, _ = self.crawl_livestreams(TwitchLivestreamSnapshots(), timelogs, shards[shard_index])
+            return shard_livestreams
+
+        # -1 is the sample walk
+        results = WorkerPool(len(shards) + 1).map(crawl, [-1] + list(range(len(shards))))
+
+        # merge and dedupe shards
+        livestreams = TwitchLivestreamSnapshots()
+        for shard_index in range(len(shards)):
+            shard_stats['num_shard_overlaps'] += livestreams.merge(results[shard_index])
+
+        # livestreams in the top 100 that none of the shards found (ie: a language no shard lists) are added from the sample
+        for item in results[-1]:
+            shard_stats['sample_size'] += 1
+            if (livestreams.get(int(item['id'])) == False):
+                shard_stats['num_missed_in_sample'] += 1
+                livestreams.add_from_api(item)
+
+        return livestreams, shard_stats, timelogs
+
+
     # get viewership statistics about games on Twitch
     # creates a lookup {game_id -> StatsBucket }
     def get_platform_stats_for_games(self, livestreams):
@@ -680,6 +941,15 @@ class TwitchScraper():
                 stats[game_id].add(num_viewers)
         return stats
 
+    # converts the run stats from ProfileFreshnessCache.claim() into procedure stats
+    def __get_profile_cache_stats(self, profile_stats):
+        return {
+            'num_profiles_fresh':     profile_stats['num_fresh'],
+            'num_profiles_in_flight': profile_stats['num_in_flight'],
+            'num_profiles_fetched':   profile_stats['num_claimed'],
+            'profile_cache_hit_rate': ProfileFreshnessCache.get_hit_rate(profile_stats)
+        }
+
     # takes in a list of datapoints and breaks it into a list of lists, each size <= batch_size
     def __break_list_into_batches(self, list_of_data, batch_size):
         batches = []
@@ -697,14 +967,16 @@ class TwitchScraper():
 
         self.__print('Starting Scrape Inactive procedure!')
         time_started = int(time.time())
-        stats = {'num_streamers_updated': 0}
+        stats = {'num_streamers_updated': 0, 'num_streamers_changed': 0, 'num_streamers_unchanged': 0}
         timelogs = TimeLogs(self.timelog_actions)
 
         # Phase 1: Get a list of streamers that are "inactive" -----------------
 
-        conn = self.db.get_connection()
-        streamer_ids = self.db.get_inactive_streamer_ids(conn)
-        conn.close()
+        conn = self.db.get_reader_connection()
+        self.profiles.seed(lambda: self.db.get_streamers_scraped_since(conn, self.profiles.get_cutoff()))
+        streamer_ids, profile_stats = self.profiles.claim(self.db.get_inactive_streamer_ids(conn))
+        stats.update(self.__get_profile_cache_stats(profile_stats))
+        self.db.release_connection(conn)
 
         # Phase 2: Scrape info for each streamer in our list -------------------
 
@@ -716,30 +988,33 @@ class TwitchScraper():
         self.__print('Finished scraping streamer profiles')
 
 
-        # Phase 3: Save streamer info to the database --------------------------
+        # Phase 3: Queue streamer info for the db writer -----------------------
+
+        all_streamers = [streamers.get(streamer_id) for streamer_id in streamers.get_streamer_ids()]
+        stats['num_streamers_updated'] += len(all_streamers)
+
+        # save streamer profiles and their time-series data
+        # -> the profile hashes are read on the writer's connection, so they include anything written since phase 1
+        def write_streamers(conn):
+            known_streamers = self.db.get_streamer_profile_hashes(conn, [streamer.id for streamer in all_streamers])
+            num_changed = self.db.update_streamers_if_changed(conn, all_streamers, known_streamers)
+            stats['num_streamers_changed']   += num_changed
+            stats['num_streamers_unchanged'] += len(all_streamers) - num_changed
+            self.db.insert_total_views_for_streamers(conn, all_streamers)
+            self.db.insert_broadcaster_types_for_streamers(conn, all_streamers)
 
-        conn = self.db.get_connection()
-        # save streamer profiles
-        self.__print('Inserting streamers into db...')
-        for streamer_id in streamers.get_streamer_ids():
-            streamer = streamers.get(streamer_id)
-            self.db.update_streamer(conn, streamer)
-            stats['num_streamers_updated'] += 1
+        def on_streamers_done(committed):
+            self.profiles.complete(streamer_ids, streamers.get_streamer_ids() if (committed) else [])
 
-            # add time-series data for streamers
-            self.db.insert_total_views_for_streamer(conn, streamer)
-            self.db.insert_broadcaster_type_for_streamer(conn, streamer)
+        self.__print('Queueing streamers for the db...')
+        self.__submit('streamers', write_streamers, on_streamers_done)
 
 
         # Phase 4: Log this scraping procedure to database ---------------------
 
-        self.__print('Inserting scraping logs into db...')
+        self.__print('Queueing scraping logs for the db...')
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
-        stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-inactive', time_started, timelog_str, stats_str)
-
-        conn.commit()
-        conn.close()
+        self.__submit('logs', lambda conn: self.db.insert_logs(conn, 'scrape-inactive', time_started, timelog_str, json.dumps(stats)))
         self.__print('Scrape Inactive procedure finished!')
         return
 
@@ -750,42 +1025,44 @@ class TwitchScraper():
 
         self.__print('Starting Scrape Followers procedure!')
         time_started = int(time.time())
-        stats = {'num_streamers_inserted': 0}
+        stats = {'num_streamers_inserted': 0, 'num_streamers_failed': 0}
         timelogs = TimeLogs(self.timelog_actions)
 
         # Phase 1: Get a list of streamers that need follower counts -----------
 
-        conn = self.db.get_connection()
-        streamer_ids = self.db.get_streamer_ids_that_need_follower_data(conn, 750)
-        conn.close()
+        conn = self.db.get_reader_connection()
+        streamer_ids = self.db.get_streamer_ids_that_need_follower_data(conn, self.num_streamers_for_followers)
+        self.db.release_connection(conn)
 
         # Phase 2: Scrape followers from API -----------------------------------
 
-        self.__print('Scraping follower counts for ' + str(len(streamer_ids)) + ' streamers...')
-        followers_lookup = {} # <- {streamer_id -> num_followers}
-        for i, streamer_id in enumerate(streamer_ids):
-            num_followers, timelogs = self.twitch.scrape_num_followers(streamer_id, timelogs)
-            followers_lookup[streamer_id] = num_followers
-            if (i % 25 == 0):
-                self.__print('scraped ' + str(i) + ' out of ' + str(len(streamer_ids)))
+        self.__print('Scraping follower counts for ' + str(len(streamer_ids)) + ' streamers with ' + str(self.num_follower_workers) + ' workers...')
+
+        def print_progress(num_scraped):
+            if (num_scraped % 25 == 0):
+                self.__print('scraped ' + str(num_scraped) + ' out of ' + str(len(streamer_ids)))
+
+        # followers_lookup = {streamer_id -> num_followers}
+        followers_lookup, timelogs = self.twitch.scrape_num_followers_concurrently(streamer_ids, timelogs, self.num_follower_workers, print_progress)
 
-        # Phase 3: Commit follower counts to the database ----------------------
+        # Phase 3: Queue follower counts for the db writer --------------------
 
-        self.__print('Commiting follower counts to database...')
-        conn = self.db.get_connection()
+        self.__print('Queueing follower counts for the db...')
+        followers = []
         for streamer_id, num_followers in followers_lookup.items():
-            self.db.insert_followers_count(conn, streamer_id, num_followers)
-            stats['num_streamers_inserted'] += 1
+            if (num_followers < 0):
+                stats['num_streamers_failed'] += 1 # <- request failed, this streamer will be picked up again next run
+                continue
+            followers.append((streamer_id, num_followers))
+        self.__submit('followers', lambda conn: self.db.insert_followers_counts(conn, followers))
+        stats['num_streamers_inserted'] += len(followers)
 
         # Phase 4: Save logs to the database -----------------------------------
 
-        self.__print('Inserting scraping logs into db...')
+        self.__print('Queueing scraping logs for the db...')
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
         stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'scrape-followers', time_started, timelog_str, stats_str)
-
-        conn.commit()
-        conn.close()
+        self.__submit('logs', lambda conn: self.db.insert_logs(conn, 'scrape-followers', time_started, timelog_str, stats_str))
 
         self.__print('Scrape Followers Procedure complete!')
         return
@@ -797,97 +1074,56 @@ class TwitchScraper():
 
         self.__print('Starting Compress Livestreams procedure!')
         time_started = int(time.time())
-        stats = {'num_snapshots': 0, 'num_livestream_ids': 0, 'num_livestream_objs': 0}
+        stats = {'num_snapshots': 0, 'num_livestream_ids': 0, 'num_livestream_objs': 0, 'seconds_writing': 0}
         timelogs = TimeLogs(self.timelog_actions)
-
-
-        # Phase 1: Get list of livestream_snapshots to be processed ------------
-
-        conn = self.db.get_connection()
-        livestream_snapshots = {}
-        for livestream_id in self.db.get_livestream_snapshot_ids_to_compress(conn, 5000):
-            snapshots = self.db.get_all_livestream_snapshots_with_id(conn, livestream_id)
-            livestream_snapshots[livestream_id] = snapshots
-            stats['num_snapshots'] += len(snapshots)
-        conn.close()
-
-
-        # Phase 2: Compress snapshots ------------------------------------------
-
-        compressed_livestreams = []
-        livestream_ids         = []
-        for id, snapshots in livestream_snapshots.items():
-            for compressed_obj in self.__compress_snapshots(snapshots):
-                db_obj = self.__compressed_livestream_to_db_tuple(compressed_obj)
-                compressed_livestreams.append(db_obj)
-            livestream_ids.append(id)
-
-        stats['num_livestream_ids']  = len(livestream_ids)
-        stats['num_livestream_objs'] = len(compressed_livestreams)
-
-        # Phase 3: Modify database (Delete/Insert) -----------------------------
-
-        conn = self.db.get_connection()
-        for db_tuple in compressed_livestreams:
-            self.db.insert_livestream(conn, db_tuple)
-        for livestream_id in livestream_ids:
-            self.db.delete_livestream_snapshots(conn, livestream_id)
-
-        # Phase 4: Save Logs to Database ---------------------------------------
-
-        self.__print('Inserting scraping logs into db...')
+        date_cutoff = int(time.time()) - (1 * 60 * 60 * 24 * 2) # <- 2 days ago
+
+        # compressing reads and deletes the same snapshots, so all of it runs as one batch on the db writer,
+        # inside the writer's transaction, bounded by num_livestreams_to_compress
+        def write_livestreams(conn):
+            writing_started = time.time()
+
+            # 1) select livestreams and compress their snapshots
+            # -> the snapshots are read in one scan ordered by (livestream_id, date_scraped) and grouped as they stream in
+            stats['num_livestream_ids'] = self.db.select_livestreams_to_compress(conn, date_cutoff, self.num_livestreams_to_compress)
+            compressed_livestreams = []
+            for livestream_id, snapshots in itertools.groupby(self.db.get_snapshots_to_compress(conn), key=lambda row: row[0]):
+                for compressed_obj in self.__compress_snapshots(snapshots):
+                    compressed_livestreams.append(self.__compressed_livestream_to_db_tuple(compressed_obj))
+            stats['num_livestream_objs'] = len(compressed_livestreams)
+
+            # 2) modify database (insert/delete)
+            self.db.insert_livestreams(conn, compressed_livestreams)
+            stats['num_snapshots'] = self.db.delete_compressed_livestream_snapshots(conn)
+            stats['seconds_writing'] = round(time.time() - writing_started, 3)
+
+        self.__submit('livestreams', write_livestreams)
+
+        # save logs to database, after the livestreams batch has filled in stats
+        self.__print('Queueing scraping logs for the db...')
         timelog_str = json.dumps(timelogs.get_stats_from_logs())
-        stats_str   = json.dumps(stats)
-        self.db.insert_logs(conn, 'compress-livestreams', time_started, timelog_str, stats_str)
-
-        conn.commit()
-        conn.close()
+        self.__submit('logs', lambda conn: self.db.insert_logs(conn, 'compress-livestreams', time_started, timelog_str, json.dumps(stats)))
         return
 
 
-    # given a list of snapshots from db.get_all_livestream_snapshots_with_id(),
+    # given the snapshot rows of one livestream ordered by date_scraped (from db.get_snapshots_to_compress()),
     # compresses snapshots into individual livestream objects based on (livestream_id, game_id, date_started)
     # -> this means that if a streamer played games [A, B, A]
     def __compress_snapshots(self, snapshots):
-
-        # 1) sort snapshots by date_scraped value
-        sorted_snapshots = sorted(snapshots, key=lambda k: k['date_scraped'])
-
-        # 2) Break snapshots list into sublists by game_id
-        sublists = []
-        current_game_id = None
-        for snapshot in sorted_snapshots:
-            if (current_game_id is None or snapshot['game_id'] != current_game_id):
-                current_game_id = snapshot['game_id']
-                sublists.append([])
-            sublists[-1].append(snapshot)
-
-        # 3) Compress each sublist
         compressed_livestreams = []
-        for sublist in sublists:
-            id           = sublist[0]['livestream_id']
-            date_started = sublist[0]['date_scraped']
-            date_ended   = sublist[-1]['date_scraped']
-            min_views    = None
-            max_views    = None
-            views        = []
-            for snapshot in sublist:
-                views.append(snapshot['viewers'])
-                if (max_views is None or snapshot['viewers'] > max_views):
-                    max_views = snapshot['viewers']
-                if (min_views is None or snapshot['viewers'] < min_views):
-                    min_views = snapshot['viewers']
-
+        for game_id, sublist in itertools.groupby(snapshots, key=lambda row: row[2]):
+            sublist = list(sublist)
+            views   = [row[3] for row in sublist]
             compressed_livestreams.append({
-                'livestream_id': sublist[0]['livestream_id'],
-                'streamer_id'  : sublist[0]['streamer_id'],
-                'game_id'      : sublist[0]['game_id'],
-                'date_started' : date_started,
-                'date_ended'   : date_ended,
-                'tag_ids'      : sublist[0]['tag_ids'],
-                'language'     : sublist[0]['language'],
-                'max_viewers'  : max_views,
-                'min_viewers'  : min_views,
+                'livestream_id': sublist[0][0],
+                'streamer_id'  : sublist[0][1],
+                'game_id'      : game_id,
+                'date_started' : sublist[0][4],
+                'date_ended'   : sublist[-1][4],
+                'tag_set_id'   : sublist[0][5],
+                'language'     : sublist[0][6],
+                'max_viewers'  : max(views),
+                'min_viewers'  : min(views),
                 'viewer_counts': views
             })
         return compressed_livestreams
@@ -901,9 +1137,9 @@ class TwitchScraper():
             c['game_id'],
             c['date_started'],
             c['date_ended'],
-            json.dumps(c['tag_ids']),
+            c['tag_set_id'],
             c['language'],
             c['max_viewers'],
             c['min_viewers'],
-            json.dumps(c['viewer_counts'])
+            encode_viewer_counts(c['viewer_counts'])
         )
@@ -55,6 +55,22 @@ __sleep = {
 }
 
 
+# HTTP Related Variables -------------------------------------------------------
+
+# number of /helix/users/follows requests the followers thread keeps in flight at once
+__num_follower_workers = 8
+
+# the livestreams thread runs one cursor walk per shard in parallel (plus a sample walk), or a single cursor walk when False
+# -> stays False: TWITCH_LANGUAGE_SHARDS only covers the languages it lists, the single walk sees every stream
+__livestream_shards = False
+
+# streamer profiles refreshed less than this many seconds ago aren't fetched again by the livestreams or inactive threads
+__profile_refresh_ttl = 60 * 60
+
+# every thread shares one keep-alive connection pool per host, so size it to the most requests that can be in flight at once
+__http_pool_size = len(__sleep) + __num_follower_workers + (len(__livestream_shards) if (__livestream_shards != False) else 0) + 1
+
+
 # Scraper Health Variables -----------------------------------------------------
 
 # for keeping track of process IDs so only 1 version of the scraper can ever run
@@ -80,10 +96,15 @@ if (args.twilio):
 
 # Functions for Threads --------------------------------------------------------
 
-def thread_scrape_procedure(thread_id, scraping_procedure):
+def thread_scrape_procedure(thread_id, scraping_procedure, db):
     while(True):
         print_from_thread(thread_id, "starting work")
         scraping_procedure()
+        print_from_thread(thread_id, "connection pools: " + json.dumps(shared_http_sessions.get_stats()))
+        print_from_thread(thread_id, "helix rate limit: " + json.dumps(helix_rate_limit_governor.get_stats()))
+        print_from_thread(thread_id, "profile cache: " + json.dumps(twitch_profile_freshness.get_stats()))
+        print_from_thread(thread_id, "twitch.db: " + json.dumps(db.get_stats()))
+        print_from_thread(thread_id, "db writer: " + json.dumps(get_db_writer(db).get_stats()))
         print_from_thread(thread_id, "sleeping")
         for i in range(__sleep[thread_id]):
             if (thread_status[thread_id] == 'end'):
@@ -104,10 +125,13 @@ def create_worker_thread(thread_id):
 
     # create the scraper for this thread
     twitch_scraper = TwitchScraper()
+    twitch_scraper.set_profile_refresh_ttl(__profile_refresh_ttl)
     procedure_to_run = False
     if (thread_id == __thread_id_livestream_snapshots):
+        twitch_scraper.set_livestream_shards(__livestream_shards)
         procedure_to_run = twitch_scraper.procedure_scrape_livestream_snapshots
     elif (thread_id == __thread_id_followers):
+        twitch_scraper.set_num_follower_workers(__num_follower_workers)
         procedure_to_run = twitch_scraper.procedure_scrape_followers
     elif (thread_id == __thread_id_inactive):
         procedure_to_run = twitch_scraper.procedure_scrape_inactive
@@ -118,7 +142,7 @@ def create_worker_thread(thread_id):
         return
 
     # run the thread
-    worker_threads[thread_id] = threading.Thread(target=thread_scrape_procedure, args=(thread_id, procedure_to_run))
+    worker_threads[thread_id] = threading.Thread(target=thread_scrape_procedure, args=(thread_id, procedure_to_run, twitch_scraper.db))
     thread_status[thread_id]  = 'live'
     worker_threads[thread_id].start()
     return
@@ -144,6 +168,9 @@ def stop_scraper(sig, frame):
         worker_threads[thread_id].join()
         print_from_thread(thread_id, "terminated")
 
+    # write everything the threads queued before they stopped
+    print('waiting for the db writer to commit queued writes...')
+    stop_db_writers()
     print('shut down complete!\n')
     sys.exit(0)
 
@@ -208,6 +235,9 @@ def run():
         sys.exit(0)
     atexit.register(on_program_shutdown)
 
+    # size the shared connection pools before any thread makes a request
+    shared_http_sessions.set_pool_size(__http_pool_size)
+
     # initialize databases if need be
     twitch_db = TwitchDB()
     twitch_db.create_tables()
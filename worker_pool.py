@@ -0,0 +1,111 @@
+# ==============================================================================
+# About: worker_pool.py
+# ==============================================================================
+#
+# worker_pool.py contains helpers for running API requests concurrently
+# - WorkerPool      - a bounded pool of worker threads that keeps many requests in flight at once
+# - InFlightLookups - coalesces duplicate lookups (ie: the same game) that worker threads make at the same time
+#
+
+# Imports ----------------------------------------------------------------------
+
+import sys
+import threading
+import concurrent.futures
+
+
+# ==============================================================================
+# Class: WorkerPool
+# ==============================================================================
+
+# WorkerPool runs a function over a list of items using at most max_workers threads
+# -> the function is expected to be thread-safe (ie: TwitchAPI/MixerAPI requests)
+# -> results are yielded as soon as they finish, so callers can process them while other requests are in flight
+class WorkerPool():
+
+    def __init__(self, max_workers = 8):
+        self.max_workers = max(1, int(max_workers))
+        return
+
+    # runs fn(item) for every item, yields (item, result) tuples in the order they complete
+    # -> if fn raises an exception, it is re-raised once the remaining work is cancelled
+    def map_unordered(self, fn, items):
+        items = list(items)
+        if (len(items) == 0):
+            return
+
+        num_workers = min(self.max_workers, len(items))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {}
+            for item in items:
+                futures[executor.submit(fn, item)] = item
+
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        return
+
+    # runs fn(item) for every item and returns a lookup table of {item -> result}
+    def map(self, fn, items):
+        results = {}
+        for item, result in self.map_unordered(fn, items):
+            results[item] = result
+        return results
+
+
+# ==============================================================================
+# Class: InFlightLookups
+# ==============================================================================
+
+# InFlightLookups makes sure a lookup for the same key only runs once, even if many threads ask for it at the same time
+# -> threads that ask for a key that is already being looked up wait for that lookup instead of starting their own (coalesced)
+# -> results are kept for the life of the object (ie: one scraping procedure), later calls get them from the cache
+# -> a lookup that fails (returns False or raises) isn't kept, the threads waiting on it get False and the next call tries again
+class InFlightLookups():
+
+    def __init__(self):
+        self.results   = {} # <- lookup table of {key: result} for lookups that finished without failing
+        self.in_flight = {} # <- lookup table of {key: threading.Event} for lookups that are running
+        self.lock      = threading.Lock()
+        self.stats     = {'num_lookups': 0, 'num_coalesced': 0, 'num_cached': 0, 'num_failed': 0}
+        return
+
+    # returns fn() for this key, running fn once unless it fails
+    def get(self, key, fn):
+        with self.lock:
+            if (key in self.results):
+                self.stats['num_cached'] += 1
+                return self.results[key]
+            if (key in self.in_flight):
+                self.stats['num_coalesced'] += 1 # <- only joins on a lookup that's still running count as coalesced
+                event, is_owner = self.in_flight[key], False
+            else:
+                self.stats['num_lookups'] += 1
+                event, is_owner = threading.Event(), True
+                self.in_flight[key] = event
+
+        # another thread is already running this lookup, wait for its result
+        if (not is_owner):
+            event.wait()
+            with self.lock:
+                return self.results.get(key, False)
+
+        result = False
+        try:
+            result = fn()
+        finally:
+            with self.lock:
+                if (result != False):
+                    self.results[key] = result
+                else:
+                    self.stats['num_failed'] += 1
+                del self.in_flight[key]
+            event.set()
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)